@@ -0,0 +1,95 @@
+from typing import Any, Dict, Optional
+
+import typer
+from typing_extensions import Annotated
+
+from benchmarks.harness import compare_results, format_time, load_results, run_benchmarks, write_results
+
+app = typer.Typer(help="Microbenchmarks of the hot paths of prepare assignment, they don't need network access")
+
+
+@app.command()
+def run(
+    output: Annotated[
+        Optional[str],
+        typer.Option("--output", "-o", help="Write the results to this file (JSON)", show_default=False)
+    ] = None,
+    pattern: Annotated[
+        Optional[str],
+        typer.Option("--filter", "-k", help="Only run the benchmarks whose name matches this regular expression",
+                     show_default=False)
+    ] = None,
+    repeat: Annotated[
+        int,
+        typer.Option("--repeat", "-r", min=1, help="number of times every benchmark is timed")
+    ] = 5,
+    min_time: Annotated[
+        float,
+        typer.Option("--min-time", min=0, help="minimum time (in seconds) of every repetition")
+    ] = 0.2,
+):
+    """
+    Run the benchmarks
+    """
+    # The workloads import the core, only do so when the benchmarks actually run
+    from benchmarks.workloads import BENCHMARKS
+
+    def on_result(name: str, stats: Dict[str, Any]) -> None:
+        typer.echo(f"{name:<24} {format_time(stats['median']):>10} ± {format_time(stats['stdev']):>10} "
+                   f"({stats['loops']} loops)")
+
+    results = run_benchmarks(BENCHMARKS, pattern, repeat, min_time, on_result)
+    if len(results["benchmarks"]) == 0:
+        typer.echo("No benchmarks match the filter", err=True)
+        raise typer.Exit(code=1)
+    if output is not None:
+        write_results(results, output)
+
+
+@app.command()
+def compare(
+    base: Annotated[str, typer.Argument(help="Results to compare against, e.g. of the main branch")],
+    new: Annotated[str, typer.Argument(help="New results")],
+    threshold: Annotated[
+        float,
+        typer.Option("--threshold", "-t", min=0, help="relative slowdown that counts as a regression")
+    ] = 0.1,
+    stat: Annotated[
+        str,
+        typer.Option("--stat", help="statistic to compare: min, median or mean, the minimum is the least noisy")
+    ] = "min",
+):
+    """
+    Compare two results files, the exit code is 1 if a benchmark became slower than the threshold allows
+    """
+    if stat not in ("min", "median", "mean"):
+        raise typer.BadParameter("Must be one of min, median or mean", param_hint="--stat")
+    try:
+        base_results = load_results(base)
+        new_results = load_results(new)
+    except (OSError, ValueError) as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(code=1)
+    for key in ("python", "implementation"):
+        if base_results.get(key, None) != new_results.get(key, None):
+            typer.echo(f"Warning: the results were measured with different interpreters "
+                       f"({base_results.get(key, None)} and {new_results.get(key, None)})", err=True)
+    typer.echo(f"{'benchmark':<24} {'base':>10} {'new':>10} {'change':>8}")
+    regressions = 0
+    for comparison in compare_results(base_results, new_results, stat):
+        change = comparison.change
+        marker = ""
+        if change > threshold:
+            marker = "  slower"
+            regressions += 1
+        elif change < -threshold:
+            marker = "  faster"
+        typer.echo(f"{comparison.name:<24} {format_time(comparison.base):>10} {format_time(comparison.new):>10} "
+                   f"{change:>+8.1%}{marker}")
+    if regressions > 0:
+        typer.echo(f"{regressions} benchmark(s) became more than {threshold:.0%} slower", err=True)
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
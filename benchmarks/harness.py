@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Final, Iterator, List, Optional, Tuple
+
+from prepare_assignment.data.constants import LOG_LEVEL_TRACE
+from prepare_assignment.utils.logger import add_logging_level
+
+# Version of the results file, results with another version cannot be compared
+RESULTS_VERSION: Final[int] = 1
+# The loggers the hot paths log to, they are set to the level of a run without verbosity
+LOGGERS: Final[Tuple[str, ...]] = ("prepare_assignment", "tasks")
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    description: str
+    # Gets the number of loops and returns a function that runs the workload that many times. Everything the
+    # workload needs is created before the function is returned, so only the function itself is timed.
+    setup: Callable[[int], Callable[[], None]]
+
+
+@contextmanager
+def quiet_loggers() -> Iterator[None]:
+    """
+    Discard the output of the loggers while benchmarking, with the level that is used without verbosity
+    """
+    # The tasks log their output with the trace level, which is only added when prepare runs
+    if not hasattr(logging, "TRACE"):
+        add_logging_level("TRACE", LOG_LEVEL_TRACE, "trace")
+    previous = []
+    for name in LOGGERS:
+        logger = logging.getLogger(name)
+        previous.append((logger, logger.level, logger.handlers, logger.propagate))
+        logger.setLevel(logging.ERROR)
+        logger.handlers = [logging.NullHandler()]
+        logger.propagate = False
+    try:
+        yield
+    finally:
+        for logger, level, handlers, propagate in previous:
+            logger.setLevel(level)
+            logger.handlers = handlers
+            logger.propagate = propagate
+
+
+def __time(benchmark: Benchmark, loops: int) -> float:
+    run = benchmark.setup(loops)
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def measure(benchmark: Benchmark, repeat: int = 5, min_time: float = 0.2) -> Dict[str, Any]:
+    """
+    Time a benchmark. The number of loops is doubled until running them takes at least min_time, which also warms up
+    caches that are filled on first use (e.g. compiled validators). Then the loops are timed repeat times.
+
+    :param benchmark: the benchmark to run
+    :param repeat: the number of times the loops are timed
+    :param min_time: the minimum time (in seconds) of one repetition
+    :return: the statistics of the time (in seconds) of one loop
+    """
+    loops = 1
+    while __time(benchmark, loops) < min_time and loops < 2 ** 20:
+        loops *= 2
+    timings = [__time(benchmark, loops) / loops for _ in range(repeat)]
+    return {
+        "description": benchmark.description,
+        "loops": loops,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "unit": "s"
+    }
+
+
+def __commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=10,
+                                cwd=Path(__file__).parent)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def run_benchmarks(benchmarks: List[Benchmark], pattern: Optional[str] = None, repeat: int = 5,
+                   min_time: float = 0.2, on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None) \
+        -> Dict[str, Any]:
+    """
+    Run the benchmarks whose name matches the pattern
+
+    :param benchmarks: the benchmarks
+    :param pattern: regular expression the names have to match (re.search), None to run all benchmarks
+    :param repeat: see measure
+    :param min_time: see measure
+    :param on_result: called with the name and statistics of every benchmark once it is finished
+    :return: the results, including the commit and interpreter they were measured with
+    """
+    results: Dict[str, Any] = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": __commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "benchmarks": {}
+    }
+    with quiet_loggers():
+        for benchmark in benchmarks:
+            if pattern is not None and re.search(pattern, benchmark.name) is None:
+                continue
+            stats = measure(benchmark, repeat, min_time)
+            results["benchmarks"][benchmark.name] = stats
+            if on_result is not None:
+                on_result(benchmark.name, stats)
+    return results
+
+
+def write_results(results: Dict[str, Any], path: str | os.PathLike) -> None:
+    with open(path, "w") as handle:
+        json.dump(results, handle, indent=2)
+        handle.write("\n")
+
+
+def load_results(path: str | os.PathLike) -> Dict[str, Any]:
+    """
+    :param path: the results file
+    :return: the results
+    :raises: ValueError: if the file is not a results file of this version
+    """
+    with open(path, "r") as handle:
+        results: Dict[str, Any] = json.load(handle)
+    if not isinstance(results, dict) or results.get("version", None) != RESULTS_VERSION:
+        raise ValueError(f"'{path}' is not a benchmark results file (version {RESULTS_VERSION})")
+    return results
+
+
+@dataclass(frozen=True)
+class Comparison:
+    name: str
+    base: float
+    new: float
+
+    @property
+    def change(self) -> float:
+        """
+        :return: the relative change of the time, e.g. 0.1 if the benchmark became 10% slower
+        """
+        return self.new / self.base - 1 if self.base > 0 else 0.0
+
+
+def compare_results(base: Dict[str, Any], new: Dict[str, Any], stat: str = "min") -> List[Comparison]:
+    """
+    Compare the benchmarks that are in both results
+
+    :param base: the results to compare against
+    :param new: the new results
+    :param stat: the statistic to compare (min, median or mean)
+    :return: the comparison per benchmark
+    """
+    comparisons = []
+    for name, stats in new["benchmarks"].items():
+        if name in base["benchmarks"]:
+            comparisons.append(Comparison(name, base["benchmarks"][name][stat], stats[stat]))
+    return comparisons
+
+
+def format_time(seconds: float) -> str:
+    for unit, factor in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= factor:
+            return f"{seconds / factor:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
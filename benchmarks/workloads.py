@@ -0,0 +1,264 @@
+import copy
+import io
+import itertools
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Final, List
+from urllib.parse import quote_plus
+
+from prepare_toolbox.command import DEMARCATION
+
+from benchmarks.harness import Benchmark
+from prepare_assignment.core import preparer, runner, subsituter
+from prepare_assignment.core.expression import evaluate, evaluate_condition
+from prepare_assignment.core.validator import validate_tasks
+from prepare_assignment.data.job_environment import JobEnvironment
+from prepare_assignment.data.prepare import UsesTask
+from prepare_assignment.data.task_definition import PythonTaskDefinition
+from prepare_assignment.data.task_properties import TaskProperties
+
+# The size of the workloads, chosen to be (a lot) larger than a typical prepare file
+ENV_VARS: Final[int] = 500
+STEPS: Final[int] = 50
+SUBSTITUTION_BLOCKS: Final[int] = 100
+SUBSTITUTED_INPUTS: Final[int] = 200
+TASK_INPUTS: Final[int] = 100
+ARRAY_ITEMS: Final[int] = 1000
+OUTPUT_BYTES: Final[int] = 4 * 1024 * 1024
+# Every n-th line of the task output is a command
+COMMAND_INTERVAL: Final[int] = 25
+
+CONDITIONS: Final[List[str]] = [
+    "${{ env.CI == true && startsWith(env.BRANCH, 'release') }}",
+    "env.VAR_250 == 'value-250' || contains(inputs.languages, 'java')",
+    "tasks.step-10.outputs.stripped-files != '' && success()",
+    "!failure() && needs.build.outputs.compile.status == 'ok'",
+    "endsWith(env.VAR_499, '499') && inputs.level >= 3 && !env.DRY_RUN",
+    "always() && (env.VAR_1 != env.VAR_2 || contains(tasks.step-49.outputs.files, 'src/Main.java'))",
+]
+
+# Unique payloads for the cold validation, the validation results are memoized per payload
+_unique = itertools.count()
+
+
+def __environment() -> JobEnvironment:
+    """
+    A job environment with hundreds of environment variables and the outputs of many steps
+    """
+    environment = {f"VAR_{index}": f"value-{index}" for index in range(ENV_VARS)}
+    environment.update({"CI": "true", "DRY_RUN": "false", "BRANCH": "release/2024.1", "HOME": "/home/student"})
+    outputs: Dict[str, Any] = {
+        f"step-{index}": {
+            "stripped-files": f"out/Step{index}.java",
+            "files": [f"src/Step{index}/{file}.java" for file in range(20)] + ["src/Main.java"],
+            "count": index
+        } for index in range(STEPS)
+    }
+    inputs = {"languages": ["python", "java", "kotlin"], "level": 3, "name": "assignment", "strict": True}
+    needs = {"build": {"outputs": {"compile": {"status": "ok", "artifacts": ["target/app.jar"]}}}}
+    return JobEnvironment(environment=environment, outputs=outputs, inputs=inputs, needs=needs)
+
+
+def __conditions(loops: int) -> Callable[[], None]:
+    environment = __environment()
+    for condition in CONDITIONS:
+        # evaluate_condition returns False on errors, make sure the expressions are actually evaluated
+        if evaluate(condition, environment) is not True:
+            raise AssertionError(f"Condition '{condition}' is not true")
+
+    def run() -> None:
+        for _ in range(loops):
+            for condition in CONDITIONS:
+                evaluate_condition(condition, environment)
+    return run
+
+
+def __template(blocks: int, offset: int = 0) -> str:
+    expressions = [
+        "env.VAR_{index}",
+        "tasks.step-{step}.outputs.stripped-files",
+        "inputs.name",
+        "tasks.step-{step}.outputs.count + 1",
+        "needs.build.outputs.compile.status",
+    ]
+    parts = []
+    for index in range(offset, offset + blocks):
+        expression = expressions[index % len(expressions)].format(index=index % ENV_VARS, step=index % STEPS)
+        parts.append(f"arg{index}=${{{{ {expression} }}}}")
+    return "echo " + " ".join(parts)
+
+
+def __substitute_blocks(loops: int) -> Callable[[], None]:
+    environment = __environment()
+    substitute = getattr(subsituter, "__substitute")
+    value = __template(SUBSTITUTION_BLOCKS)
+
+    def run() -> None:
+        for _ in range(loops):
+            substitute(value, environment)
+    return run
+
+
+def __substitute_inputs(loops: int) -> Callable[[], None]:
+    environment = __environment()
+    values: Dict[str, Any] = {}
+    for index in range(SUBSTITUTED_INPUTS):
+        kind = index % 4
+        if kind == 0:
+            values[f"input-{index}"] = __template(3, index)
+        elif kind == 1:
+            values[f"input-{index}"] = [f"src/${{{{ env.VAR_{index} }}}}/{file}.java" for file in range(10)]
+        elif kind == 2:
+            values[f"input-{index}"] = [f"${{{{ tasks.step-{index % STEPS}.outputs.files }}}}", "pom.xml"]
+        else:
+            values[f"input-{index}"] = "no expressions in this input"
+    # The values are substituted in place, every loop gets its own copy
+    copies = [copy.deepcopy(values) for _ in range(loops)]
+
+    def run() -> None:
+        for values in copies:
+            subsituter.substitute_all(values, environment)
+    return run
+
+
+def __task_definition() -> PythonTaskDefinition:
+    inputs: Dict[str, Any] = {}
+    for index in range(TASK_INPUTS):
+        kind = index % 4
+        inp: Dict[str, Any] = {"description": f"Input {index}", "required": index % 10 == 0}
+        if kind == 0:
+            inp.update({"type": "string", "default": f"default-{index}"})
+        elif kind == 1:
+            inp.update({"type": "integer", "default": index})
+        elif kind == 2:
+            inp.update({"type": "boolean", "default": False})
+        else:
+            inp.update({"type": "array", "items": "string", "default": ["**/*.java"]})
+        inputs[f"input-{index}"] = inp
+    return PythonTaskDefinition.of({
+        "id": "large",
+        "name": "Large task",
+        "description": "Task with many inputs",
+        "inputs": inputs,
+        "runs": {"using": "python", "main": "main.py"}
+    }, Path("task.yml"))
+
+
+def __task_schema() -> Dict[str, Any]:
+    props = TaskProperties.of("prepare-assignment/large@v1.0.0")
+    schema: Dict[str, Any] = json.loads(getattr(preparer, "__build_json_schema")(props, __task_definition()))
+    return schema
+
+
+def __large_step(unique: int) -> Dict[str, Any]:
+    """
+    A step that sets all required inputs and three quarters of the others, the arrays contain ARRAY_ITEMS paths
+    """
+    values: Dict[str, Any] = {}
+    for index in range(TASK_INPUTS):
+        if index % 4 == 3 and index % 10 != 0:
+            continue
+        kind = index % 4
+        if kind == 0:
+            values[f"input-{index}"] = f"value-{index}-{unique}"
+        elif kind == 1:
+            values[f"input-{index}"] = index * 2
+        elif kind == 2:
+            values[f"input-{index}"] = True
+        else:
+            values[f"input-{index}"] = [f"src/module{index}/File{item}.java" for item in range(ARRAY_ITEMS)]
+    return {"name": "Large step", "id": "large", "uses": "prepare-assignment/large@v1.0.0", "with": values}
+
+
+def __validate(loops: int, memoized: bool) -> Callable[[], None]:
+    schema = __task_schema()
+    # Compile the validator and make sure the step is valid
+    validate_tasks("prepare.yml", __large_step(-1), schema)
+    # The default values are added to the steps, every loop gets its own copy
+    steps = [__large_step(-1 if memoized else next(_unique)) for _ in range(loops)]
+
+    def run() -> None:
+        for step in steps:
+            validate_tasks("prepare.yml", step, schema)
+    return run
+
+
+def __task_output() -> bytes:
+    """
+    Output of a task: mostly log lines, with every COMMAND_INTERVAL-th line a command
+    """
+    commands = [
+        f"{DEMARCATION}set-env{DEMARCATION}BUILD_{{index}}{DEMARCATION}\"{{index}}\"",
+        f"{DEMARCATION}set-output{DEMARCATION}files{DEMARCATION}{{{{\"files\": [\"src/File{{index}}.java\"]}}}}",
+        f"{DEMARCATION}warning{DEMARCATION}{quote_plus('Skipping file src/Generated.java')}",
+        f"{DEMARCATION}debug{DEMARCATION}{quote_plus('Processed 10 files')}",
+    ]
+    lines = []
+    size = 0
+    index = 0
+    while size < OUTPUT_BYTES:
+        if index % COMMAND_INTERVAL == 0:
+            line = commands[(index // COMMAND_INTERVAL) % len(commands)].format(index=index)
+        else:
+            line = (f"[INFO] {index:08d} Processing src/main/java/nl/fontys/assignment/File{index % 97}.java "
+                    + "." * (index % 61))
+        lines.append(line)
+        size += len(line) + 1
+        index += 1
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def __output_environment() -> JobEnvironment:
+    definition = PythonTaskDefinition.of({
+        "id": "codestripper",
+        "name": "Codestripper",
+        "description": "Strips code",
+        "outputs": {"files": {"description": "Stripped files", "type": "array", "items": "string"}},
+        "runs": {"using": "python", "main": "main.py"}
+    }, Path("task.yml"))
+    task = UsesTask(name="codestripper", id="codestripper", uses="codestripper", with_={}, if_=None, reads=[],
+                    writes=[])
+    return JobEnvironment(environment={}, outputs={"codestripper": {}}, inputs={},
+                          current_task_definition=definition, current_task=task)
+
+
+def __pump_output(loops: int) -> Callable[[], None]:
+    pump = getattr(runner, "__pump_output")
+    output = __task_output()
+    environment = __output_environment()
+
+    def run() -> None:
+        for _ in range(loops):
+            pump(io.BytesIO(output), environment)
+    return run
+
+
+def __process_lines(loops: int) -> Callable[[], None]:
+    process = getattr(runner, "__process_output_line")
+    # The lines of task workers and of verbose runs are all processed one by one
+    lines = [line + "\n" for line in __task_output()[:OUTPUT_BYTES // 4].decode("utf-8").split("\n")]
+    environment = __output_environment()
+
+    def run() -> None:
+        for _ in range(loops):
+            for line in lines:
+                process(line, environment)
+    return run
+
+
+BENCHMARKS: Final[List[Benchmark]] = [
+    Benchmark("expression.conditions", f"Evaluate {len(CONDITIONS)} if conditions with {ENV_VARS} environment "
+                                       f"variables and the outputs of {STEPS} steps", __conditions),
+    Benchmark("substitute.blocks", f"Substitute a command with {SUBSTITUTION_BLOCKS} ${{{{ }}}} blocks",
+              __substitute_blocks),
+    Benchmark("substitute.inputs", f"Substitute {SUBSTITUTED_INPUTS} inputs of a step (strings and lists)",
+              __substitute_inputs),
+    Benchmark("validate.cold", f"Validate a step with {TASK_INPUTS} inputs and arrays of {ARRAY_ITEMS} items, "
+                               "every step is different", lambda loops: __validate(loops, memoized=False)),
+    Benchmark("validate.memoized", "Validate the same large step again (memoized validation result)",
+              lambda loops: __validate(loops, memoized=True)),
+    Benchmark("output.pump", f"Read {OUTPUT_BYTES // (1024 * 1024)} MiB of task output with a command every "
+                             f"{COMMAND_INTERVAL} lines", __pump_output),
+    Benchmark("output.lines", f"Process {OUTPUT_BYTES // (4 * 1024 * 1024)} MiB of task output line by line",
+              __process_lines),
+]
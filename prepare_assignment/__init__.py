@@ -1,3 +1,10 @@
-from importlib.metadata import version
+from typing import Any
 
-__version__ = version("prepare_assignment")
\ No newline at end of file
+
+def __getattr__(name: str) -> Any:
+    # Reading the package metadata is slow, only do it when the version is requested
+    if name == "__version__":
+        from importlib.metadata import version
+        globals()["__version__"] = version("prepare_assignment")
+        return globals()["__version__"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,13 +5,12 @@ from typing import Dict, List, Optional
 import typer
 from typing_extensions import Annotated
 
-from prepare_assignment import __version__
 from prepare_assignment.cli.task import app as task_app
 from prepare_assignment.cli.tasks import app as tasks_app
-from prepare_assignment.core.main import prepare
 from prepare_assignment.data.config import GitMode
 from prepare_assignment.data.constants import CONFIG
 from prepare_assignment.utils.paths import get_config_path
+from prepare_assignment.utils.tracing import enable_tracing, write_trace
 from prepare_assignment.utils.virtual_env import get_virtualenv_name
 
 app = typer.Typer(invoke_without_command=True)
@@ -19,9 +18,26 @@ app.add_typer(task_app, name="task")
 app.add_typer(tasks_app, name="tasks")
 
 
+def prepare(file_name: Optional[str], env_vars: Optional[Dict[str, str]] = None) -> None:
+    # The core pulls in git, virtualenv, jsonschema etc. so only import it when we actually run
+    from prepare_assignment.core.main import prepare as prepare_core
+    prepare_core(file_name, env_vars)
+
+
+def find_prepare_files(paths: List[str]) -> List[str]:
+    from prepare_assignment.core.main import find_prepare_files as find_prepare_files_core
+    return find_prepare_files_core(paths)
+
+
+def prepare_many(files: List[str], env_vars: Dict[str, str], processes: Optional[int]) -> Dict[str, Optional[str]]:
+    from prepare_assignment.core.main import prepare_many as prepare_many_core
+    return prepare_many_core(files, env_vars, processes)
+
+
 @app.callback(invoke_without_command=True)
 def main(ctx: typer.Context):
     if ctx.invoked_subcommand is None:
+        from prepare_assignment import __version__
         config_path = os.path.join(get_config_path(), 'config.yml')
         config_exists = os.path.exists(config_path)
         typer.echo(f"Prepare version: {__version__}")
@@ -39,29 +55,161 @@ def run(
         typer.Option("--file", "-f", help="Configuration file")
     ] = None,
     git: Annotated[
-        GitMode,
-        typer.Option(case_sensitive=False, help="Clone mode for git, options are 'ssh' (default) or 'https'")
-    ] = CONFIG.core.git_mode,
+        Optional[GitMode],
+        typer.Option(case_sensitive=False, help="Clone mode for git, options are 'ssh' (default) or 'https'",
+                     show_default=False)
+    ] = None,
     debug: Annotated[
         int,
         typer.Option("--debug", "-d", count=True, help="increase debug verbosity for prepare assignment")
-    ] = CONFIG.core.debug,
+    ] = 0,
     verbose: Annotated[
         int,
         typer.Option("--verbose", "-v", count=True, help="increase task output verbosity")
-    ] = CONFIG.core.verbose,
+    ] = 0,
+    jobs: Annotated[
+        Optional[int],
+        typer.Option("--jobs", "-j", min=1, help="maximum number of tasks to prepare concurrently, defaults to "
+                                                 "'core.max-workers'", show_default=False)
+    ] = None,
+    refresh: Annotated[
+        bool,
+        typer.Option("--refresh", help="ignore the cached tags of task repositories")
+    ] = False,
+    offline: Annotated[
+        bool,
+        typer.Option("--offline", help="only install task dependencies from the wheelhouse")
+    ] = False,
     env: Annotated[
         Optional[List[str]],
         typer.Option("-e", "--env", help="Set environment variable (KEY=VALUE)")
     ] = None,
+    trace: Annotated[
+        Optional[str],
+        typer.Option("--trace", help="Write a timeline of the run to this file, in Chrome trace event format "
+                                     "(open it in Perfetto)", show_default=False)
+    ] = None,
+    metrics_file: Annotated[
+        Optional[str],
+        typer.Option("--metrics-file", help="Add the metrics of the run to this file, in OpenMetrics text format, "
+                                            "defaults to 'core.metrics-file'", show_default=False)
+    ] = None,
 ):
     """
     Parse 'prepare_assignment.y(a)ml' and execute all jobs
     """
-    CONFIG.core.debug = debug  # type: ignore
-    CONFIG.core.git_mode = git # type: ignore
-    CONFIG.core.verbose = verbose  # type: ignore
+    __apply_options(git, debug, verbose, jobs, refresh, offline, trace, metrics_file)
+    env_vars = __parse_env_vars(env, ctx.args)
+    try:
+        prepare(file_name, env_vars)
+    except Exception:
+        raise typer.Exit(code=1)
+    finally:
+        if trace is not None:
+            write_trace(trace)
 
+
+@app.command("run-many", context_settings={"allow_extra_args": True, "ignore_unknown_options": True})
+def run_many(
+    ctx: typer.Context,
+    paths: Annotated[
+        List[str],
+        typer.Argument(help="Prepare files, or directories to search for prepare.y(a)ml files")
+    ],
+    processes: Annotated[
+        Optional[int],
+        typer.Option("--processes", "-p", min=1, help="number of assignments to prepare concurrently, defaults to "
+                                                      "the number of CPUs", show_default=False)
+    ] = None,
+    git: Annotated[
+        Optional[GitMode],
+        typer.Option(case_sensitive=False, help="Clone mode for git, options are 'ssh' (default) or 'https'",
+                     show_default=False)
+    ] = None,
+    debug: Annotated[
+        int,
+        typer.Option("--debug", "-d", count=True, help="increase debug verbosity for prepare assignment")
+    ] = 0,
+    verbose: Annotated[
+        int,
+        typer.Option("--verbose", "-v", count=True, help="increase task output verbosity")
+    ] = 0,
+    jobs: Annotated[
+        Optional[int],
+        typer.Option("--jobs", "-j", min=1, help="maximum number of tasks to prepare concurrently, defaults to "
+                                                 "'core.max-workers'", show_default=False)
+    ] = None,
+    refresh: Annotated[
+        bool,
+        typer.Option("--refresh", help="ignore the cached tags of task repositories")
+    ] = False,
+    offline: Annotated[
+        bool,
+        typer.Option("--offline", help="only install task dependencies from the wheelhouse")
+    ] = False,
+    env: Annotated[
+        Optional[List[str]],
+        typer.Option("-e", "--env", help="Set environment variable (KEY=VALUE)")
+    ] = None,
+    trace: Annotated[
+        Optional[str],
+        typer.Option("--trace", help="Write a timeline of the run to this file, in Chrome trace event format "
+                                     "(open it in Perfetto)", show_default=False)
+    ] = None,
+    metrics_file: Annotated[
+        Optional[str],
+        typer.Option("--metrics-file", help="Add the metrics of the run to this file, in OpenMetrics text format, "
+                                            "defaults to 'core.metrics-file'", show_default=False)
+    ] = None,
+):
+    """
+    Prepare many assignments at once, the tasks are only loaded once for all assignments
+    """
+    __apply_options(git, debug, verbose, jobs, refresh, offline, trace, metrics_file)
+    env_vars = __parse_env_vars(env, ctx.args)
+    try:
+        files = find_prepare_files(paths)
+    except FileNotFoundError as e:
+        typer.echo(str(e), err=True)
+        raise typer.Exit(code=1)
+    if len(files) == 0:
+        typer.echo("No prepare files found")
+        raise typer.Exit(code=1)
+    try:
+        results = prepare_many(files, env_vars, processes)
+    finally:
+        if trace is not None:
+            write_trace(trace)
+    for file, message in results.items():
+        typer.echo(f"{'✓' if message is None else '✗'} {file}")
+    failed = len([message for message in results.values() if message is not None])
+    typer.echo(f"Prepared {len(results) - failed} of {len(results)} assignments")
+    if failed > 0:
+        raise typer.Exit(code=1)
+
+
+def __apply_options(git: Optional[GitMode], debug: int, verbose: int, jobs: Optional[int], refresh: bool,
+                    offline: bool, trace: Optional[str], metrics_file: Optional[str]) -> None:
+    # The defaults come from the config file, which is only loaded when needed
+    if debug:
+        CONFIG.core.debug = debug  # type: ignore
+    if git is not None:
+        CONFIG.core.git_mode = git  # type: ignore
+    if verbose:
+        CONFIG.core.verbose = verbose  # type: ignore
+    if jobs is not None:
+        CONFIG.core.max_workers = jobs  # type: ignore
+    if offline:
+        CONFIG.core.offline = offline  # type: ignore
+    if refresh:
+        CONFIG.core.tag_cache_ttl = 0  # type: ignore
+    if trace is not None:
+        enable_tracing()
+    if metrics_file is not None:
+        CONFIG.core.metrics_file = metrics_file  # type: ignore
+
+
+def __parse_env_vars(env: Optional[List[str]], args: List[str]) -> Dict[str, str]:
     env_vars: Dict[str, str] = {}
     for item in (env or []):
         if "=" not in item:
@@ -72,7 +220,7 @@ def run(
         env_vars[key] = value
     # ctx.args only contains arguments unknown to Click (known options like --debug,
     # --verbose are consumed by the parser and never appear here)
-    for arg in ctx.args:
+    for arg in args:
         if not arg.startswith("--"):
             continue
         key_value = arg[2:]
@@ -85,8 +233,4 @@ def run(
         else:
             key, value = key_value, "true"
         env_vars[key] = value
-
-    try:
-        prepare(file_name, env_vars)
-    except Exception:
-        raise typer.Exit(code=1)
+    return env_vars
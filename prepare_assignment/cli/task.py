@@ -4,8 +4,6 @@ from typing import Optional
 import typer
 from typing_extensions import Annotated
 
-from prepare_assignment.core.task_handler import info, remove, update, add
-
 app = typer.Typer(help="Commands that apply to one task")
 logger = logging.getLogger("prepare_assignment")
 
@@ -15,6 +13,7 @@ def display_info(task: str) -> None:
     """
     Display task info
     """
+    from prepare_assignment.core.task_handler import info
     info(task)
 
 
@@ -29,6 +28,7 @@ def display_remove(
     """
     Remove a task
     """
+    from prepare_assignment.core.task_handler import remove
     try:
         remove(task, recursive)
     except Exception as e:
@@ -38,19 +38,24 @@ def display_remove(
 
 @app.command("update")
 def display_update(
-        task: Annotated[str, typer.Argument(help="The task to remove")],
+        task: Annotated[str, typer.Argument(help="The task to update")],
         recursive: Annotated[
             bool,
-            typer.Option("-r", "--recursive", help="Recursively remove dependencies as well")
+            typer.Option("-r", "--recursive", help="Recursively update dependencies as well")
         ] = False) -> None:
     """
     Update a task
     """
+    from prepare_assignment.core.task_handler import update
     try:
-        update(task, recursive)
+        updated = update(task, recursive)
     except Exception as e:
         logger.exception(e)
         raise typer.Abort()
+    if len(updated) == 0:
+        typer.echo("All tasks are up to date")
+    for props in updated:
+        typer.echo(f"Updated: {props}")
 
 
 @app.command("add")
@@ -58,4 +63,5 @@ def display_add(task: str) -> None:
     """
     Add a task
     """
+    from prepare_assignment.core.task_handler import add
     add(task)
@@ -1,16 +1,25 @@
-import typer
+import logging
+from typing import Optional
 
-from prepare_assignment.core.task_handler import ls, remove_all
+import typer
+from typing_extensions import Annotated
 
 app = typer.Typer(help="Apply action to all tasks")
+logger = logging.getLogger("prepare_assignment")
 
 
 @app.command("ls")
-def display_ls() -> None:
+def display_ls(
+        dependents: Annotated[
+            bool,
+            typer.Option("--dependents", "-d", help="Show which tasks use every task")
+        ] = False
+) -> None:
     """
     List all tasks
     """
-    ls()
+    from prepare_assignment.core.task_handler import ls
+    ls(dependents)
 
 
 @app.command("remove")
@@ -21,4 +30,98 @@ def display_remove() -> None:
     confirm_remove = typer.confirm("Are you sure you want to remove all tasks?")
     if not confirm_remove:
         raise typer.Abort()
+    from prepare_assignment.core.task_handler import remove_all
     remove_all()
+
+
+@app.command("prefetch-wheels")
+def display_prefetch_wheels(
+        wheelhouse: Annotated[
+            Optional[str],
+            typer.Option("--wheelhouse", "-w", help="Directory to store the wheels in, defaults to the configured "
+                                                    "wheelhouse")
+        ] = None
+) -> None:
+    """
+    Download the wheels of the dependencies of all tasks, so they can be installed offline
+    """
+    from prepare_assignment.core.task_handler import prefetch_wheels
+    try:
+        path = prefetch_wheels(wheelhouse)
+    except Exception as e:
+        logger.exception(e)
+        raise typer.Abort()
+    typer.echo(f"Wheels stored in: {path}")
+
+
+@app.command("gc")
+def display_gc(
+        max_size: Annotated[
+            Optional[str],
+            typer.Option("--max-size", "-s", help="Remove the least recently used tasks until the cache is at most "
+                                                  "this size (e.g. 2G), defaults to 'core.cache-max-size'")
+        ] = None,
+        max_age: Annotated[
+            Optional[str],
+            typer.Option("--max-age", "-a", help="Remove the tasks that have not been used for this long (e.g. 30d)")
+        ] = None
+) -> None:
+    """
+    Remove tasks that have not been used recently, tasks that are used by another installed task are kept
+    """
+    from prepare_assignment.data.constants import CONFIG
+    from prepare_assignment.utils.task_gc import collect_garbage, parse_age, parse_size
+    max_size = max_size or CONFIG.core.cache_max_size
+    try:
+        size = parse_size(max_size) if max_size is not None else None
+        age = parse_age(max_age) if max_age is not None else None
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    try:
+        result = collect_garbage(size, age)
+    except Exception as e:
+        logger.exception(e)
+        raise typer.Abort()
+    for props in result.tasks:
+        typer.echo(f"Removed: {props}")
+    typer.echo(f"Freed {result.freed / 1024 ** 2:.1f} MiB")
+
+
+@app.command("export")
+def display_export(
+        archive: Annotated[str, typer.Argument(help="The archive to create, e.g. tasks.tar.gz")],
+        file: Annotated[
+            Optional[str],
+            typer.Option("--file", "-f", help="Only export the tasks used by this prepare file, the tasks are "
+                                              "installed if necessary")
+        ] = None
+) -> None:
+    """
+    Export the installed tasks, with their virtual environments, to an archive that can be imported elsewhere
+    """
+    from prepare_assignment.core.bundle import export_tasks
+    try:
+        tasks = export_tasks(archive, file)
+    except Exception as e:
+        logger.exception(e)
+        raise typer.Abort()
+    typer.echo(f"Exported {len(tasks)} task(s) to: {archive}")
+
+
+@app.command("import")
+def display_import(
+        archive: Annotated[str, typer.Argument(help="The archive created by 'tasks export'")]
+) -> None:
+    """
+    Import the tasks of an archive, tasks that are already installed are kept
+    """
+    from prepare_assignment.core.bundle import import_tasks
+    try:
+        tasks = import_tasks(archive)
+    except Exception as e:
+        logger.exception(e)
+        raise typer.Abort()
+    for props in tasks:
+        typer.echo(f"Imported: {props}")
+    if len(tasks) == 0:
+        typer.echo("All tasks are already installed")
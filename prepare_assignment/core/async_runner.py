@@ -0,0 +1,39 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+from prepare_assignment.core.runner import run
+from prepare_assignment.data.prepare import Prepare
+from prepare_assignment.data.task_definition import TaskDefinition
+from prepare_assignment.data.task_event import TaskEvent
+from prepare_assignment.utils.run_control import RunControl
+
+logger = logging.getLogger("prepare_assignment")
+
+Emit = Callable[[TaskEvent], None]
+
+
+async def run_async(prepare: Prepare, mapping: Dict[str, TaskDefinition], cwd: str, emit: Emit,
+                    env_vars: Optional[Dict[str, str]] = None) -> None:
+    """
+    Run the jobs, the asyncio counterpart of runner.run. The jobs are run by runner.run in a separate thread, so they
+    are scheduled and run exactly the same. Cancelling the coroutine kills the running tasks, it returns once they are
+    killed.
+
+    :param prepare: the parsed prepare file
+    :param mapping: the definitions of the tasks that are used
+    :param cwd: the directory the tasks run in
+    :param emit: function that is called with every command a task sends, from the thread that runs the task
+    :param env_vars: extra environment variables
+    :return: None
+    :raises TaskExecutionError: if a job failed
+    """
+    control = RunControl(emit)
+    runner = asyncio.ensure_future(asyncio.to_thread(run, prepare, mapping, env_vars, cwd, control))
+    try:
+        await asyncio.shield(runner)
+    except asyncio.CancelledError:
+        logger.debug("Run is cancelled, killing the running tasks")
+        control.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        raise
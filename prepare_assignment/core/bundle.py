@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+import posixpath
+import shutil
+import sys
+import tarfile
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Final, List, Optional, Set, Tuple
+
+from git import Repo
+
+from prepare_assignment.core import preparer
+from prepare_assignment.core.preparer import prepare_tasks, __file_lock, __load_installed_task, STAGING_PATH
+from prepare_assignment.core.validator import validate_prepare
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.tasks import get_all_tasks
+from prepare_assignment.utils.virtual_env import get_venv_key, relocate_venv, VENV_COMPLETE, VENV_TEMPLATE_PREFIX
+from prepare_assignment.utils.yml_loader import YAML_LOADER
+
+MANIFEST_FILE: Final[str] = "manifest.json"
+# Increase when the layout of a bundle changes
+BUNDLE_VERSION: Final[int] = 1
+HASH_CHUNK_SIZE: Final[int] = 1024 * 1024
+
+logger = logging.getLogger("prepare_assignment")
+
+
+def __interpreter() -> Dict[str, str]:
+    return {
+        "implementation": sys.implementation.name,
+        "version": ".".join(str(part) for part in sys.version_info[:3]),
+        "platform": sys.platform,
+        "executable": sys.executable
+    }
+
+
+def __digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def __add_tree(tar: tarfile.TarFile, path: str, arcname: str, seen: Dict[Tuple[int, int, str], str]) -> None:
+    """
+    Add a directory to the archive, files with the same contents (and mode) are stored once and added as hardlinks
+
+    :param tar: the archive
+    :param path: the directory to add
+    :param arcname: the name of the directory in the archive
+    :param seen: (size, mode, digest) of the files that have been added, mapped to their name in the archive
+    :return: None
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        relative = os.path.relpath(root, path)
+        archive_root = arcname if relative == "." else f"{arcname}/{relative.replace(os.sep, '/')}"
+        tar.add(root, archive_root, recursive=False)
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            info = tar.gettarinfo(file, f"{archive_root}/{name}")
+            # Symbolic links, and files that are a hardlink of a file that has already been added
+            if not info.isreg():
+                tar.addfile(info)
+                continue
+            key = (info.size, info.mode, __digest(file))
+            first = seen.get(key, None)
+            if first is not None:
+                info.type = tarfile.LNKTYPE
+                info.linkname = first
+                info.size = 0
+                tar.addfile(info)
+                continue
+            seen[key] = info.name
+            with open(file, "rb") as handle:
+                tar.addfile(info, handle)
+
+
+def __prepare_file_tasks(prepare_file: str) -> List[TaskProperties]:
+    yaml = YAML_LOADER.load(Path(prepare_file))
+    validate_prepare(prepare_file, yaml)
+    # Makes sure all tasks (including the sub-tasks of composite tasks) are installed
+    mapping = prepare_tasks(prepare_file, yaml["jobs"])
+    return [TaskProperties.of(task) for task in mapping]
+
+
+def export_tasks(archive: str | os.PathLike, prepare_file: Optional[str] = None) -> List[TaskProperties]:
+    """
+    Export installed tasks, with their virtual environments and repository mirrors, to a compressed archive that can
+    be imported on another machine (see import_tasks). The archive contains a manifest with the commits of the tasks
+    and the interpreter the virtual environments were created with.
+
+    :param archive: the file to write the archive (.tar.gz) to
+    :param prepare_file: only export the tasks used by this prepare file, the tasks are installed if necessary
+    :return: the exported tasks
+    """
+    tasks = __prepare_file_tasks(prepare_file) if prepare_file is not None else get_all_tasks()
+    tasks = sorted(set(tasks), key=str)
+    manifest: Dict[str, Any] = {
+        "version": BUNDLE_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "interpreter": __interpreter(),
+        # The locations the tasks were installed at, the virtual environments have to be relocated when imported
+        "venvs-path": str(preparer.venvs_path),
+        "mirrors-path": str(preparer.mirrors_path),
+        "tasks": [],
+        "venvs": [],
+        "mirrors": []
+    }
+    exported: List[TaskProperties] = []
+    venvs: Set[str] = set()
+    # New virtualenvs are cloned from the templates
+    if os.path.isdir(preparer.venvs_path):
+        venvs.update(name for name in os.listdir(preparer.venvs_path) if name.startswith(VENV_TEMPLATE_PREFIX))
+    mirrors: Set[Tuple[str, str]] = set()
+
+    destination = Path(archive)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=destination.parent, prefix=f".{destination.name}-")
+    try:
+        with os.fdopen(fd, "wb") as handle, tarfile.open(fileobj=handle, mode="w:gz") as tar:
+            seen: Dict[Tuple[int, int, str], str] = {}
+            # Every entry is added while holding its lock, so it is not changed (or removed) by another process
+            for props in tasks:
+                with __file_lock(f"task-{props}"):
+                    if not os.path.isdir(props.task_path):
+                        logger.warning(f"Task '{props}' has been removed, skipping")
+                        continue
+                    logger.debug(f"Exporting task '{props}'")
+                    with Repo(props.repo_path) as repo:
+                        commit = repo.head.commit.hexsha
+                    key = get_venv_key(props.task_path)
+                    arcname = f"tasks/{props.organization}/{props.name}/{props.version}"
+                    __add_tree(tar, str(props.task_path), arcname, seen)
+                manifest["tasks"].append({"task": str(props), "commit": commit, "venv": key})
+                exported.append(props)
+                if key is not None:
+                    venvs.add(key)
+                mirrors.add((props.organization, props.name))
+            for key in sorted(venvs):
+                venv_path = os.path.join(preparer.venvs_path, key)
+                with __file_lock(f"venv-{key}"):
+                    if not os.path.isfile(os.path.join(venv_path, VENV_COMPLETE)):
+                        continue
+                    __add_tree(tar, venv_path, f"venvs/{key}", seen)
+                manifest["venvs"].append(key)
+            for organization, name in sorted(mirrors):
+                mirror = f"{organization}/{name}.git"
+                with __file_lock(f"mirror-{organization}-{name}"):
+                    if not os.path.isdir(os.path.join(preparer.mirrors_path, mirror)):
+                        continue
+                    __add_tree(tar, os.path.join(preparer.mirrors_path, mirror), f"mirrors/{mirror}", seen)
+                manifest["mirrors"].append(mirror)
+            # The manifest describes what has been added, so it is added last
+            data = json.dumps(manifest, indent=2).encode("utf-8")
+            info = tarfile.TarInfo(MANIFEST_FILE)
+            info.size = len(data)
+            info.mtime = int(datetime.now().timestamp())
+            tar.addfile(info, io.BytesIO(data))
+        # mkstemp only allows the owner to read the file
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, destination)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return exported
+
+
+def __read_manifest(tar: tarfile.TarFile) -> Dict[str, Any]:
+    handle = tar.extractfile(MANIFEST_FILE)
+    if handle is None:
+        raise ValueError(f"Archive doesn't contain a '{MANIFEST_FILE}'")
+    manifest: Dict[str, Any] = json.load(handle)
+    if manifest.get("version", None) != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported archive version '{manifest.get('version', None)}'")
+    interpreter = manifest["interpreter"]
+    current = __interpreter()
+    for key in ("implementation", "version", "platform"):
+        if interpreter[key] != current[key]:
+            raise ValueError(f"Archive was created for {interpreter['implementation']} {interpreter['version']} on "
+                             f"{interpreter['platform']}, the virtual environments cannot be used with "
+                             f"{current['implementation']} {current['version']} on {current['platform']}")
+    if interpreter["executable"] != current["executable"] and not os.path.exists(interpreter["executable"]):
+        raise ValueError(f"Archive was created with '{interpreter['executable']}', the virtual environments cannot be "
+                         f"used as that interpreter is not available")
+    return manifest
+
+
+def __is_within(name: str) -> bool:
+    # Relative path in the archive, that doesn't leave the directory the archive is extracted to
+    normalized = posixpath.normpath(name)
+    return not posixpath.isabs(name) and normalized != ".." and not normalized.startswith("../")
+
+
+def __venv_homes(tar: tarfile.TarFile) -> Dict[str, str]:
+    """
+    :return: the virtual environments in the archive, mapped to the directory of the interpreter they use
+    """
+    homes = {}
+    for member in tar.getmembers():
+        parts = member.name.split("/")
+        # Files with the same contents are stored as hardlinks
+        if len(parts) != 3 or parts[0] != "venvs" or parts[2] != "pyvenv.cfg" \
+                or not (member.isreg() or member.islnk()):
+            continue
+        handle = tar.extractfile(member)
+        if handle is None:
+            continue
+        for line in handle.read().decode("utf-8", errors="replace").splitlines():
+            key, _, value = line.partition("=")
+            if key.strip() == "home":
+                homes[parts[1]] = posixpath.normpath(value.strip())
+    return homes
+
+
+def __check_members(tar: tarfile.TarFile) -> Set[str]:
+    """
+    Make sure extracting the archive only creates files in the directory it is extracted to. Links have to point to
+    a file within the archive, except the links of virtual environments to the interpreter they use, and nothing is
+    extracted through a link.
+
+    :return: the directories in the archive
+    :raises ValueError: if the archive contains a member that is not allowed
+    """
+    homes = __venv_homes(tar)
+    directories: Set[str] = set()
+    files: Set[str] = set()
+    links: Set[str] = set()
+    for member in tar.getmembers():
+        name = member.name
+        parts = name.split("/")
+        if not __is_within(name) or ".." in parts:
+            raise ValueError(f"Archive contains an invalid path '{name}'")
+        if any("/".join(parts[:index]) in links for index in range(1, len(parts) + 1)):
+            raise ValueError(f"Archive contains a path through a symbolic link '{name}'")
+        if member.issym():
+            target = member.linkname
+            if posixpath.isabs(target):
+                if parts[0] != "venvs" or len(parts) < 3 \
+                        or posixpath.dirname(posixpath.normpath(target)) != homes.get(parts[1], None):
+                    raise ValueError(f"Archive contains a symbolic link '{name}' to '{target}'")
+            elif not __is_within(posixpath.join(posixpath.dirname(name), target)):
+                raise ValueError(f"Archive contains a symbolic link '{name}' to '{target}'")
+            links.add(name)
+        elif member.islnk():
+            # Hardlinks refer to a file that has been extracted before
+            if member.linkname not in files:
+                raise ValueError(f"Archive contains a hardlink '{name}' to '{member.linkname}'")
+        elif member.isreg():
+            files.add(name)
+        elif member.isdir():
+            directories.add(posixpath.normpath(name))
+        else:
+            raise ValueError(f"Archive contains an unsupported file '{name}'")
+    return directories
+
+
+def __is_component(part: str) -> bool:
+    # A single directory name, that cannot refer to another directory
+    return part not in ("", ".", "..") and not any(separator in part for separator in ("/", "\\", os.sep))
+
+
+def __check_manifest(manifest: Dict[str, Any], directories: Set[str]) -> None:
+    """
+    Make sure the venvs, mirrors and tasks in the manifest are directories in the archive, as the manifest determines
+    where they are moved to in the cache
+
+    :param manifest: the manifest
+    :param directories: the directories in the archive
+    :raises ValueError: if the manifest refers to something else
+    """
+    for key in manifest["venvs"]:
+        if not __is_component(key) or f"venvs/{key}" not in directories:
+            raise ValueError(f"Archive contains an invalid virtual environment '{key}'")
+    for mirror in manifest["mirrors"]:
+        parts = mirror.split("/")
+        if len(parts) != 2 or not all(__is_component(part) for part in parts) or not parts[1].endswith(".git") \
+                or len(parts[1]) <= len(".git") or f"mirrors/{mirror}" not in directories:
+            raise ValueError(f"Archive contains an invalid mirror '{mirror}'")
+    for entry in manifest["tasks"]:
+        props = TaskProperties.of(entry["task"])
+        parts = (props.organization, props.name, props.version)
+        if not all(__is_component(part) for part in parts) or f"tasks/{'/'.join(parts)}" not in directories:
+            raise ValueError(f"Archive contains an invalid task '{entry['task']}'")
+
+
+def __extract(tar: tarfile.TarFile, manifest: Dict[str, Any], path: str) -> None:
+    __check_manifest(manifest, __check_members(tar))
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(path, filter="tar")
+    else:
+        tar.extractall(path)
+
+
+def __publish(source: str, destination: str) -> bool:
+    """
+    Move an extracted directory into the cache, unless the cache already has it
+
+    :return: True if the directory is moved
+    """
+    if os.path.exists(destination):
+        return False
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.rename(source, destination)
+    return True
+
+
+def __relocate_origin(props: TaskProperties, old_mirrors_path: str) -> None:
+    # Tasks are cloned from the mirror, which has moved along with the cache
+    mirror = f"{props.organization}/{props.name}.git"
+    with Repo(props.repo_path) as repo:
+        if "origin" in repo.remotes and repo.remotes.origin.url == os.path.join(old_mirrors_path, mirror):
+            repo.git.remote("set-url", "origin", os.path.join(preparer.mirrors_path, mirror))
+
+
+def import_tasks(archive: str | os.PathLike) -> List[TaskProperties]:
+    """
+    Import the tasks of an archive created by export_tasks. The archive is extracted next to the cache, after which
+    every task, virtual environment and mirror that is not installed yet is moved into the cache. Tasks that are
+    already installed are kept as is.
+
+    :param archive: the archive (.tar.gz)
+    :return: the tasks that have been imported
+    :raises ValueError: if the archive is not valid, or if it was created for another interpreter that is not
+                        available
+    """
+    staging_root = os.path.join(preparer.cache_path, STAGING_PATH)
+    os.makedirs(staging_root, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix="import-", dir=staging_root)
+    imported: List[TaskProperties] = []
+    try:
+        with tarfile.open(archive, "r:gz") as tar:
+            manifest = __read_manifest(tar)
+            __extract(tar, manifest, staging)
+        old_venvs_path = manifest["venvs-path"]
+        for key in manifest["venvs"]:
+            venv_path = os.path.join(preparer.venvs_path, key)
+            with __file_lock(f"venv-{key}"):
+                source = os.path.join(staging, "venvs", key)
+                # The virtualenv is only complete once its scripts refer to the new location
+                marker = os.path.join(source, VENV_COMPLETE)
+                if os.path.exists(marker):
+                    os.remove(marker)
+                if __publish(source, venv_path):
+                    relocate_venv(venv_path, os.path.join(old_venvs_path, key))
+                    Path(os.path.join(venv_path, VENV_COMPLETE)).touch()
+        for mirror in manifest["mirrors"]:
+            organization, name = mirror.split("/")
+            with __file_lock(f"mirror-{organization}-{name[:-len('.git')]}"):
+                __publish(os.path.join(staging, "mirrors", mirror), os.path.join(preparer.mirrors_path, mirror))
+        old_mirrors_path = manifest["mirrors-path"]
+        for entry in manifest["tasks"]:
+            props = TaskProperties.of(entry["task"])
+            source = os.path.join(staging, "tasks", props.organization, props.name, props.version)
+            with __file_lock(f"task-{props}"):
+                if not __publish(source, str(props.task_path)):
+                    logger.debug(f"Task '{props}' is already installed, skipping")
+                    continue
+                __relocate_origin(props, old_mirrors_path)
+                __load_installed_task(props)
+            logger.debug(f"Imported task '{props}' at commit {entry['commit']}")
+            imported.append(props)
+        preparer.task_index.save()
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return imported
+
@@ -83,6 +83,7 @@ def _build_names(environment: JobEnvironment) -> Dict[str, Any]:
         "inputs": _Namespace(environment.inputs),
         "env": _Namespace(_coerce_env(environment.environment)),
         "tasks": _Namespace(tasks_ctx),
+        "needs": _Namespace(environment.needs),
     }
 
 
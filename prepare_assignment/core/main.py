@@ -1,17 +1,27 @@
+import asyncio
 import logging
+import multiprocessing
 import os
+import sys
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from prepare_toolbox.file import get_matching_files
 
 from prepare_assignment.core.preparer import prepare_tasks
 from prepare_assignment.core.runner import run
 from prepare_assignment.core.validator import validate_prepare
-from prepare_assignment.data.constants import CONFIG
+from prepare_assignment.data.config import Core
+from prepare_assignment.data.constants import CONFIG, set_core
 from prepare_assignment.data.errors import PrepareTaskError, PrepareError, TaskExecutionError
 from prepare_assignment.data.prepare import Prepare
+from prepare_assignment.data.task_definition import TaskDefinition, ValidableTask
+from prepare_assignment.data.task_event import TaskEvent
+from prepare_assignment.data.task_properties import TaskProperties
 from prepare_assignment.utils.logger import add_logging_level, set_logger_level
+from prepare_assignment.utils.metrics import enable_metrics, record_run, write_metrics
+from prepare_assignment.utils.tracing import add_events, enable_tracing, has_span_listeners, is_tracing, span, \
+    take_events
 from prepare_assignment.utils.yml_loader import YAML_LOADER
 
 
@@ -40,14 +50,69 @@ def __get_prepare_file(file: Optional[str]) -> str:
     return file
 
 
-def prepare(file_name: Optional[str], env_vars: Optional[Dict[str, str]] = None) -> None:
-    env_vars = env_vars or {}
-    # Set the logger
-    add_logging_level("TRACE", logging.DEBUG - 5, "trace")
+def __set_loggers() -> logging.Logger:
+    """
+    Set the levels and handlers of the loggers, only the first call has effect
+
+    :return: the logger of prepare assignment
+    """
     logger = logging.getLogger("prepare_assignment")
+    if hasattr(logging, "TRACE"):
+        return logger
+    add_logging_level("TRACE", logging.DEBUG - 5, "trace")
     tasks_logger = logging.getLogger("tasks")
     set_logger_level(logger, CONFIG.core.debug)
     set_logger_level(tasks_logger, CONFIG.core.verbose, prefix="\t[TASK] ", debug_linenumbers=False)
+    return logger
+
+
+def __collect_garbage(mapping: Dict[str, TaskDefinition]) -> None:
+    """
+    Remove the least recently used tasks if the cache is larger than 'core.cache-max-size', the tasks of the current
+    run are kept. Collecting garbage never fails the run.
+
+    :param mapping: the tasks that are used by the current run
+    :return: None
+    """
+    if CONFIG.core.cache_max_size is None:
+        return
+    from prepare_assignment.utils.task_gc import collect_garbage_automatically, parse_size
+    logger = logging.getLogger("prepare_assignment")
+    try:
+        keep = [TaskProperties.of(task) for task in mapping]
+        result = collect_garbage_automatically(parse_size(CONFIG.core.cache_max_size), keep)
+        if result is not None and len(result.tasks) > 0:
+            logger.debug(f"Removed {len(result.tasks)} least recently used task(s), freed {result.freed} bytes")
+    except Exception as e:
+        logger.debug(f"Unable to collect garbage in the cache: {e}")
+
+
+def __write_metrics(results: List[bool]) -> None:
+    """
+    Add the metrics of the runs to 'core.metrics-file'. Writing the metrics never fails the run.
+
+    :param results: for every run True if it succeeded
+    :return: None
+    """
+    if CONFIG.core.metrics_file is None:
+        return
+    logger = logging.getLogger("prepare_assignment")
+    try:
+        for succeeded in results:
+            record_run(succeeded)
+        write_metrics(enable_metrics(), CONFIG.core.metrics_file)
+    except Exception as e:
+        logger.warning(f"Unable to write metrics to '{CONFIG.core.metrics_file}': {e}")
+
+
+def prepare(file_name: Optional[str], env_vars: Optional[Dict[str, str]] = None) -> None:
+    env_vars = env_vars or {}
+    # Set the logger
+    logger = __set_loggers()
+    mapping: Optional[Dict[str, TaskDefinition]] = None
+    succeeded = False
+    if CONFIG.core.metrics_file is not None:
+        enable_metrics()
 
     try:
         # Get the prepare_assignment.yml file
@@ -56,20 +121,18 @@ def prepare(file_name: Optional[str], env_vars: Optional[Dict[str, str]] = None)
 
         # Load the file
         path = Path(file)
-        yaml = YAML_LOADER.load(path)
-
-        # Check if we have to change working directory
-        dirname = os.path.dirname(path)
-        if dirname:
-            os.chdir(dirname)
+        with span("load prepare file", "prepare", file=file):
+            yaml = YAML_LOADER.load(path)
+            validate_prepare(file, yaml)
 
         # Prepare
-        validate_prepare(file, yaml)
         mapping = prepare_tasks(file, yaml['jobs'])
         prepare = Prepare.of(yaml)
 
-        # Execute
-        run(prepare, mapping, env_vars)
+        # Execute, the tasks run in the directory of the prepare file
+        with span("run", "run", file=file):
+            run(prepare, mapping, env_vars, cwd=os.path.dirname(os.path.abspath(path)))
+        succeeded = True
     except TaskExecutionError as e:
         logger.error(e.message)
         raise
@@ -82,4 +145,189 @@ def prepare(file_name: Optional[str], env_vars: Optional[Dict[str, str]] = None)
         raise
     except Exception as e:
         logger.error(str(e))
-        raise
\ No newline at end of file
+        raise
+    finally:
+        if mapping is not None:
+            __collect_garbage(mapping)
+        __write_metrics([succeeded])
+
+
+async def prepare_async(file_name: Optional[str],
+                        env_vars: Optional[Dict[str, str]] = None) -> AsyncIterator[TaskEvent]:
+    """
+    Prepare an assignment from asyncio code, e.g. a web service. The commands the tasks send (like 'set-output' and
+    'error') are yielded while the tasks run. Preparing the tasks (git, virtual environments and pip) and running the
+    jobs (like run does) is done in separate threads, the tasks run in the directory of the prepare file. Unlike
+    prepare, the loggers are not configured.
+
+    Closing the generator, or cancelling the task that iterates over it, kills the running tasks. Preparing the tasks
+    cannot be cancelled: when the generator is cancelled while the tasks are prepared, it stops waiting right away and
+    no task is run, but the git, virtualenv and pip processes that are already running finish in the background
+    thread (the tasks are still installed in the cache).
+
+    :param file_name: the prepare file, if None the prepare file in the working directory is used
+    :param env_vars: extra environment variables
+    :return: the commands that are sent by the tasks
+    :raises TaskExecutionError: if a job failed
+    :raises PrepareTaskError: if a task could not be prepared
+    """
+    from prepare_assignment.core.async_runner import run_async
+
+    def load() -> Tuple[str, Prepare, Dict[str, TaskDefinition]]:
+        file = __get_prepare_file(file_name)
+        yaml = YAML_LOADER.load(Path(file))
+        validate_prepare(file, yaml)
+        mapping = prepare_tasks(file, yaml['jobs'])
+        return file, Prepare.of(yaml), mapping
+
+    file, prepare, mapping = await asyncio.to_thread(load)
+    events: asyncio.Queue[Optional[TaskEvent]] = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    def emit(event: TaskEvent) -> None:
+        # The tasks run in other threads
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    async def execute() -> None:
+        try:
+            cwd = os.path.dirname(os.path.abspath(file))
+            await run_async(prepare, mapping, cwd, emit, env_vars)
+        finally:
+            events.put_nowait(None)
+
+    runner = asyncio.ensure_future(execute())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        await runner
+    finally:
+        if not runner.done():
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+
+def find_prepare_files(paths: List[str]) -> List[str]:
+    """
+    Find the prepare files, a path is either a prepare file or a directory that is searched (recursively) for
+    prepare.y(a)ml files. Hidden directories are skipped.
+
+    :param paths: the files and directories
+    :return: the absolute paths of the prepare files, in order of the paths and sorted per directory
+    :raises FileNotFoundError: if a path doesn't exist
+    """
+    found: Dict[str, None] = {}
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            found[path] = None
+            continue
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"Supplied path: '{path}' is not a file or directory")
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in ("prepare.yml", "prepare.yaml"):
+                if name in files:
+                    found[os.path.join(root, name)] = None
+    return list(found.keys())
+
+
+# The definitions of the tasks, shared by all assignments that are prepared by a worker process
+__mapping: Dict[str, TaskDefinition] = {}
+
+
+def __init_worker(mapping: Dict[str, TaskDefinition], core: Core, tracing: bool) -> None:
+    global __mapping
+    __mapping = mapping
+    # Worker processes that are spawned instead of forked don't have the settings of the command line
+    set_core(core)
+    __set_loggers()
+    # The spans are sent to the main process, for its trace or its metrics
+    if tracing:
+        enable_tracing()
+    # Forked workers inherit the spans of the main process
+    take_events()
+
+
+def __run_assignment(file: str, prepare: Prepare, env_vars: Dict[str, str]) -> Optional[str]:
+    """
+    Run the jobs of an assignment of which the tasks are already prepared
+
+    :return: None if the assignment is prepared, otherwise the error message
+    """
+    try:
+        with span("run", "run", file=file):
+            run(prepare, __mapping, env_vars, cwd=os.path.dirname(file))
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def __run_assignment_in_worker(file: str, prepare: Prepare,
+                               env_vars: Dict[str, str]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """
+    Run an assignment in a worker process (see __run_assignment)
+
+    :return: the result of __run_assignment and the spans that have been recorded, to add them to the trace of the
+             main process
+    """
+    return __run_assignment(file, prepare, env_vars), take_events()
+
+
+def prepare_many(files: List[str], env_vars: Optional[Dict[str, str]] = None,
+                 processes: Optional[int] = None) -> Dict[str, Optional[str]]:
+    """
+    Prepare many assignments at once. The prepare files are validated and their tasks are prepared in this process, so
+    every task is only loaded (and validated) once. The jobs are then run by a pool of processes that share the
+    definitions of the tasks.
+
+    :param files: the prepare files
+    :param env_vars: extra environment variables
+    :param processes: the number of processes that run assignments, defaults to the number of CPUs
+    :return: for every prepare file None if it is prepared, otherwise the error message
+    """
+    global __mapping
+    env_vars = env_vars or {}
+    logger = __set_loggers()
+    if CONFIG.core.metrics_file is not None:
+        enable_metrics()
+    results: Dict[str, Optional[str]] = {}
+    to_run: List[Tuple[str, Prepare]] = []
+    parsed: Dict[str, ValidableTask] = {}
+    for file in files:
+        try:
+            with span("load prepare file", "prepare", file=file):
+                yaml = YAML_LOADER.load(Path(file))
+                validate_prepare(file, yaml)
+            prepare_tasks(file, yaml['jobs'], parsed)
+            to_run.append((file, Prepare.of(yaml)))
+        except PrepareTaskError as e:
+            cause = e.cause.message if isinstance(e.cause, PrepareError) else str(e.cause)
+            results[file] = f"{e.message}: {cause}"
+        except Exception as e:
+            results[file] = str(e)
+    mapping = {key: value["task"] for key, value in parsed.items()}
+
+    processes = max(1, min(processes or os.cpu_count() or 1, len(to_run)))
+    if processes == 1:
+        __mapping = mapping
+        for file, prepare in to_run:
+            results[file] = __run_assignment(file, prepare, env_vars)
+    else:
+        # Forked workers inherit the loaded modules, the others have to import everything again
+        context = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn")
+        with context.Pool(processes, initializer=__init_worker,
+                          initargs=(mapping, CONFIG.core, is_tracing() or has_span_listeners())) as pool:
+            pending = [(file, pool.apply_async(__run_assignment_in_worker, (file, prepare, env_vars)))
+                       for file, prepare in to_run]
+            for file, result in pending:
+                results[file], events = result.get()
+                add_events(events)
+    for file, message in results.items():
+        if message is not None:
+            logger.error(f"Unable to prepare '{file}': {message}")
+    __collect_garbage(mapping)
+    __write_metrics([message is None for message in results.values()])
+    return {file: results[file] for file in files}
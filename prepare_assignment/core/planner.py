@@ -0,0 +1,151 @@
+import posixpath
+import re
+from typing import Any, Final, List, Optional, Set
+
+from prepare_assignment.data.constants import HAS_SUB_REGEX
+from prepare_assignment.data.prepare import Task
+
+# References to the outputs of another task, e.g. tasks.build.outputs or tasks['build'].outputs
+TASK_REF_REGEX: Final[re.Pattern] = re.compile(
+    r"\btasks\s*(?:\.\s*(?P<attr>[a-zA-Z_][a-zA-Z0-9_-]*)|\[\s*(?P<quote>['\"])(?P<item>.*?)(?P=quote)\s*])"
+)
+TASKS_REGEX: Final[re.Pattern] = re.compile(r"\btasks\b")
+# Expressions that depend on the status of the job, or on environment variables that earlier tasks might have set
+STATUS_REGEX: Final[re.Pattern] = re.compile(r"\b(success|failure|always)\s*\(")
+ENV_REGEX: Final[re.Pattern] = re.compile(r"\benv\b")
+# Shell variables in a run command, e.g. $VAR or ${VAR:-default}, these might have been set by an earlier task
+SHELL_VARIABLE_REGEX: Final[re.Pattern] = re.compile(r"\$(?:[a-zA-Z_]|\{[^{])")
+# Command a task uses to set an environment variable for the tasks after it
+SET_ENV_COMMAND: Final[str] = "set-env"
+GLOB_CHARACTERS: Final[str] = "*?["
+
+
+def __strings(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [string for item in value for string in __strings(item)]
+    if isinstance(value, dict):
+        return [string for item in value.values() for string in __strings(item)]
+    return []
+
+
+def expressions(task: Task) -> List[str]:
+    """
+    Get the expressions of a task: the contents of the ${{ }} blocks of 'run' and 'with' and the 'if' condition
+
+    :param task: the task
+    :return: the expressions
+    """
+    values = __strings(task.run) if task.is_run else __strings(task.with_)  # type: ignore
+    result = [block.group("content") for value in values for block in HAS_SUB_REGEX.finditer(value)]
+    if task.if_ is not None:
+        result.append(task.if_)
+    return result
+
+
+def referenced_tasks(task: Task) -> Optional[Set[str]]:
+    """
+    Get the keys of the tasks whose outputs are used by a task
+
+    :param task: the task
+    :return: the keys of the referenced tasks, None if a reference cannot be determined (e.g. tasks[some_variable])
+    """
+    references: Set[str] = set()
+    for expression in expressions(task):
+        matches = list(TASK_REF_REGEX.finditer(expression))
+        if len(matches) != len(TASKS_REGEX.findall(expression)):
+            return None
+        references.update(match.group("attr") or match.group("item") for match in matches)
+    return references
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalize a declared path, a glob is reduced to the directory in front of the first wildcard
+
+    :param path: the declared path
+    :return: the normalized path, '.' for the working directory
+    """
+    parts: List[str] = []
+    for part in path.replace("\\", "/").split("/"):
+        if any(character in part for character in GLOB_CHARACTERS):
+            break
+        parts.append(part)
+    normalized = posixpath.normpath("/".join(parts)) if len(parts) > 0 else "."
+    return "." if normalized == "" else normalized
+
+
+def paths_overlap(first: str, second: str) -> bool:
+    """
+    Check if two normalized paths overlap, i.e. if they are equal or if one contains the other
+
+    :param first: the first path
+    :param second: the second path
+    :return: True if the paths (might) overlap
+    """
+    # Relative and absolute paths cannot be compared without knowing the working directory
+    if first == "." or second == "." or first.startswith("..") or second.startswith(".."):
+        return True
+    if posixpath.isabs(first) != posixpath.isabs(second):
+        return True
+    return first == second or first.startswith(second.rstrip("/") + "/") or second.startswith(first.rstrip("/") + "/")
+
+
+def __declares_paths(task: Task) -> bool:
+    return len(task.reads) > 0 or len(task.writes) > 0
+
+
+def __reads_environment(task: Task) -> bool:
+    if not task.is_run:
+        return False
+    commands = [HAS_SUB_REGEX.sub("", value) for value in __strings(task.run)]  # type: ignore
+    return any(SHELL_VARIABLE_REGEX.search(command) for command in commands)
+
+
+def __sets_environment(task: Task) -> bool:
+    return task.is_run and any(SET_ENV_COMMAND in value for value in __strings(task.run))  # type: ignore
+
+
+def __conflicts(task: Task, previous: Task) -> bool:
+    writes = [normalize_path(path) for path in task.writes]
+    previous_writes = [normalize_path(path) for path in previous.writes]
+    accessed = [normalize_path(path) for path in task.reads] + writes
+    previous_accessed = [normalize_path(path) for path in previous.reads] + previous_writes
+    return (any(paths_overlap(path, other) for path in writes for other in previous_accessed)
+            or any(paths_overlap(path, other) for path in accessed for other in previous_writes))
+
+
+def plan_steps(tasks: List[Task]) -> List[Set[int]]:
+    """
+    Determine which of the earlier tasks every task has to wait for.
+
+    A task depends on an earlier task if it uses its outputs or if the paths they declare (with 'reads' and 'writes')
+    conflict. If independence cannot be proven the task depends on all earlier tasks, this is the case for tasks that
+    don't declare paths, use the status of the job or environment variables (also shell variables in a run command),
+    set environment variables with set-env, or reference tasks dynamically. The tasks after a task that sets
+    environment variables all depend on it.
+
+    :param tasks: the tasks of a job, in order of definition
+    :return: for every task the indices of the earlier tasks it depends on
+    """
+    plan: List[Set[int]] = []
+    for index, task in enumerate(tasks):
+        references = referenced_tasks(task)
+        sequential = (references is None
+                      or not __declares_paths(task)
+                      or __reads_environment(task)
+                      or __sets_environment(task)
+                      or any(STATUS_REGEX.search(expression) or ENV_REGEX.search(expression)
+                             for expression in expressions(task)))
+        dependencies: Set[int] = set()
+        for previous_index in range(index):
+            previous = tasks[previous_index]
+            if (sequential
+                    or not __declares_paths(previous)
+                    or __sets_environment(previous)
+                    or previous.key in references  # type: ignore
+                    or __conflicts(task, previous)):
+                dependencies.add(previous_index)
+        plan.append(dependencies)
+    return plan
@@ -1,3 +1,6 @@
+from __future__ import annotations
+
+import hashlib
 import json
 import logging
 import os
@@ -5,40 +8,77 @@ import re
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Deque, Set, Tuple
 
-from git import Repo, Git
+from git import Repo, Git, GitCommandError
 from importlib_resources import files
-from packaging.version import Version, InvalidVersion
 from virtualenv import cli_run
 
-from prepare_assignment.data.constants import CONFIG
+from prepare_assignment.data.constants import CONFIG, STAGING_PATH
 from prepare_assignment.core.validator import validate_task_definition, validate_tasks, load_yaml, \
     validate_default_values
 from prepare_assignment.data.errors import DependencyError, ValidationError, PrepareTaskError
 from prepare_assignment.data.task_definition import TaskDefinition, CompositeTaskDefinition, \
     PythonTaskDefinition, ValidableTask
+from prepare_assignment.data.prepare import Job
 from prepare_assignment.data.task_properties import TaskProperties
-from prepare_assignment.utils.paths import get_cache_path, get_tasks_path
+from prepare_assignment.utils.file_lock import FileLock, cache_lock
+from prepare_assignment.utils.paths import get_cache_path, get_tasks_path, get_venvs_path, get_mirrors_path
+from prepare_assignment.utils.tag_cache import TagCache
+from prepare_assignment.utils.task_index import get_task_index, schema_path
+from prepare_assignment.utils.task_graph import TaskGraph, get_sub_tasks, resolve_task_graph
+from prepare_assignment.utils.tracing import span
+from prepare_assignment.utils.virtual_env import get_python_executable, get_task_venv, set_venv_key, clone_venv, \
+    VENV_COMPLETE, VENV_TEMPLATE_PREFIX
 
 # Set the cache path
 cache_path = get_cache_path()
 tasks_path = get_tasks_path()
+venvs_path = get_venvs_path()
+mirrors_path = get_mirrors_path()
+# Make sure the same virtualenv is not created concurrently
+venv_locks: Dict[str, threading.Lock] = {}
+venv_locks_guard = threading.Lock()
+# Make sure a mirror is not created or fetched concurrently, and only fetched once per process
+mirror_locks: Dict[str, threading.Lock] = {}
+mirror_locks_guard = threading.Lock()
+fetched_mirrors: Set[str] = set()
 # Get the logger
 logger = logging.getLogger("prepare_assignment")
+# Remote tags, shared by all tasks that are prepared in this process
+tag_cache = TagCache(Path(os.path.join(cache_path, "tags")))
+# Parsed definitions and schemas of the installed tasks
+task_index = get_task_index()
 # Load the task template file
 template_file = files().joinpath('../schemas/task.schema.json_template')
 template: str = template_file.read_text()
 
 
 _COMMIT_HASH_RE = re.compile(r'^[0-9a-f]{40}$')
+# Versions that follow the repository, the other versions are (assumed to be) immutable
+UPDATABLE_VERSIONS = ("latest", "main")
+
 
+def __file_lock(name: str) -> FileLock:
+    """
+    Get the lock of a resource in the cache, see cache_lock
 
-def __resolve_version(git_url: str, version: str) -> Optional[str]:
+    :param name: the name of the resource
+    :return: the lock
+    """
+    return cache_lock(cache_path, name)
+
+
+def __resolve_version(git_url: str, version: str, ttl: Optional[int] = None) -> Optional[str]:
     """
     Resolve a version string to a concrete git ref by inspecting remote tags.
+    The remote tags are cached, see 'core.tag-cache-ttl', unless another ttl is given.
 
     - "main"    → "main" (latest commit on main branch)
     - "latest"  → highest semver tag; None if no tags exist (falls back to default branch)
@@ -53,71 +93,116 @@ def __resolve_version(git_url: str, version: str) -> Optional[str]:
     if _COMMIT_HASH_RE.match(version):
         return version
 
-    raw = Git().ls_remote("--tags", git_url)
-    all_tags: List[str] = []
-    for line in raw.splitlines():
-        parts = line.split("\t")
-        if len(parts) != 2:
-            continue
-        ref = parts[1]
-        if ref.endswith("^{}"):
-            continue
-        all_tags.append(ref.replace("refs/tags/", ""))
+    if ttl is None:
+        ttl = CONFIG.core.tag_cache_ttl
+    with span("resolve version", "prepare", url=git_url, version=version) as attributes:
+        attributes["tag cache"] = "hit"
 
-    def as_version(tag: str) -> Optional[Version]:
-        try:
-            return Version(tag)
-        except InvalidVersion:
-            return None
+        def ls_remote() -> str:
+            attributes["tag cache"] = "miss"
+            return str(Git().ls_remote("--tags", git_url))
+        tags = tag_cache.get(git_url, ls_remote, ttl)
 
     if version == "latest":
-        versioned = [(as_version(t), t) for t in all_tags]
-        valid = [(v, t) for v, t in versioned if v is not None]
-        if valid:
-            return max(valid, key=lambda x: x[0])[1]
-        return None  # no tags → clone default branch HEAD
+        # no tags → clone default branch HEAD
+        return tags.latest()
 
     # Exact tag match
-    if version in all_tags:
+    if version in tags:
         return version
 
     # Prefix match (e.g. "v1" → "v1.1.2")
-    prefix_matches = [(as_version(t), t) for t in all_tags if t.startswith(version)]
-    valid_prefix = [(v, t) for v, t in prefix_matches if v is not None]
-    if valid_prefix:
-        return max(valid_prefix, key=lambda x: x[0])[1]
+    prefix_match = tags.highest_with_prefix(version)
+    if prefix_match is not None:
+        return prefix_match
 
     # Fallback (branch name, partial ref, etc.)
     return version
 
 
-def __download_task(props: TaskProperties) -> Path:
+def __has_ref(repo: Repo, ref: str) -> bool:
+    try:
+        repo.git.rev_parse("--verify", "--quiet", f"{ref}^{{commit}}")
+        return True
+    except GitCommandError:
+        return False
+
+
+def __update_mirror(git_url: str, props: TaskProperties, resolved: Optional[str]) -> Path:
     """
-    Download the task (using git clone)
+    Make sure the bare mirror of the task repository exists and contains the resolved ref.
+    The mirror is shared by all versions of the task, so the objects are only downloaded once.
 
+    :param git_url: the url of the repository
     :param props: task properties
-    :returns Path: the path where the repo is checked out
+    :param resolved: the resolved version, None for the default branch
+    :returns Path: the path of the mirror
     """
-    props.repo_path.mkdir(parents=True, exist_ok=True)
+    mirror_path = Path(os.path.join(mirrors_path, props.organization, f"{props.name}.git"))
+    key = str(mirror_path)
+    with mirror_locks_guard:
+        lock = mirror_locks.setdefault(key, threading.Lock())
+    with span("mirror", "prepare", url=git_url) as attributes, lock, \
+            __file_lock(f"mirror-{props.organization}-{props.name}"):
+        attributes["action"] = "none"
+        if not os.path.isdir(mirror_path):
+            logger.debug(f"Creating mirror of repository: {git_url}")
+            attributes["action"] = "clone"
+            mirror_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                Git().clone("--mirror", git_url, str(mirror_path))
+            except Exception:
+                shutil.rmtree(mirror_path, ignore_errors=True)
+                raise
+            fetched_mirrors.add(key)
+            return mirror_path
+        if key in fetched_mirrors:
+            return mirror_path
+        with Repo(mirror_path) as repo:
+            # Tags and commits are (assumed to be) immutable, only fetch if we don't have them yet
+            if resolved is not None and resolved != "main" and __has_ref(repo, resolved):
+                return mirror_path
+            logger.debug(f"Fetching mirror of repository: {git_url}")
+            attributes["action"] = "fetch"
+            repo.git.fetch("--prune", "origin")
+        fetched_mirrors.add(key)
+    return mirror_path
+
+
+def __git_url(props: TaskProperties) -> str:
     if CONFIG.core.git_mode == "https":
-        git_url = f"https://github.com/{props.organization}/{props.name}.git"
-    else:
-        git_url = f"git@github.com:{props.organization}/{props.name}.git"
+        return f"https://github.com/{props.organization}/{props.name}.git"
+    return f"git@github.com:{props.organization}/{props.name}.git"
+
 
+def __download_task(props: TaskProperties, repo_path: Optional[Path] = None) -> Path:
+    """
+    Download the task, the version is cloned from the (local) mirror of the repository
+
+    :param props: task properties
+    :param repo_path: the path to check out the repository, defaults to the repository path of the task
+    :returns Path: the path where the repo is checked out
+    """
+    if repo_path is None:
+        repo_path = props.repo_path
+    repo_path.mkdir(parents=True, exist_ok=True)
+    git_url = __git_url(props)
     resolved = __resolve_version(git_url, props.version)
+    mirror_path = __update_mirror(git_url, props, resolved)
     logger.debug(f"Cloning repository: {git_url} at ref '{resolved or 'HEAD'}'")
 
-    if resolved is not None and _COMMIT_HASH_RE.match(resolved):
-        # Shallow clones cannot reach arbitrary commits; do a full clone then checkout
-        with Repo.clone_from(git_url, props.repo_path) as repo:
-            repo.git.checkout(resolved)
-    else:
-        clone_kwargs: Dict[str, Any] = {"depth": 1}
-        if resolved is not None:
-            clone_kwargs["branch"] = resolved
-        Repo.clone_from(git_url, props.repo_path, **clone_kwargs)
+    # A local clone hardlinks the objects of the mirror, so it is cheap in both time and disk space
+    with span("clone", "prepare", task=str(props), ref=resolved or "HEAD"):
+        if resolved is not None and _COMMIT_HASH_RE.match(resolved):
+            with Repo.clone_from(str(mirror_path), repo_path, no_checkout=True) as repo:
+                repo.git.checkout(resolved)
+        else:
+            clone_kwargs: Dict[str, Any] = {}
+            if resolved is not None:
+                clone_kwargs["branch"] = resolved
+            Repo.clone_from(str(mirror_path), repo_path, **clone_kwargs)
 
-    return props.repo_path
+    return repo_path
 
 
 def __build_json_schema(props: TaskProperties, task: TaskDefinition) -> str:
@@ -148,11 +233,70 @@ def __build_json_schema(props: TaskProperties, task: TaskDefinition) -> str:
     return schema
 
 
-def __task_install_dependencies(task_path: Path) -> None:
-    if sys.platform == "win32":
-        venv_path = os.path.join(task_path, "venv", "Scripts", "python.exe")
-    else:
-        venv_path = os.path.join(task_path, "venv", "bin", "python")
+def get_wheelhouse_path() -> Path:
+    """
+    Get the path of the wheelhouse, the directory with wheels that is used for offline installs
+
+    :return: the configured wheelhouse, defaults to 'wheelhouse' in the cache directory
+    """
+    if CONFIG.core.wheelhouse:
+        return Path(CONFIG.core.wheelhouse).expanduser()
+    return Path(os.path.join(cache_path, "wheelhouse"))
+
+
+def __pip_index_args() -> List[str]:
+    """
+    Get the arguments for pip that determine where packages are retrieved from
+
+    :return: the arguments, when offline only the wheelhouse is used
+    :raises DependencyError: if offline and there is no wheelhouse
+    """
+    if not CONFIG.core.offline:
+        return []
+    wheelhouse = get_wheelhouse_path()
+    if not os.path.isdir(wheelhouse):
+        raise DependencyError(f"No wheelhouse available at '{wheelhouse}', "
+                              f"use 'prepare tasks prefetch-wheels' to create one")
+    return ["--no-index", "--find-links", str(wheelhouse)]
+
+
+def __build_requirements(pyproject_path: str) -> List[str]:
+    """
+    Get the packages needed to build a project, see PEP 518
+
+    :param pyproject_path: the path to the pyproject.toml
+    :return: the build requirements
+    """
+    # If there is no build system, pip falls back to setuptools
+    default = ["setuptools>=40.8.0", "wheel"]
+    try:
+        import tomllib  # type: ignore
+    except ImportError:
+        try:
+            import tomli as tomllib  # type: ignore
+        except ImportError:
+            logger.warning(f"Unable to read '{pyproject_path}', assuming it is built with setuptools")
+            return default
+    with open(pyproject_path, "rb") as handle:
+        pyproject = tomllib.load(handle)
+    requires = pyproject.get("build-system", {}).get("requires", None)
+    return requires if isinstance(requires, list) else default
+
+
+def __raise_dependency_error(result: subprocess.CompletedProcess[Any], message: str) -> None:
+    log_path = os.path.join(cache_path, "logs")
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    Path(log_path).mkdir(parents=True, exist_ok=True)
+    fd, file = tempfile.mkstemp(prefix=f"{timestamp}-", suffix="-dependencies.log", dir=log_path)
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(result.stderr)
+    raise DependencyError(f"{message}, see '{file}' for more info")
+
+
+def __task_install_dependencies(task_path: Path, venv_path: Optional[str | os.PathLike] = None) -> None:
+    if venv_path is None:
+        venv_path = os.path.join(task_path, "venv")
+    executable = get_python_executable(venv_path)
     repo_path = os.path.join(task_path, "repo")
     requirements_path = os.path.join(repo_path, "requirements.txt")
     pyproject_path = os.path.join(repo_path, "pyproject.toml")
@@ -163,131 +307,413 @@ def __task_install_dependencies(task_path: Path) -> None:
         return
 
     result: Optional[subprocess.CompletedProcess[Any]] = None
-    if has_requirements:
-        logger.debug(f"Installing dependencies from '{requirements_path}'")
-        args = [venv_path] + f"-m pip install -r {requirements_path}".split(" ")
-        result = subprocess.run(args, capture_output=True)
-    elif has_pyproject:
-        logger.debug(f"Installing dependencies from '{pyproject_path}'")
-        args = [venv_path] + f"-m pip install .".split()
-        result = subprocess.run(args, capture_output=True, cwd=repo_path)
+    with span("pip install", "prepare", repository=repo_path) as attributes:
+        if has_requirements:
+            logger.debug(f"Installing dependencies from '{requirements_path}'")
+            args = [executable, "-m", "pip", "install", *__pip_index_args(), "-r", requirements_path]
+            result = subprocess.run(args, capture_output=True)
+        elif has_pyproject:
+            logger.debug(f"Installing dependencies from '{pyproject_path}'")
+            args = [executable, "-m", "pip", "install", *__pip_index_args(), "."]
+            result = subprocess.run(args, capture_output=True, cwd=repo_path)
+        attributes["exit code"] = result.returncode if result is not None else None
 
     if result is not None and result.returncode != 0:
-        log_path = os.path.join(cache_path, "logs")
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        file = os.path.join(log_path, f'{timestamp}-dependencies.log')
-        Path(log_path).mkdir(parents=True, exist_ok=True)
-        with open(file, 'wb') as handle:
-            handle.write(result.stderr)
-        raise DependencyError(f"Unable to install dependencies for '{repo_path}', see '{file}' for more info")
-
-
-def __load_task_from_disk(props: TaskProperties, parsed: Dict[str, ValidableTask]) -> None:
-    logger.debug(f"Task '{props}' is already available, loading from disk")
-    with open(os.path.join(props.task_path, f"{props.name}.schema.json"), "r") as handle:
-        json_schema = json.load(handle)
-    task_yaml = load_yaml(props.definition_path)
-    task = TaskDefinition.of(task_yaml, props.task_path)
-    parsed[str(props)] = {"schema": json_schema, "task": task}
-    if isinstance(task, CompositeTaskDefinition):
-        for sub_task in task.tasks:
-            sub_task_name = sub_task.get("uses", None)
-            if sub_task_name is None:
-                continue
-            sub_props = TaskProperties.of(sub_task_name)
-            __load_task_from_disk(sub_props, parsed)
+        __raise_dependency_error(result, f"Unable to install dependencies for '{repo_path}'")
 
 
-def __prepare_task(props: TaskProperties) -> ValidableTask:
+def download_wheels(props: TaskProperties, wheelhouse: Path) -> None:
+    """
+    Download (or build) the wheels of all dependencies of a task into the wheelhouse,
+    so the task can be installed without access to a package index.
+
+    :param props: the properties of the (installed) task
+    :param wheelhouse: the directory to store the wheels in
+    :return: None
+    :raises DependencyError: if pip is unable to retrieve the wheels
+    """
+    executable = get_python_executable(get_task_venv(props.task_path))
+    requirements_path = os.path.join(props.repo_path, "requirements.txt")
+    pyproject_path = os.path.join(props.repo_path, "pyproject.toml")
+    pip_wheel = [executable, "-m", "pip", "wheel", "--wheel-dir", str(wheelhouse)]
+    commands: List[List[str]] = []
+    if os.path.isfile(requirements_path):
+        commands.append(pip_wheel + ["-r", requirements_path])
+    elif os.path.isfile(pyproject_path):
+        # Installing the task itself requires its build backend to be available as well
+        commands.append(pip_wheel + __build_requirements(pyproject_path))
+        commands.append(pip_wheel + ["."])
+    for args in commands:
+        logger.debug(f"Retrieving wheels for '{props}'")
+        result = subprocess.run(args, capture_output=True, cwd=props.repo_path)
+        if result.returncode != 0:
+            __raise_dependency_error(result, f"Unable to retrieve wheels for '{props}'")
+
+
+def __tree_hash(repo_path: Path) -> str:
+    """
+    Get a hash of all files in the repository, used when dependencies refer to the repository itself
+
+    :param repo_path: the path of the repository
+    :return: the hash
+    """
+    try:
+        with Repo(repo_path) as repo:
+            return str(repo.head.commit.tree.hexsha)
+    except Exception:
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(repo_path):
+            dirs[:] = sorted(d for d in dirs if d != ".git")
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, repo_path).encode("utf-8"))
+                with open(path, "rb") as handle:
+                    digest.update(handle.read())
+        return digest.hexdigest()
+
+
+def __venv_key(repo_path: Path) -> str:
+    """
+    Get the key of the virtual environment in the pool, based on the interpreter and the requirements of the task.
+    Tasks with the same key share the same virtual environment.
+
+    :param repo_path: the path of the repository of the task
+    :return: the key
+    """
+    digest = hashlib.sha256()
+    requirements_path = os.path.join(repo_path, "requirements.txt")
+    pyproject_path = os.path.join(repo_path, "pyproject.toml")
+    if os.path.isfile(requirements_path):
+        with open(requirements_path, "rb") as handle:
+            requirements = handle.read()
+        digest.update(b"requirements.txt\0" + requirements)
+        # Requirements that refer to other files (e.g. '-r', '-e .') depend on the contents of the repository
+        lines = [line.strip() for line in requirements.splitlines()]
+        if any(line.startswith((b"-", b".", b"/", b"file:")) for line in lines):
+            digest.update(__tree_hash(repo_path).encode("utf-8"))
+    elif os.path.isfile(pyproject_path):
+        # The task itself is installed as well, so the key depends on all files in the repository
+        digest.update(b"pyproject.toml\0" + __tree_hash(repo_path).encode("utf-8"))
+    implementation = sys.implementation.name
+    version = ".".join(str(part) for part in sys.version_info[:3])
+    return f"{implementation}-{version}-{digest.hexdigest()[:32]}"
+
+
+def __venv_lock(key: str) -> threading.Lock:
+    with venv_locks_guard:
+        return venv_locks.setdefault(key, threading.Lock())
+
+
+def __venv_template() -> Optional[Path]:
+    """
+    Get the template virtualenv for the current interpreter, it is created the first time it is needed.
+
+    :return: the path of the template, None if virtualenvs cannot be cloned on this platform
+    """
+    if sys.platform == "win32":
+        return None
+    implementation = sys.implementation.name
+    version = ".".join(str(part) for part in sys.version_info[:3])
+    interpreter = hashlib.sha256(sys.executable.encode("utf-8")).hexdigest()[:16]
+    name = f"{VENV_TEMPLATE_PREFIX}{implementation}-{version}-{interpreter}"
+    template_path = Path(os.path.join(venvs_path, name))
+    with __venv_lock(name), __file_lock(f"venv-{name}"):
+        if not os.path.isfile(os.path.join(template_path, VENV_COMPLETE)):
+            shutil.rmtree(template_path, ignore_errors=True)
+            logger.debug(f"Creating virtualenv template '{name}'")
+            with span("cli_run", "prepare", path=str(template_path)):
+                cli_run([str(template_path)])
+            Path(os.path.join(template_path, VENV_COMPLETE)).touch()
+    return template_path
+
+
+def __create_venv(venv_path: Path) -> None:
+    """
+    Create a virtualenv, by cloning the template if possible as that is a lot faster than bootstrapping one
+
+    :param venv_path: the path of the virtualenv
+    :return: None
+    """
     try:
-        # Download the task (clone the repository)
-        __download_task(props)
-        # Validate that the task.yml is valid
-        task_yaml = validate_task_definition(props.definition_path)
+        template_path = __venv_template()
+        if template_path is not None:
+            with span("clone virtualenv", "prepare", path=str(venv_path)):
+                clone_venv(template_path, venv_path)
+            return
+    except Exception as e:
+        logger.debug(f"Unable to clone virtualenv template, creating virtualenv instead: {e}")
+        shutil.rmtree(venv_path, ignore_errors=True)
+    with span("cli_run", "prepare", path=str(venv_path)):
+        cli_run([str(venv_path)])
+
+
+def __prepare_venv(props: TaskProperties, task_path: Optional[Path] = None) -> str:
+    """
+    Make sure the virtual environment for the task is available in the pool, create it if necessary.
+
+    :param props: the task properties
+    :param task_path: the directory the task is installed in, defaults to the path of the task
+    :return: the key of the virtual environment
+    """
+    if task_path is None:
+        task_path = props.task_path
+    key = __venv_key(Path(os.path.join(task_path, "repo")))
+    venv_path = Path(os.path.join(venvs_path, key))
+    complete_marker = os.path.join(venv_path, VENV_COMPLETE)
+    # Other processes might create the same virtualenv, so the marker is checked again once the lock is acquired
+    with span("virtualenv", "prepare", task=str(props), key=key) as attributes, __venv_lock(key), \
+            __file_lock(f"venv-{key}"):
+        attributes["cache"] = "hit"
+        if os.path.isfile(complete_marker):
+            logger.debug(f"Using virtualenv '{key}' for task '{props}'")
+            # The garbage collector doesn't remove virtualenvs that have been used recently
+            os.utime(complete_marker)
+            return key
+        attributes["cache"] = "miss"
+        # A virtualenv without marker is a leftover of an installation that didn't finish
+        if os.path.isdir(venv_path):
+            shutil.rmtree(venv_path)
+        logger.debug(f"Creating virtualenv '{key}' for task '{props}'")
+        try:
+            __create_venv(venv_path)
+            __task_install_dependencies(task_path, venv_path)
+            Path(complete_marker).touch()
+        except Exception:
+            shutil.rmtree(venv_path, ignore_errors=True)
+            raise
+    return key
+
+
+def __load_installed_task(props: TaskProperties) -> ValidableTask:
+    """
+    Load a task that is already installed, from the task index if possible
+
+    :param props: the task properties
+    :return: the parsed task definition and json schema
+    """
+    with span("load task", "prepare", task=str(props)) as attributes:
+        indexed = task_index.get(props)
+        if indexed is not None:
+            logger.debug(f"Task '{props}' is already available, loading from index")
+            attributes["index"] = "hit"
+            return indexed
+        logger.debug(f"Task '{props}' is already available, loading from disk")
+        attributes["index"] = "miss"
+        with open(schema_path(props), "r") as handle:
+            json_schema = json.load(handle)
+        task_yaml = load_yaml(props.definition_path)
+        valid_task: ValidableTask = {"schema": json_schema, "task": TaskDefinition.of(task_yaml, props.task_path)}
+        task_index.put(props, valid_task)
+    return valid_task
+
+
+def __load_task_from_disk(props: TaskProperties, parsed: Dict[str, ValidableTask]) -> TaskGraph:
+    def load(task_props: TaskProperties) -> TaskDefinition:
+        parsed[str(task_props)] = __load_installed_task(task_props)
+        return parsed[str(task_props)]["task"]
+
+    # Sub-tasks that have already been loaded don't need to be loaded again
+    return resolve_task_graph([props], load, skip=lambda sub_props: str(sub_props) in parsed)
+
+
+def __install_task(props: TaskProperties, task_path: Optional[Path] = None) -> ValidableTask:
+    """
+    Validate a downloaded task, make sure its virtual environment is available and build its json schema
+
+    :param props: the task properties
+    :param task_path: the directory the task is downloaded to, defaults to the path of the task. The task definition
+                      always refers to the path of the task, as that is where the task is run from.
+    :return: the parsed task definition and json schema
+    """
+    if task_path is None:
+        task_path = props.task_path
+    repo_path = Path(os.path.join(task_path, "repo"))
+    # Validate that the task.yml is valid
+    with span("validate task definition", "prepare", task=str(props)):
+        task_yaml = validate_task_definition(os.path.join(repo_path, "task.yml"))
         task: TaskDefinition = TaskDefinition.of(task_yaml, props.task_path)
         validate_default_values(task)
-        if isinstance(task, PythonTaskDefinition):
-            main_path = os.path.join(props.repo_path, Path(task.main))  # type: ignore
-            if not Path(main_path).resolve().is_relative_to(props.repo_path.resolve()):
-                raise ValidationError(f"Main path '{task.main}' must be within the repository")
-            if not os.path.isfile(main_path):
-                error_msg = f"Main file '{task.main}' does not exist for task '{task.name}'"  # type: ignore
-                raise ValidationError(error_msg)
-            # Create a virtualenv for this task
-            cli_run([os.path.join(props.task_path, "venv")])
-            # Install dependencies
-            __task_install_dependencies(props.task_path)
-        # Now we can build a schema for this task
-        schema = __build_json_schema(props, task)
-        json_schema = json.loads(schema)
-        with open(os.path.join(props.task_path, f"{props.name}.schema.json"), 'w') as handle:
-            handle.write(schema)
-        return {"schema": json_schema, "task": task}
-    except Exception as e:
-        # If something went wrong in the previous steps,
-        # that means the task is not valid and should be removed
-        shutil.rmtree(props.task_path)
-        # We need to raise an exception, because if it was part of a composite task,
-        # then that task is also not valid
-        raise PrepareTaskError(f"Unable to prepare task '{str(props)}'", e) from e
+    if isinstance(task, PythonTaskDefinition):
+        main_path = os.path.join(repo_path, Path(task.main))  # type: ignore
+        if not Path(main_path).resolve().is_relative_to(repo_path.resolve()):
+            raise ValidationError(f"Main path '{task.main}' must be within the repository")
+        if not os.path.isfile(main_path):
+            error_msg = f"Main file '{task.main}' does not exist for task '{task.name}'"  # type: ignore
+            raise ValidationError(error_msg)
+        # Use a virtualenv (with the dependencies installed) from the pool
+        set_venv_key(task_path, __prepare_venv(props, task_path))
+    # Now we can build a schema for this task
+    schema = __build_json_schema(props, task)
+    json_schema = json.loads(schema)
+    with open(os.path.join(task_path, schema_path(props).name), 'w') as handle:
+        handle.write(schema)
+    return {"schema": json_schema, "task": task}
+
+
+def __prepare_task(props: TaskProperties) -> ValidableTask:
+    """
+    Install a task. The task is built in a staging directory and then moved to the path of the task, so the path of a
+    task only exists once the task is installed completely. A lock makes sure only one process installs the task,
+    other processes wait and then use the installed task.
+
+    :param props: the task properties
+    :return: the parsed task definition and json schema
+    :raises PrepareTaskError: if the task cannot be installed
+    """
+    with span("install task", "prepare", task=str(props), version=props.version) as attributes, \
+            __file_lock(f"task-{props}"):
+        # Another process might have installed the task while we were waiting
+        if os.path.isdir(props.task_path):
+            attributes["cache"] = "hit"
+            return __load_installed_task(props)
+        attributes["cache"] = "miss"
+        staging_path = Path(os.path.join(cache_path, STAGING_PATH, props.organization, props.name, props.version))
+        try:
+            # A staging directory that exists is a leftover of a process that was killed
+            shutil.rmtree(staging_path, ignore_errors=True)
+            # Download the task (clone the repository)
+            __download_task(props, Path(os.path.join(staging_path, "repo")))
+            valid_task = __install_task(props, staging_path)
+            props.task_path.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(staging_path, props.task_path)
+        except Exception as e:
+            # If something went wrong in the previous steps,
+            # that means the task is not valid and should be removed
+            shutil.rmtree(staging_path, ignore_errors=True)
+            # We need to raise an exception, because if it was part of a composite task,
+            # then that task is also not valid
+            raise PrepareTaskError(f"Unable to prepare task '{str(props)}'", e) from e
+        task_index.put(props, valid_task)
+    return valid_task
+
+
+def __remove_task(props: TaskProperties) -> None:
+    with __file_lock(f"task-{props}"):
+        shutil.rmtree(props.task_path, ignore_errors=True)
+        task_index.remove(props)
+
+
+def __remove_incomplete(composites: Dict[str, List[str]], parsed: Dict[str, ValidableTask]) -> None:
+    """
+    Remove the composite tasks that have been prepared in this run, but of which not all sub-tasks are available.
+
+    :param composites: mapping of the freshly prepared composite tasks to the sub-tasks they depend on
+    :param parsed: the tasks that have been prepared successfully
+    :return: None
+    """
+    dependents: Dict[str, List[str]] = {}
+    for key, sub_tasks in composites.items():
+        for sub_task in sub_tasks:
+            dependents.setdefault(sub_task, []).append(key)
+    # Start from the missing sub-tasks and walk up to every composite task that (transitively) depends on them
+    worklist = [sub_task for sub_task in dependents if sub_task not in parsed]
+    incomplete: Set[str] = set()
+    while len(worklist) > 0:
+        for key in dependents.get(worklist.pop(), []):
+            if key not in incomplete:
+                incomplete.add(key)
+                worklist.append(key)
+    for key in incomplete:
+        logger.debug(f"Removing composite task '{key}', as not all its sub-tasks could be prepared")
+        parsed.pop(key, None)
+        __remove_task(TaskProperties.of(key))
 
 
 def __prepare_tasks(tasks: List[Any], parsed: Optional[Dict[str, ValidableTask]] = None, *,
-                    file: Optional[str] = None, check_inputs: bool = True) -> Dict[str, ValidableTask]:
+                    file: Optional[str] = None, check_inputs: bool = True,
+                    max_workers: Optional[int] = None) -> Dict[str, ValidableTask]:
     # Unfortunately we cannot do this as a default value, see:
     # https://docs.python-guide.org/writing/gotchas/#mutable-default-arguments
     if parsed is None:
         parsed = {}
-    if len(tasks) == 0:
-        logger.debug("All (sub-)tasks prepared")
-        return parsed
-
-    task_def = tasks.pop()
-    props = TaskProperties.of(task_def["uses"])
-
-    # Make sure that we always talk about the same task/version, e.g. the following are all the same
-    # remove, remove@latest, prepare-assignment/remove@latest
-    task_def["uses"] = str(props)
-    # Check if we have already loaded the task
-    if parsed.get(str(props), None) is None:
-        logger.debug(f"Task '{props}' has not been loaded in this run")
-        # Check if task (therefore the path) has already been downloaded in previous run
-        task_path = props.task_path
-        if os.path.isdir(task_path):
-            __load_task_from_disk(props, parsed)
-        else:
-            logger.debug(f"Task '{props}' is not available on this system")
-            valid_task = __prepare_task(props)
-            # Check if it is a composite task, in that case we might need to retrieve more tasks
-            task = valid_task["task"]
-            if isinstance(task, CompositeTaskDefinition):
-                logger.debug(f"Task '{props}' is a composite task, preparing sub-tasks")
-                all_tasks: List[Any] = []
-                for step in task.tasks:
-                    name = step.get("uses", None)
-                    if name is not None:
-                        all_tasks.append(step)
+    if max_workers is None:
+        max_workers = CONFIG.core.max_workers
+
+    # Steps that still need to be handled: (step, file the step is defined in, composite task it belongs to)
+    pending: Deque[Tuple[Any, Optional[str], Optional[str]]] = deque((task, file, None) for task in tasks)
+    # Steps of which the inputs have to be validated, once all tasks are available
+    to_validate: List[Tuple[Any, Optional[str], Optional[str]]] = []
+    # Tasks that are loaded, or are being prepared, in this run
+    scheduled: Set[str] = set(parsed.keys())
+    # Tasks that are being prepared by one of the workers, mapped to the step that triggered them
+    in_progress: Dict[Future[ValidableTask], Tuple[TaskProperties, Any]] = {}
+    # Composite tasks prepared in this run and the sub-tasks they depend on
+    composites: Dict[str, List[str]] = {}
+    error: Optional[Exception] = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while len(pending) > 0 or len(in_progress) > 0:
+            # Don't start new work once something went wrong, only wait for the running workers
+            while len(pending) > 0 and error is None:
+                task_def, task_file, owner = pending.popleft()
+                props = TaskProperties.of(task_def["uses"])
+                # Make sure that we always talk about the same task/version, e.g. the following are all the same
+                # remove, remove@latest, prepare-assignment/remove@latest
+                task_def["uses"] = str(props)
+                to_validate.append((task_def, task_file, owner))
+                # Check if we have already loaded the task
+                if str(props) in scheduled:
+                    logger.debug(f"Task '{props}' has already been loaded in this run")
+                    continue
+                logger.debug(f"Task '{props}' has not been loaded in this run")
+                scheduled.add(str(props))
+                # Check if task (therefore the path) has already been downloaded in previous run
+                if os.path.isdir(props.task_path):
+                    graph = __load_task_from_disk(props, parsed)
+                    scheduled.update(str(loaded) for loaded in graph.tasks)
+                else:
+                    logger.debug(f"Task '{props}' is not available on this system")
+                    in_progress[executor.submit(__prepare_task, props)] = (props, task_def)
+
+            if len(in_progress) == 0:
+                break
+            done, _ = wait(in_progress, return_when=FIRST_COMPLETED)
+            for future in done:
+                props, task_def = in_progress.pop(future)
                 try:
-                    parsed = __prepare_tasks(all_tasks, parsed, file=str(props.repo_path))
-                except PrepareTaskError as PE:
-                    # If any of the subtasks this composite task depend on fails,
-                    # we have to remove this task as well
-                    shutil.rmtree(task_path)
-                    raise PE
+                    valid_task = future.result()
                 except Exception as e:
-                    shutil.rmtree(task_path)
-                    raise PrepareTaskError(f"Unable to prepare task '{props}'", e)
-            parsed[str(props)] = valid_task
-            if task_def.get("with", None) is None:
-                task_def["with"] = {}
-    else:
-        logger.debug(f"Task '{props}' has already been loaded in this run")
-    if check_inputs and file is not None:
-        validate_tasks(file, task_def, parsed[str(props)]["schema"])
-    return __prepare_tasks(tasks, parsed, file=file)
-
-
-def prepare_tasks(prepare_file: str, jobs: Dict[str, Any]) -> Dict[str, TaskDefinition]:
+                    error = error or e
+                    continue
+                parsed[str(props)] = valid_task
+                if task_def.get("with", None) is None:
+                    task_def["with"] = {}
+                # Check if it is a composite task, in that case we might need to retrieve more tasks
+                task = valid_task["task"]
+                if isinstance(task, CompositeTaskDefinition):
+                    logger.debug(f"Task '{props}' is a composite task, preparing sub-tasks")
+                    composites[str(props)] = [str(sub_props) for sub_props in get_sub_tasks(task)]
+                    pending.extend((step, str(props.repo_path), str(props))
+                                   for step in task.tasks if step.get("uses", None) is not None)
+    task_index.save()
+
+    if error is not None:
+        # If any of the sub-tasks a composite task depends on failed, we have to remove the composite task as well
+        __remove_incomplete(composites, parsed)
+        if isinstance(error, PrepareTaskError):
+            raise error
+        raise PrepareTaskError("Unable to prepare tasks", error)
+
+    for task_def, task_file, owner in to_validate:
+        if task_file is None or (owner is None and not check_inputs):
+            continue
+        try:
+            with span("validate inputs", "prepare", task=task_def["uses"], file=task_file):
+                validate_tasks(task_file, task_def, parsed[task_def["uses"]]["schema"])
+        except Exception as e:
+            if owner is None:
+                raise
+            # The composite task itself is not valid, so it has to be removed (and the tasks that depend on it)
+            parsed.pop(owner, None)
+            __remove_task(TaskProperties.of(owner))
+            __remove_incomplete(composites, parsed)
+            raise PrepareTaskError(f"Unable to prepare task '{owner}'", e) from e
+    logger.debug("All (sub-)tasks prepared")
+    return parsed
+
+
+def prepare_tasks(prepare_file: str, jobs: Dict[str, Any],
+                  parsed: Optional[Dict[str, ValidableTask]] = None) -> Dict[str, TaskDefinition]:
     """
     Make sure that the tasks are available for the runner.
 
@@ -297,18 +723,158 @@ def prepare_tasks(prepare_file: str, jobs: Dict[str, Any]) -> Dict[str, TaskDefi
     3. Generate json schema for validation
     4. Validate task
 
+    Tasks that are not available are prepared concurrently, using at most 'core.max-workers' workers.
+
     :param prepare_file the name/path to the prepare file
     :param jobs: The jobs of the prepare file
-    :return: None
+    :param parsed: optional tasks that are already loaded, e.g. for another prepare file, new tasks are added to it
+    :return: the definitions of the tasks that are used, mapped by task
     """
     logger.debug("========== Preparing tasks")
     all_tasks: List[Any] = []
     # Iterate through all the tasks to make sure that they are available
-    for step, tasks in jobs.items():
-        for task in tasks:
+    for step, job in jobs.items():
+        for task in Job.steps_of(job):
             # If the task is a run command, we don't need to do anything
             if task.get("uses", None) is not None:
                 all_tasks.append(task)
-    mapping = __prepare_tasks(all_tasks, file=prepare_file)
+    with span("prepare tasks", "prepare", file=prepare_file):
+        mapping = __prepare_tasks(all_tasks, parsed, file=prepare_file)
     logger.debug("✓ All tasks downloaded and valid")
     return {k: v["task"] for k, v in mapping.items()}
+
+
+def __remote_commit(git_url: str, ref: Optional[str]) -> Optional[str]:
+    """
+    Get the commit a branch of the remote repository points to
+
+    :param git_url: the url of the repository
+    :param ref: the branch, None for the default branch
+    :return: the commit hash, None if the remote doesn't have the branch
+    """
+    names = ("HEAD",) if ref is None else (f"refs/heads/{ref}", ref)
+    commits: Dict[str, str] = {}
+    for line in str(Git().ls_remote(git_url, ref or "HEAD")).splitlines():
+        commit, _, name = line.partition("\t")
+        commits[name.strip()] = commit.strip()
+    return next((commits[name] for name in names if name in commits), None)
+
+
+def __is_up_to_date(props: TaskProperties, git_url: str, resolved: Optional[str]) -> bool:
+    with Repo(props.repo_path) as repo:
+        head = repo.head.commit.hexsha
+        if resolved is not None and resolved != "main":
+            # Tags are (assumed to be) immutable, so a tag we already have can be checked without the remote
+            if __has_ref(repo, resolved):
+                return str(repo.git.rev_parse(f"{resolved}^{{commit}}")) == head
+            return False
+    return __remote_commit(git_url, resolved) == head
+
+
+def update_task(props: TaskProperties) -> bool:
+    """
+    Update an installed task to the newest commit of its version, if the version follows the repository (see
+    UPDATABLE_VERSIONS). The installed task is copied to a staging directory, where the checked-out repository is
+    fetched from the mirror and reset, instead of being cloned again. The virtual environment is only replaced if the
+    requirements of the task changed. Once the updated task is valid, it replaces the installed task.
+
+    :param props: the task properties
+    :return: True if the task changed, False if it was already up to date
+    :raises PrepareTaskError: if the task cannot be updated, the installed task is left unchanged
+    """
+    if props.version not in UPDATABLE_VERSIONS:
+        return False
+    if not os.path.isdir(props.repo_path):
+        logger.debug(f"Task '{props}' is not available on this system")
+        __prepare_tasks([{"uses": str(props)}], check_inputs=False)
+        return True
+    git_url = __git_url(props)
+    # Always list the remote tags, as a new tag might have been created since they were cached
+    resolved = __resolve_version(git_url, props.version, ttl=0)
+    if __is_up_to_date(props, git_url, resolved):
+        logger.debug(f"Task '{props}' is up to date")
+        return False
+    __update_mirror(git_url, props, resolved)
+    with __file_lock(f"task-{props}"):
+        staging_path = Path(os.path.join(cache_path, STAGING_PATH, props.organization, props.name, props.version))
+        previous_path = Path(f"{staging_path}.previous")
+        try:
+            # Leftovers of a process that was killed
+            shutil.rmtree(staging_path, ignore_errors=True)
+            shutil.rmtree(previous_path, ignore_errors=True)
+            shutil.copytree(props.task_path, staging_path, symlinks=True)
+            logger.debug(f"Updating task '{props}' to ref '{resolved or 'HEAD'}'")
+            with Repo(os.path.join(staging_path, "repo")) as repo:
+                # The origin of the repository is the mirror, so this only copies objects locally. The tags are
+                # fetched as well, so the next update can check the resolved tag without the remote
+                repo.git.fetch("--tags", "origin", resolved or "HEAD")
+                repo.git.reset("--hard", "FETCH_HEAD")
+            valid_task = __install_task(props, staging_path)
+            task = valid_task["task"]
+            if isinstance(task, CompositeTaskDefinition):
+                # The composite task might use new tasks, and has to be valid for the (updated) tasks it uses
+                steps = [dict(step) for step in task.tasks if step.get("uses", None) is not None]
+                __prepare_tasks(steps, file=str(props.repo_path))
+            # A directory cannot be replaced by renaming, so the installed task is moved out of the way first
+            os.rename(props.task_path, previous_path)
+            os.rename(staging_path, props.task_path)
+        except Exception as e:
+            if os.path.isdir(previous_path) and not os.path.exists(props.task_path):
+                os.rename(previous_path, props.task_path)
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise PrepareTaskError(f"Unable to update task '{props}'", e) from e
+        shutil.rmtree(previous_path, ignore_errors=True)
+        task_index.put(props, valid_task)
+    return True
+
+
+def update_tasks(graph: TaskGraph, max_workers: Optional[int] = None) -> List[TaskProperties]:
+    """
+    Update the tasks in the graph (see update_task). Tasks are updated concurrently, using at most 'core.max-workers'
+    workers, but a task is only updated after all the tasks it depends on are updated.
+
+    :param graph: the tasks to update and their dependencies
+    :param max_workers: the maximum number of tasks to update concurrently, defaults to 'core.max-workers'
+    :return: the tasks that changed
+    :raises PrepareTaskError: if one of the tasks cannot be updated, the tasks that depend on it are not updated
+    """
+    if max_workers is None:
+        max_workers = CONFIG.core.max_workers
+    # Fails on circular dependencies, instead of waiting forever
+    graph.topological_order()
+    remaining = {props: {dependency for dependency in dependencies if dependency in graph.dependencies}
+                 for props, dependencies in graph.dependencies.items()}
+    dependents = graph.dependents()
+    ready: Deque[TaskProperties] = deque(props for props, dependencies in remaining.items() if len(dependencies) == 0)
+    in_progress: Dict[Future[bool], TaskProperties] = {}
+    updated: List[TaskProperties] = []
+    error: Optional[Exception] = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while len(ready) > 0 or len(in_progress) > 0:
+            # Don't start new work once something went wrong, only wait for the running workers
+            while len(ready) > 0 and error is None:
+                props = ready.popleft()
+                in_progress[executor.submit(update_task, props)] = props
+            if len(in_progress) == 0:
+                break
+            done, _ = wait(in_progress, return_when=FIRST_COMPLETED)
+            for future in done:
+                props = in_progress.pop(future)
+                try:
+                    if future.result():
+                        updated.append(props)
+                except Exception as e:
+                    error = error or e
+                    continue
+                for dependent in dependents.get(props, []):
+                    remaining[dependent].discard(props)
+                    if len(remaining[dependent]) == 0:
+                        ready.append(dependent)
+    task_index.save()
+
+    if error is not None:
+        if isinstance(error, PrepareTaskError):
+            raise error
+        raise PrepareTaskError("Unable to update tasks", error)
+    return updated
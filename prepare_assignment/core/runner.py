@@ -5,23 +5,41 @@ import os.path
 import shlex
 import subprocess
 import sys
-from typing import Dict, Optional
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Final, IO, Iterator, List, Optional, Set, Tuple
 
 from prepare_toolbox.command import DEMARCATION
 
 from prepare_assignment.core.command import COMMAND_MAPPING
 from prepare_assignment.core.expression import evaluate_condition
+from prepare_assignment.core.planner import plan_steps
 from prepare_assignment.core.subsituter import substitute_all, __substitute
 from prepare_assignment.data.task_definition import TaskDefinition, PythonTaskDefinition
-from prepare_assignment.data.constants import BASH_EXECUTABLE
-from prepare_assignment.data.prepare import Prepare, Task
+from prepare_assignment.data.constants import BASH_EXECUTABLE, CONFIG, LOG_LEVEL_TRACE
+from prepare_assignment.data.prepare import Prepare, Task, Job
 from prepare_assignment.data.job_environment import JobEnvironment
 from prepare_assignment.data.errors import TaskExecutionError
+from prepare_assignment.data.task_event import TaskEvent
 from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.logger import JobLogBuffer
+from prepare_assignment.utils.run_control import RunControl, kill_process_group
+from prepare_assignment.utils.task_worker import run_in_worker, workers_supported
+from prepare_assignment.utils.task_gc import mark_used
+from prepare_assignment.utils.tracing import span
+from prepare_assignment.utils.virtual_env import get_task_venv, get_python_executable
 
 # Get the logger
 logger = logging.getLogger("prepare_assignment")
 tasks_logger = logging.getLogger("tasks")
+# Size of the chunks the output of tasks is read in
+OUTPUT_CHUNK_SIZE: Final[int] = 64 * 1024
+# Longer lines of output are split, so a task can't exhaust the memory with a line that doesn't end
+MAX_OUTPUT_LINE_LENGTH: Final[int] = 1024 * 1024
+# Holds back the output of jobs and tasks that run concurrently, only records of jobs that capture them are held back
+job_log_buffer = JobLogBuffer()
+logger.addFilter(job_log_buffer)
+tasks_logger.addFilter(job_log_buffer)
 
 
 def __process_output_line(line: str, environment: JobEnvironment) -> None:
@@ -30,6 +48,10 @@ def __process_output_line(line: str, environment: JobEnvironment) -> None:
         if len(parts) <= 1:
             return
         command = parts[1]
+        control = environment.control
+        if control is not None and control.on_event is not None:
+            control.on_event(TaskEvent(environment.job or "", environment.step or "", command,
+                                       line.rstrip("\n").split(DEMARCATION)[2:]))
         handler = COMMAND_MAPPING.get(command, None)
         if not handler:
             logger.warning(f"Found command '{command}', "
@@ -41,17 +63,117 @@ def __process_output_line(line: str, environment: JobEnvironment) -> None:
         tasks_logger.trace(line)  # type: ignore
 
 
-def __execute_task(environment: JobEnvironment) -> None:
-    logger.debug(f"Executing task '{environment.current_task.name}'")  # type: ignore
+class OutputSplitter:
+    """
+    Splits the output of a task, that is read in chunks, into lines. Only command lines and lines that are actually
+    logged are decoded, lines longer than MAX_OUTPUT_LINE_LENGTH are split.
+    """
+
+    def __init__(self) -> None:
+        self._demarcation = DEMARCATION.encode("utf-8")
+        self._trace = tasks_logger.isEnabledFor(LOG_LEVEL_TRACE)
+        self._pending = b""
+        # False if the pending output is the remainder of a line that was too long
+        self._at_line_start = True
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """
+        :param chunk: the next chunk of output
+        :return: the complete lines that have to be handled, including the newline
+        """
+        lines: List[bytes] = []
+        self._pending += chunk
+        last = self._pending.rfind(b"\n")
+        if last >= 0:
+            complete = self._pending[:last]
+            if self._trace:
+                lines = complete.split(b"\n")
+                if not self._at_line_start:
+                    tasks_logger.trace(lines.pop(0).decode("utf-8", errors="replace"))  # type: ignore
+            else:
+                lines = self._command_lines(complete)
+            self._pending = self._pending[last + 1:]
+            self._at_line_start = True
+        while len(self._pending) > MAX_OUTPUT_LINE_LENGTH:
+            line = self._pending[:MAX_OUTPUT_LINE_LENGTH]
+            self._pending = self._pending[MAX_OUTPUT_LINE_LENGTH:]
+            self._at_line_start = False
+            if self._trace:
+                tasks_logger.trace(line.decode("utf-8", errors="replace"))  # type: ignore
+        return [line.rstrip(b"\r").decode("utf-8", errors="replace") + "\n" for line in lines]
+
+    def close(self) -> List[str]:
+        """
+        :return: the last line, if the output didn't end with a newline and the line has to be handled
+        """
+        pending, self._pending = self._pending, b""
+        if pending and (self._trace or (self._at_line_start and pending.startswith(self._demarcation))):
+            return [pending.decode("utf-8", errors="replace")]
+        return []
+
+    def _command_lines(self, output: bytes) -> List[bytes]:
+        # Search for the demarcation directly instead of looking at every line, most lines aren't commands
+        lines: List[bytes] = []
+        marker = b"\n" + self._demarcation
+        index = 0 if self._at_line_start and output.startswith(self._demarcation) else output.find(marker)
+        while index >= 0:
+            start = index if index == 0 and output[0:1] != b"\n" else index + 1
+            end = output.find(b"\n", start)
+            lines.append(output[start:] if end < 0 else output[start:end])
+            index = -1 if end < 0 else output.find(marker, end)
+        return lines
+
+
+def __output_handler(environment: JobEnvironment) -> Tuple[Callable[[bytes], None], Callable[[], int]]:
+    """
+    Create the functions that handle the output of a task that is read in chunks
+
+    :return: the function to call with every chunk, and the function to call once all output is read, which returns
+             the number of lines of output
+    """
+    splitter = OutputSplitter()
+    lines = [0]
+    last = [b"\n"]
+
+    def feed(chunk: bytes) -> None:
+        lines[0] += chunk.count(b"\n")
+        last[0] = chunk[-1:]
+        for line in splitter.feed(chunk):
+            __process_output_line(line, environment)
+
+    def close() -> int:
+        for line in splitter.close():
+            __process_output_line(line, environment)
+        # The last line doesn't have to end with a newline
+        return lines[0] if last[0] == b"\n" else lines[0] + 1
+    return feed, close
+
+
+def __pump_output(stream: IO[bytes], environment: JobEnvironment) -> int:
+    """
+    Handle the output of a task until the stream is closed
+
+    :return: the number of lines of output
+    """
+    feed, close = __output_handler(environment)
+    read = getattr(stream, "read1", stream.read)
+    while True:
+        chunk = read(OUTPUT_CHUNK_SIZE)
+        if not chunk:
+            break
+        feed(chunk)
+    return close()
+
+
+def __task_invocation(environment: JobEnvironment) -> Tuple[str, str, Dict[str, str]]:
+    """
+    :return: the python executable, main file and environment variables to run the current (python) task with
+    """
     task: PythonTaskDefinition = environment.current_task_definition   # type: ignore
-    venv_path = os.path.join(task.path, "venv")
+    venv_path = get_task_venv(task.path)
     main_path = os.path.join(task.path, "repo", task.main)
-    executable: str
-    if sys.platform == "win32":
-        executable = os.path.join(venv_path, "Scripts", "python.exe")
-    else:
-        executable = os.path.join(venv_path, "bin", "python")
-    
+    executable = get_python_executable(venv_path)
+
     env = environment.environment.copy()
     env["VIRTUAL_ENV"] = venv_path
     for key, value in environment.current_task.with_.items():  # type: ignore
@@ -61,18 +183,73 @@ def __execute_task(environment: JobEnvironment) -> None:
         if inp.default is not None and not inp.name in environment.current_task.with_.keys():  # type: ignore
             sanitized = "PREPARE_" + inp.name.replace(" ", "_").upper()
             env[sanitized] = json.dumps(inp.default)
+    return executable, main_path, env
+
+
+def __shell_args(command: str) -> List[str]:
+    args = shlex.split(f"-c {shlex.quote(command)}")
+    args.insert(0, BASH_EXECUTABLE)
+    return args
+
+
+def __kill(process: subprocess.Popen) -> None:
+    if sys.platform == "win32":
+        process.kill()
+    else:
+        kill_process_group(process.pid)
+
+
+@contextmanager
+def __start_process(args: List[str], env: Dict[str, str], environment: JobEnvironment) -> Iterator[subprocess.Popen]:
+    """
+    Start the process of a step. If the run can be cancelled, the process gets its own session, so it is killed
+    together with the processes it started
+    """
+    control = environment.control
     with subprocess.Popen(
-        [executable, main_path],
+        args,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        bufsize=1,
-        universal_newlines=True,
-        env=env
+        env=env,
+        cwd=environment.cwd,
+        start_new_session=control is not None and sys.platform != "win32"
     ) as process:
-        if process.stdout is None:
+        if control is None:
+            yield process
             return
-        for line in process.stdout:
-            __process_output_line(line, environment)
+        with control.register(lambda: __kill(process)):
+            yield process
+
+
+def __execute_task(environment: JobEnvironment) -> None:
+    logger.debug(f"Executing task '{environment.current_task.name}'")  # type: ignore
+    executable, main_path, env = __task_invocation(environment)
+    task_name = str(TaskProperties.of(environment.current_task.uses))  # type: ignore
+    if CONFIG.core.task_workers and workers_supported():
+        with span("task process", "run", task=task_name, worker=True) as attributes:
+            feed, close = __output_handler(environment)
+            try:
+                with ExitStack() as registered:
+                    def on_start(pid: int) -> None:
+                        if environment.control is not None:
+                            registered.enter_context(environment.control.register(lambda: kill_process_group(pid)))
+                    returncode = run_in_worker(executable, main_path, env, feed, environment.cwd, on_start)
+            except ConnectionError as e:
+                raise TaskExecutionError(f"Task '{environment.current_task.name}' failed: {e}")  # type: ignore
+            attributes["exit code"] = returncode
+            attributes["output lines"] = close()
+        if returncode is not None:
+            if returncode != 0:
+                raise TaskExecutionError(
+                    f"Task '{environment.current_task.name}' exited with code {returncode}"  # type: ignore
+                )
+            return
+    with span("task process", "run", task=task_name, worker=False) as attributes:
+        with __start_process([executable, main_path], env, environment) as process:
+            if process.stdout is None:
+                return
+            attributes["output lines"] = __pump_output(process.stdout, environment)
+        attributes["exit code"] = process.returncode
     if process.returncode != 0:
         raise TaskExecutionError(
             f"Task '{environment.current_task.name}' exited with code {process.returncode}"  # type: ignore
@@ -81,48 +258,59 @@ def __execute_task(environment: JobEnvironment) -> None:
 
 def __execute_shell_command(command: str, environment: JobEnvironment) -> None:
     logger.debug(f"Executing run '{command}'")  # type: ignore
-    args = shlex.split(f"-c {shlex.quote(command)}")
-    args.insert(0, BASH_EXECUTABLE)
-    with subprocess.Popen(
-        args,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        bufsize=1,
-        universal_newlines=True,
-        env=environment.environment
-    ) as process:
-        if process.stdout is None:
-            return
-        for line in process.stdout:
-            __process_output_line(line, environment)
+    with span("shell process", "run", command=command) as attributes:
+        with __start_process(__shell_args(command), environment.environment, environment) as process:
+            if process.stdout is None:
+                return
+            attributes["output lines"] = __pump_output(process.stdout, environment)
+        attributes["exit code"] = process.returncode
     if process.returncode != 0:
         raise TaskExecutionError(f"Shell command exited with code {process.returncode}: {command}")
 
 
 def __should_skip(task: Task, environment: JobEnvironment) -> bool:
+    if environment.control is not None and environment.control.cancelled:
+        logger.debug(f"Skipping task '{task.name}' (the run is cancelled)")
+        return True
     if task.if_ is None:
         if environment.job_failed:
             logger.debug(f"Skipping task '{task.name}' (previous task failed)")
             return True
-    elif not evaluate_condition(task.if_, environment):
-        logger.debug(f"Skipping task '{task.name}' (if condition is false)")
-        return True
+    else:
+        with span("evaluate condition", "run", step=task.name, condition=task.if_) as attributes:
+            attributes["result"] = evaluate_condition(task.if_, environment)
+        if not attributes["result"]:
+            logger.debug(f"Skipping task '{task.name}' (if condition is false)")
+            return True
     return False
 
 
 def __handle_task(mapping: Dict[str, TaskDefinition],
                   task: Task,
                   environment: JobEnvironment) -> None:
+    kind = {"run": task.run} if task.is_run else {"uses": str(TaskProperties.of(task.uses))}  # type: ignore
+    environment.step = task.name
+    with span("step", "run", step=task.name, **kind):
+        __handle_step(mapping, task, environment)
+
+
+def __handle_step(mapping: Dict[str, TaskDefinition],
+                  task: Task,
+                  environment: JobEnvironment) -> None:
     # Check what kind of task it is
     if task.is_run:
-        command = __substitute(task.run, environment)  # type: ignore
+        with span("substitute", "run", step=task.name):
+            command = __substitute(task.run, environment)  # type: ignore
         __execute_shell_command(command, environment)  # type: ignore
     else:
         task_properties = TaskProperties.of(task.uses)  # type: ignore
         task_definition = mapping.get(str(task_properties))
-        substitute_all(task.with_, environment)  # type: ignore
+        mark_used(task_properties)
+        with span("substitute", "run", step=task.name):
+            substitute_all(task.with_, environment)  # type: ignore
         if task_definition.is_composite:  # type: ignore
-            sub_environment = JobEnvironment(environment.environment, outputs={}, inputs=task.with_)  # type: ignore
+            sub_environment = JobEnvironment(environment.environment, outputs={}, inputs=task.with_,  # type: ignore
+                                             cwd=environment.cwd, job=environment.job, control=environment.control)
             for subtask in task_definition.tasks:  # type: ignore
                 subtask = copy.deepcopy(subtask)
                 subtask = Task.of(subtask)
@@ -142,22 +330,165 @@ def __handle_task(mapping: Dict[str, TaskDefinition],
             __execute_task(environment)
 
 
-def run(prepare: Prepare, mapping: Dict[str, TaskDefinition], env_vars: Optional[Dict[str, str]] = None) -> None:
+def __run_step(mapping: Dict[str, TaskDefinition], task: Task, environment: JobEnvironment) -> None:
+    try:
+        __handle_task(mapping, task, environment)
+    except TaskExecutionError as e:
+        logger.error(str(e))
+        environment.job_failed = True
+
+
+def __run_step_buffered(records: List[logging.LogRecord], mapping: Dict[str, TaskDefinition], task: Task,
+                        environment: JobEnvironment) -> None:
+    with job_log_buffer.capture(records):
+        __run_step(mapping, task, environment)
+
+
+def __run_steps_planned(job: Job, mapping: Dict[str, TaskDefinition], environment: JobEnvironment,
+                        max_workers: int) -> None:
+    """
+    Run the tasks of a job concurrently as far as the plan allows it. Every running task gets its own copy of the
+    environment, the outputs and environment variables it sets are merged into the job environment once it is finished.
+
+    Whether a task is skipped is decided once the tasks it depends on are finished, and it only sees the failures of
+    those tasks (and of the tasks they depend on). The tasks that run concurrently with it, or happen to finish before
+    it is started, don't affect it, so the result doesn't depend on timing.
+    """
+    plan = plan_steps(job.tasks)
+    remaining: Dict[int, Set[int]] = {index: set(dependencies) for index, dependencies in enumerate(plan)}
+    # Per finished (or skipped) task: whether it failed, or a task it depends on failed
+    failed: Dict[int, bool] = {}
+    failed_before = environment.job_failed
+    # The records of the job, if the job itself runs concurrently with other jobs
+    job_records = job_log_buffer.current()
+    running: Dict[Future[None],
+                  Tuple[int, JobEnvironment, Dict[str, str], Dict[str, Any], List[logging.LogRecord]]] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Start the tasks that are ready, in the order they are defined in
+            ready = [index for index, dependencies in remaining.items() if len(dependencies) == 0]
+            if len(ready) > 0 and len(running) < max_workers:
+                index = ready[0]
+                del remaining[index]
+                task = job.tasks[index]
+                job_failed = failed_before or any(failed[dependency] for dependency in plan[index])
+                step_env = JobEnvironment(environment.environment.copy(), dict(environment.outputs),
+                                          environment.inputs, job_failed=job_failed, needs=environment.needs,
+                                          cwd=environment.cwd, job=environment.job, control=environment.control)
+                if __should_skip(task, step_env):
+                    failed[index] = job_failed
+                    for dependencies in remaining.values():
+                        dependencies.discard(index)
+                    continue
+                records: List[logging.LogRecord] = []
+                env_before, outputs_before = dict(step_env.environment), dict(step_env.outputs)
+                future = executor.submit(__run_step_buffered, records, mapping, task, step_env)
+                running[future] = (index, step_env, env_before, outputs_before, records)
+                continue
+            if len(running) == 0:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            # Merge in the order of definition, so the result doesn't depend on which task finished first
+            for future in sorted(done, key=lambda f: running[f][0]):
+                index, step_env, env_before, outputs_before, records = running.pop(future)
+                if job_records is None:
+                    JobLogBuffer.flush(records)
+                else:
+                    job_records.extend(records)
+                future.result()
+                environment.environment.update({key: value for key, value in step_env.environment.items()
+                                                if env_before.get(key, None) != value})
+                environment.outputs.update({key: value for key, value in step_env.outputs.items()
+                                            if outputs_before.get(key, None) is not value})
+                environment.job_failed = environment.job_failed or step_env.job_failed
+                failed[index] = step_env.job_failed
+                for dependencies in remaining.values():
+                    dependencies.discard(index)
+
+
+def __run_job(job: Job, mapping: Dict[str, TaskDefinition], env_vars: Dict[str, str],
+              needs: Dict[str, Any], cwd: Optional[str], control: Optional[RunControl]) -> JobEnvironment:
+    logger.debug(f"Running job: {job.name}")
+    env = {**os.environ.copy(), **env_vars}
+    step_env = JobEnvironment(env, {}, {}, needs=needs, cwd=cwd, job=job.name, control=control)
+    max_workers = max(1, CONFIG.core.max_workers)
+    with span("job", "run", job=job.name) as attributes:
+        # Tasks can only run concurrently if they declare the paths they use
+        if max_workers > 1 and any(len(task.reads) > 0 or len(task.writes) > 0 for task in job.tasks):
+            __run_steps_planned(job, mapping, step_env, max_workers)
+        else:
+            for task in job.tasks:
+                if __should_skip(task, step_env):
+                    continue
+                __run_step(mapping, task, step_env)
+        attributes["failed"] = step_env.job_failed
+    return step_env
+
+
+def __run_job_buffered(records: List[logging.LogRecord], job: Job, mapping: Dict[str, TaskDefinition],
+                       env_vars: Dict[str, str], needs: Dict[str, Any], cwd: Optional[str],
+                       control: Optional[RunControl]) -> JobEnvironment:
+    with job_log_buffer.capture(records):
+        return __run_job(job, mapping, env_vars, needs, cwd, control)
+
+
+def run(prepare: Prepare, mapping: Dict[str, TaskDefinition], env_vars: Optional[Dict[str, str]] = None,
+        cwd: Optional[str] = None, control: Optional[RunControl] = None) -> None:
+    """
+    Run the jobs, a job is started as soon as the jobs it needs are finished.
+    At most 'core.max-workers' jobs run concurrently, in that case the output of a job is written once it is finished.
+    No new jobs are started once a job failed, or once the run is cancelled.
+
+    :param prepare: the parsed prepare file
+    :param mapping: the definitions of the tasks that are used
+    :param env_vars: extra environment variables
+    :param cwd: the directory the tasks run in, defaults to the working directory of the process
+    :param control: follows the commands the tasks send and cancels the run, see RunControl
+    :return: None
+    :raises TaskExecutionError: if a job failed
+    """
     env_vars = env_vars or {}
     logger.debug("========== Running prepare_assignment assignment")
-    for job, tasks in prepare.jobs.items():
-        logger.debug(f"Running job: {job}")
-        env = {**os.environ.copy(), **env_vars}
-        step_env = JobEnvironment(env, {}, {})
-        for task in tasks:
-            if __should_skip(task, step_env):
-                continue
-            try:
-                __handle_task(mapping, task, step_env)
-            except TaskExecutionError as e:
-                logger.error(str(e))
-                step_env.job_failed = True
-        if step_env.job_failed:
-            raise TaskExecutionError(f"Job '{job}' failed")
+    max_workers = max(1, CONFIG.core.max_workers)
+    # Only buffer the output if jobs (or the tasks of a job) can actually run concurrently
+    buffered = max_workers > 1
+
+    remaining: Dict[str, Set[str]] = {name: set(job.needs) for name, job in prepare.jobs.items()}
+    finished: Dict[str, JobEnvironment] = {}
+    running: Dict[Future[JobEnvironment], Tuple[str, List[logging.LogRecord]]] = {}
+    failed: Optional[str] = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Start the jobs that are ready, in the order they are defined in
+            ready = [name for name, needs in remaining.items() if len(needs) == 0]
+            while failed is None and len(ready) > 0 and len(running) < max_workers \
+                    and not (control is not None and control.cancelled):
+                name = ready.pop(0)
+                del remaining[name]
+                job = prepare.jobs[name]
+                outputs = {need: {"outputs": finished[need].outputs} for need in job.needs}
+                records: List[logging.LogRecord] = []
+                if buffered and len(prepare.jobs) > 1:
+                    future = executor.submit(__run_job_buffered, records, job, mapping, env_vars, outputs, cwd,
+                                             control)
+                else:
+                    future = executor.submit(__run_job, job, mapping, env_vars, outputs, cwd, control)
+                running[future] = (name, records)
+            if len(running) == 0:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, records = running.pop(future)
+                JobLogBuffer.flush(records)
+                environment = future.result()
+                finished[name] = environment
+                if environment.job_failed:
+                    failed = failed or name
+                for job_needs in remaining.values():
+                    job_needs.discard(name)
+    if failed is not None:
+        raise TaskExecutionError(f"Job '{failed}' failed")
+    if control is not None and control.cancelled:
+        raise TaskExecutionError("The run is cancelled")
 
     logger.debug("✓ Prepared :)")
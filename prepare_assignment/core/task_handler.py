@@ -1,17 +1,19 @@
 import logging
 import os.path
 import shutil
-from typing import Set
+from pathlib import Path
+from typing import Dict, List, Optional, Set
 
 import typer
-from treelib import Tree
 
-from prepare_assignment.core.preparer import __prepare_tasks
 from prepare_assignment.data.task_definition import TaskDefinition
 from prepare_assignment.data.task_properties import TaskProperties
-from prepare_assignment.utils.dependency import get_dependencies
-from prepare_assignment.utils.paths import get_tasks_path
-from prepare_assignment.utils.tasks import get_all_tasks
+from prepare_assignment.utils.file_lock import cache_lock
+from prepare_assignment.utils.paths import get_cache_path, get_tasks_path
+from prepare_assignment.utils.task_graph import TaskGraph, resolve_dependency_graph
+from prepare_assignment.utils.task_index import get_task_index
+from prepare_assignment.utils.tasks import get_all_tasks, get_dependents, load_dependencies, load_task
+from prepare_assignment.utils.virtual_env import get_venv_key
 from prepare_assignment.utils.yml_loader import YAML_LOADER
 
 logger = logging.getLogger("prepare_assignment")
@@ -20,56 +22,64 @@ tasks_path = get_tasks_path()
 
 def remove(task: str, recursive: bool) -> None:
     props = TaskProperties.of(task)
-    dependencies = get_dependencies(props)
-
-    all_tasks = set(get_all_tasks())
-    not_used_tasks = all_tasks - dependencies
-    other_dependencies = get_dependencies(not_used_tasks)
-
-    if not (dependencies - other_dependencies) == dependencies:
-        raise AssertionError(f"Cannot remove {task}, "
-                             f"as there are other tasks dependent on this task or on a dependency of this task")
-
-    if not recursive:
-        shutil.rmtree(props.task_path)
-    else:
-        for dep in dependencies:
+    dependencies = resolve_dependency_graph([props], load_dependencies).reachable([props])
+    # The task index knows which tasks use a task, so the other installed tasks don't have to be loaded
+    dependents = get_dependents()
+    users = sorted({str(user) for dependency in dependencies for user in dependents.get(dependency, [])
+                    if user not in dependencies})
+    if len(users) > 0:
+        raise AssertionError(f"Cannot remove {task}, as there are other tasks dependent on this task or on a "
+                             f"dependency of this task: {', '.join(users)}")
+
+    index = get_task_index()
+    for dep in dependencies if recursive else [props]:
+        # A run in another process might be installing or updating the task
+        with cache_lock(get_cache_path(), f"task-{dep}"):
             shutil.rmtree(dep.task_path)
+            index.remove(dep)
+    index.save()
 
 
-def update(task: str, recursive: bool) -> None:
+def update(task: str, recursive: bool) -> List[TaskProperties]:
     props = TaskProperties.of(task)
-    dependencies: Set[TaskProperties] = get_dependencies(props) if recursive else {props}
-    # TODO: use topological sort to make sure the order we remove and reinstall is the most efficient
-    for dep in dependencies:
-        # Only update if version is 'latest'
-        # Tags in git are not immutable, but we ignore that for now
-        if dep.version in ("latest", "main"):
-            # Easiest way is to just remove and reinstall
-            shutil.rmtree(dep.task_path)
-            add(str(dep))
+    graph = TaskGraph(dependencies={props: []})
+    if recursive:
+        graph = resolve_dependency_graph([props], load_dependencies)
+    # The preparer is slow to import, and only needed when tasks have to be updated
+    from prepare_assignment.core.preparer import update_tasks
+    return update_tasks(graph)
 
 
 def remove_all() -> None:
+    for props in get_all_tasks():
+        with cache_lock(get_cache_path(), f"task-{props}"):
+            shutil.rmtree(props.task_path, ignore_errors=True)
     shutil.rmtree(tasks_path)
 
 
-def ls() -> None:
+def ls(dependents: bool = False) -> None:
     if not os.path.isdir(tasks_path):
         print("No tasks available")
         return
+    users: Dict[TaskProperties, List[TaskProperties]] = get_dependents() if dependents else {}
+    from treelib import Tree
     tree = Tree()
     organizations = sorted(os.listdir(tasks_path))
     for org in organizations:
-        tree.create_node(org, org)
         org_path = os.path.join(tasks_path, org)
+        # The tasks directory also contains the task index
+        if not os.path.isdir(org_path):
+            continue
+        tree.create_node(org, org)
         tasks = sorted(os.listdir(org_path))
         for task in tasks:
             tree.create_node(task, task, parent=org)
             version_path = os.path.join(org_path, task)
             versions = sorted(os.listdir(version_path))
             for version in versions:
-                tree.create_node(version, parent=task)
+                used_by = sorted(str(user) for user in users.get(TaskProperties.of(f"{org}/{task}@{version}"), []))
+                label = f"{version} (used by {', '.join(used_by)})" if len(used_by) > 0 else version
+                tree.create_node(label, parent=task)
     t = tree.show(stdout=False)
     print(t)
 
@@ -86,6 +96,25 @@ def info(task: str) -> None:
 
 def add(task: str) -> None:
     tasks = [{"uses": task}]
+    # The preparer is slow to import, and only needed when tasks have to be prepared
+    from prepare_assignment.core.preparer import __prepare_tasks
     __prepare_tasks(tasks, check_inputs=False)
 
 
+def prefetch_wheels(wheelhouse: Optional[str] = None) -> Path:
+    from prepare_assignment.core.preparer import download_wheels, get_wheelhouse_path
+    path = Path(wheelhouse).expanduser() if wheelhouse else get_wheelhouse_path()
+    path.mkdir(parents=True, exist_ok=True)
+    # Tasks that share a virtualenv have the same dependencies, so they only need to be retrieved once
+    retrieved: Set[str] = set()
+    for props in sorted(get_all_tasks(), key=str):
+        task = load_task(props)
+        if task.is_composite:
+            continue
+        key = get_venv_key(props.task_path) or str(props)
+        if key in retrieved:
+            continue
+        logger.info(f"Retrieving wheels for '{props}'")
+        download_wheels(props, path)
+        retrieved.add(key)
+    return path
@@ -1,14 +1,16 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, Type
+from typing import Dict, Any, List, Type, Optional, Tuple
 
 from importlib_resources import files
-from jsonschema.exceptions import ValidationError
-from jsonschema.validators import validate
+from jsonschema.exceptions import ValidationError, best_match
 
 from prepare_assignment.data.errors import ValidationError as VE
 from prepare_assignment.data.task_definition import TaskDefinition
@@ -26,6 +28,106 @@ type_map: Dict[str, Type] = {
     "boolean": type(True)
 }
 
+# Validators for the generated task schemas, keyed by the hash of the schema
+_validators: Dict[str, Any] = {}
+_validators_lock = threading.Lock()
+# Properties of a step that are not part of the task, these are validated by the prepare schema
+STEP_PROPERTIES: Tuple[str, ...] = ("if", "reads", "writes")
+
+
+@lru_cache(maxsize=None)
+def __packaged_validator(name: str) -> Any:
+    """
+    Load a schema that is packaged with prepare and compile a validator for it, this only happens once per schema
+
+    :param name: the file name of the schema
+    :return: the validator
+    """
+    schema_path = files().joinpath(f'../schemas/{name}')
+    schema: Dict[str, Any] = json.loads(schema_path.read_text())
+    DefaultValidatingValidator.check_schema(schema)
+    return DefaultValidatingValidator(schema)
+
+
+def __task_validator(json_schema: Dict[str, Any]) -> Tuple[str, Any]:
+    """
+    Get the (cached) validator for a task schema
+
+    :param json_schema: the schema of the task
+    :return: the key of the schema and the validator
+    """
+    key = hashlib.sha256(json.dumps(json_schema, sort_keys=True).encode("utf-8")).hexdigest()
+    validator = _validators.get(key, None)
+    if validator is None:
+        with _validators_lock:
+            validator = _validators.setdefault(key, DefaultValidatingValidator(json_schema))
+    return key, validator
+
+
+def __task_payload(json_schema: Dict[str, Any], task: Dict[str, Any]) -> Optional[str]:
+    """
+    Serialize the part of a task that determines the validation result. The name and id are left out if the schema
+    only requires them to be a string, so that steps using the same task with the same inputs share the result.
+
+    :param json_schema: the schema of the task
+    :param task: the task (step) to validate
+    :return: the serialized payload, None if the task cannot be serialized (e.g. it contains dates)
+    """
+    payload = dict(task)
+    properties = json_schema.get("properties", {})
+    for key in ("name", "id"):
+        if isinstance(payload.get(key, None), str) and properties.get(key, None) == {"type": "string"}:
+            payload[key] = ""
+    try:
+        return json.dumps(payload, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def __validate_payload(schema_key: str, payload: str) -> Tuple[str, Optional[Tuple[str, str]]]:
+    """
+    Validate a serialized task, identical payloads are only validated once
+
+    :param schema_key: the key of the (cached) validator
+    :param payload: the serialized task
+    :return: the serialized task including the default values and the path and message of the error (if any)
+    """
+    task = json.loads(payload)
+    error = best_match(_validators[schema_key].iter_errors(task))
+    return json.dumps(task), None if error is None else (error.json_path, error.message)
+
+
+def __validate_needs(prepare_file: str, jobs: Dict[str, Any]) -> None:
+    """
+    Validate that the jobs a job needs exist, and that the jobs don't need each other in a cycle
+
+    :param prepare_file: path/name of the prepare file
+    :param jobs: the jobs in the prepare file
+    :return: None
+    :raises: ValidationError: if a job needs an unknown job or there is a cycle
+    """
+    needs: Dict[str, List[str]] = {}
+    for name, job in jobs.items():
+        job_needs = job.get("needs", []) if isinstance(job, dict) else []
+        needs[name] = [job_needs] if isinstance(job_needs, str) else list(job_needs)
+        for need in needs[name]:
+            if need not in jobs:
+                raise VE(f"Error in: {prepare_file}, job '{name}' needs unknown job '{need}'")
+    # Remove jobs without (remaining) needs, if jobs remain they depend on each other
+    remaining = {name: set(job_needs) for name, job_needs in needs.items()}
+    ready = [name for name, job_needs in remaining.items() if len(job_needs) == 0]
+    while len(ready) > 0:
+        done = ready.pop()
+        del remaining[done]
+        for name, job_needs in remaining.items():
+            if done in job_needs:
+                job_needs.discard(done)
+                if len(job_needs) == 0:
+                    ready.append(name)
+    if len(remaining) > 0:
+        raise VE(f"Error in: {prepare_file}, jobs {', '.join(sorted(remaining))} need each other")
+
 
 def validate_prepare(prepare_file: str, prepare: Dict[str, Any]) -> None:
     """
@@ -38,16 +140,13 @@ def validate_prepare(prepare_file: str, prepare: Dict[str, Any]) -> None:
     :raises: ValidationError: if schema is not valid
     """
     logger.debug("========== Validating config file")
-    # Load the validation jsonschema
-    schema_path = files().joinpath('../schemas/prepare.schema.json')
-    schema: Dict[str, Any] = json.loads(schema_path.read_text())
-
     # Validate prepare_assignment.y(a)ml
-    try:
-        validate(prepare, schema, cls=DefaultValidatingValidator)
-    except ValidationError as ve:
+    validator = __packaged_validator("prepare.schema.json")
+    ve: Optional[ValidationError] = best_match(validator.iter_errors(prepare))
+    if ve is not None:
         message = f"Error in: {prepare_file}, unable to verify '{ve.json_path}'\n\t -> {ve.message}"
         raise VE(message)
+    __validate_needs(prepare_file, prepare["jobs"])
     logger.debug("✓ Prepare file is valid")
 
 
@@ -64,15 +163,27 @@ def validate_tasks(file: str, task: Dict[str, Any], json_schema: Any) -> None:
     name = task["name"]
     task_name = task["uses"]
     logger.debug(f"Validating '{name}' ({task_name})")
-    try:
-        # If the yaml file doesn't contain with, the default validator doesn't trigger setting default values
-        # So if the schema has 'with' property and the yaml misses, we can add it manually
-        if json_schema.get("properties", {}).get("with", None) is not None and task.get("with", None) is None:
-            task["with"] = {}
-        DefaultValidatingValidator(json_schema).validate(task)
-    except ValidationError as ve:
+    # If the yaml file doesn't contain with, the default validator doesn't trigger setting default values
+    # So if the schema has 'with' property and the yaml misses, we can add it manually
+    if json_schema.get("properties", {}).get("with", None) is not None and task.get("with", None) is None:
+        task["with"] = {}
+    step = {key: value for key, value in task.items() if key not in STEP_PROPERTIES}
+    schema_key, validator = __task_validator(json_schema)
+    payload = __task_payload(json_schema, step)
+    error: Optional[Tuple[str, str]]
+    if payload is None:
+        ve = best_match(validator.iter_errors(step))
+        error = None if ve is None else (ve.json_path, ve.message)
+    else:
+        validated, error = __validate_payload(schema_key, payload)
+        # Copy the default values, but keep the name and id of this task
+        defaults = json.loads(validated)
+        defaults.pop("name", None)
+        defaults.pop("id", None)
+        task.update(defaults)
+    if error is not None:
         message = (f"Error in: {file}, unable to verify task '{name}' ({task_name})\n\t "
-                   f"-> {ve.json_path}: {ve.message}")
+                   f"-> {error[0]}: {error[1]}")
         raise VE(message)
 
 
@@ -96,20 +207,16 @@ def validate_task_definition(path: str | os.PathLike[str] | os.PathLike) -> Any:
     """
     logger.debug("Validating task definition")
 
-    # Load the validation jsonschema
-    schema_path = files().joinpath('../schemas/task.schema.json')
-    schema: Dict[str, Any] = json.loads(schema_path.read_text())
-
     task_definition = load_yaml(path)
 
-    try:
-        validate(task_definition, schema, cls=DefaultValidatingValidator)
-        # Overwrite the task.yml file as we might have added default values
-        with open(path, 'w') as handle:
-            YAML_LOADER.dump(task_definition, handle)
-    except ValidationError as ve:
+    validator = __packaged_validator("task.schema.json")
+    ve: Optional[ValidationError] = best_match(validator.iter_errors(task_definition))
+    if ve is not None:
         message = f"Unable to verify: {path}\n\t -> {ve.json_path}: {ve.message}"
         raise VE(message)
+    # Overwrite the task.yml file as we might have added default values
+    with open(path, 'w') as handle:
+        YAML_LOADER.dump(task_definition, handle)
 
     return task_definition
 
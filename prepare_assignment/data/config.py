@@ -13,6 +13,13 @@ class Core:
     git_mode: GitMode = GitMode.ssh
     verbose: int = 0
     debug: int = 0
+    max_workers: int = 1
+    tag_cache_ttl: int = 3600
+    wheelhouse: Optional[str] = None
+    offline: bool = False
+    task_workers: bool = False
+    cache_max_size: Optional[str] = None
+    metrics_file: Optional[str] = None
 
 
 @dataclass
@@ -1,10 +1,9 @@
 import logging
 import re
-from typing import Final, Dict, Type
+import threading
+from typing import Any, Final, Dict, Optional, Type, cast
 
-from prepare_assignment.data.config import Config
-from prepare_assignment.utils.config import load_config
-from prepare_assignment.utils.executables import get_bash_path
+from prepare_assignment.data.config import Config, Core
 
 TYPE_MAPPING: Final[Dict[str, Type]] = {
     "string": str,
@@ -18,6 +17,57 @@ HAS_SUB_REGEX: Final[re.Pattern] = re.compile(r"(?P<exp>\${{\s*(?P<content>.*?)\
 
 LOG_LEVEL_TRACE: Final[int] = logging.DEBUG - 5
 
-CONFIG: Config = load_config()
+# Directories in the cache for the lock files, and for the tasks that are being installed
+LOCKS_PATH: Final[str] = "locks"
+STAGING_PATH: Final[str] = "staging"
 
-BASH_EXECUTABLE: Final[str] = get_bash_path()
+
+class _LazyConfig:
+    """
+    Loads the config file the first time the config is used, so commands that don't need it don't pay for it
+    """
+
+    def __init__(self) -> None:
+        self._config: Optional[Config] = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        if self._config is None:
+            with self._lock:
+                if self._config is None:
+                    from prepare_assignment.utils.config import load_config
+                    self._config = load_config()
+        return getattr(self._config, name)
+
+    def set_core(self, core: Core) -> None:
+        """
+        Use the given core settings instead of loading the config file
+
+        :param core: the core settings
+        :return: None
+        """
+        with self._lock:
+            self._config = Config(core)
+
+
+_LAZY_CONFIG: Final[_LazyConfig] = _LazyConfig()
+CONFIG: Config = cast(Config, _LAZY_CONFIG)
+
+
+def set_core(core: Core) -> None:
+    """
+    Replace the core settings of CONFIG, e.g. in a worker process that doesn't have the settings of the command line
+
+    :param core: the core settings
+    :return: None
+    """
+    _LAZY_CONFIG.set_core(core)
+
+
+def __getattr__(name: str) -> Any:
+    # Looking up bash is only needed when running tasks
+    if name == "BASH_EXECUTABLE":
+        from prepare_assignment.utils.executables import get_bash_path
+        globals()["BASH_EXECUTABLE"] = get_bash_path()
+        return globals()["BASH_EXECUTABLE"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,6 +3,7 @@ from typing import Dict, Any, Optional
 
 from prepare_assignment.data.task_definition import PythonTaskDefinition
 from prepare_assignment.data.prepare import Task
+from prepare_assignment.utils.run_control import RunControl
 
 
 @dataclass
@@ -13,3 +14,12 @@ class JobEnvironment:
     job_failed: bool = False
     current_task_definition: Optional[PythonTaskDefinition] = None
     current_task: Optional[Task] = None
+    # The jobs this job needs, mapped to their outputs
+    needs: Dict[str, Any] = field(default_factory=dict)
+    # The directory the tasks run in, None for the working directory of the process
+    cwd: Optional[str] = None
+    # The names of the job and of the step that is running, for the events of the run control
+    job: Optional[str] = None
+    step: Optional[str] = None
+    # Follows and cancels the run, None if the run cannot be cancelled
+    control: Optional[RunControl] = None
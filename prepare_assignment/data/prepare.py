@@ -10,11 +10,19 @@ from typing import Dict, Optional, Union, Any, List
 TaskInput = Union[str, float, int, list]
 
 
+def _paths(yaml: Dict[str, Any], key: str) -> List[str]:
+    paths: Union[str, List[str]] = yaml.get(key, [])
+    return [paths] if isinstance(paths, str) else list(paths)
+
+
 @dataclass
 class Task(ABC):
     name: str
     id: Optional[str]
     if_: Optional[str]
+    # The paths the task reads and writes, used to run tasks that don't conflict concurrently
+    reads: List[str]
+    writes: List[str]
 
     @property
     @abstractmethod
@@ -43,7 +51,9 @@ class RunTask(Task):
             name=yaml["name"],
             run=yaml["run"],
             id=yaml.get("id", None),
-            if_=yaml.get("if", None)
+            if_=yaml.get("if", None),
+            reads=_paths(yaml, "reads"),
+            writes=_paths(yaml, "writes")
         )
 
     @property
@@ -63,7 +73,9 @@ class UsesTask(Task):
             uses=yaml["uses"],
             with_=yaml.get("with", {}),
             id=yaml.get("id", None),
-            if_=yaml.get("if", None)
+            if_=yaml.get("if", None),
+            reads=_paths(yaml, "reads"),
+            writes=_paths(yaml, "writes")
         )
 
     @property
@@ -71,15 +83,44 @@ class UsesTask(Task):
         return False
 
 
+@dataclass
+class Job:
+    name: str
+    tasks: List[Task]
+    needs: List[str]
+
+    @staticmethod
+    def steps_of(yaml: Union[List[Any], Dict[str, Any]]) -> List[Any]:
+        """
+        Get the steps of a job, a job is either a list of steps or an object with 'steps' (and 'needs')
+
+        :param yaml: the job as defined in the prepare file
+        :return: the steps of the job
+        """
+        if isinstance(yaml, dict):
+            steps: List[Any] = yaml.get("steps", [])
+            return steps
+        return yaml
+
+    @classmethod
+    def of(cls, name: str, yaml: Union[List[Any], Dict[str, Any]]) -> Job:
+        needs: Union[str, List[str]] = yaml.get("needs", []) if isinstance(yaml, dict) else []
+        return cls(
+            name=name,
+            tasks=[Task.of(value) for value in Job.steps_of(yaml)],
+            needs=[needs] if isinstance(needs, str) else list(needs)
+        )
+
+
 @dataclass
 class Prepare:
     name: str
-    jobs: Dict[str, List[Task]]
+    jobs: Dict[str, Job]
 
     @classmethod
     def of(cls, yaml: Dict[str, Any]) -> Prepare:
         jobs_dict = yaml.get("jobs", {})
-        jobs = {key: [Task.of(value) for value in values] for key, values in jobs_dict.items()}
+        jobs = {key: Job.of(key, value) for key, value in jobs_dict.items()}
         return cls(
             name=yaml["name"],
             jobs=jobs
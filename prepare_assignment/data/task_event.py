@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass(frozen=True)
+class TaskEvent:
+    """
+    A command (e.g. 'set-output' or 'error') that a task sent while running
+    """
+    job: str
+    task: str
+    command: str
+    # The parameters as sent by the task
+    params: List[str]
@@ -3,13 +3,9 @@ import os.path
 from enum import Enum
 from typing import Dict, Any
 
-import dacite
-from dacite import from_dict
 from importlib_resources import files
 from pathlib import Path
 
-from jsonschema import validate, ValidationError
-
 from prepare_assignment.data.config import Config, Core
 from prepare_assignment.data.errors import ValidationError as VE
 from prepare_assignment.utils.paths import get_config_path
@@ -25,6 +21,9 @@ def __convert_keys(obj: Any) -> Any:
 
 
 def __validate_config(config_path: Path, config: Dict[str, Any]) -> None:
+    # Only needed if there is a config file, and jsonschema is slow to import
+    from jsonschema import validate, ValidationError
+
     schema_path = files().joinpath('../schemas/config.schema.json')
     schema: Dict[str, Any] = json.loads(schema_path.read_text())
 
@@ -47,8 +46,9 @@ def load_config() -> Config:
         return config
 
     __validate_config(config_path, yaml)
+    import dacite
     converted_yaml = __convert_keys(yaml)
-    config = from_dict(
+    config = dacite.from_dict(
         data_class=Config,
         data=converted_yaml,
         config=dacite.Config(cast=[Enum])
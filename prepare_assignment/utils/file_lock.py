@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import Final, IO, Optional, Type
+
+from prepare_assignment.data.constants import LOCKS_PATH
+
+# Characters that are not used in the names of lock files
+LOCK_NAME_REGEX: Final[re.Pattern] = re.compile(r"[^A-Za-z0-9._@-]")
+
+
+def lock_path(directory: str | os.PathLike, name: str) -> Path:
+    """
+    Get the lock file for a name, e.g. the name of a task
+
+    :param directory: the directory with the lock files
+    :param name: the name of the resource that is locked
+    :return: the path of the lock file
+    """
+    return Path(os.path.join(directory, LOCK_NAME_REGEX.sub("_", name) + ".lock"))
+
+
+def cache_lock(cache_path: str | os.PathLike, name: str) -> FileLock:
+    """
+    Get the lock that makes sure a resource in the cache (e.g. a task or a virtualenv) is not changed by multiple
+    processes at the same time, e.g. when multiple assignments are prepared in parallel on one machine. Every change
+    of a resource holds its lock: 'task-<task>', 'venv-<key>' or 'mirror-<organization>-<name>'.
+
+    :param cache_path: the cache directory
+    :param name: the name of the resource
+    :return: the lock
+    """
+    return FileLock(lock_path(os.path.join(cache_path, LOCKS_PATH), name))
+
+
+class FileLock:
+    """
+    Exclusive lock that is shared between processes, based on a lock file (flock on POSIX, msvcrt on Windows).
+    The lock also excludes other threads of the same process, as long as they use their own FileLock.
+
+    The lock is released when the process stops, so a process that is killed never leaves a lock behind. Lock files
+    are never removed, removing them would let two processes hold the lock on different files.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """
+        :param path: the lock file, created if it doesn't exist
+        """
+        self.path = Path(path)
+        self._handle: Optional[IO[bytes]] = None
+
+    def acquire(self) -> None:
+        """
+        Wait until the lock is acquired
+
+        :return: None
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.path, "a+b")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                handle.seek(0)
+                while True:
+                    try:
+                        # Locking the first byte is enough, it also works if the file is empty
+                        msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            handle.close()
+            raise
+        self._handle = handle
+
+    def release(self) -> None:
+        """
+        Release the lock, if it is held
+
+        :return: None
+        """
+        handle = self._handle
+        if handle is None:
+            return
+        self._handle = None
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+    def __enter__(self) -> FileLock:
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.release()
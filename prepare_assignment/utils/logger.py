@@ -1,5 +1,7 @@
 import logging
-from typing import Dict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
 
 from prepare_assignment.data.constants import LOG_LEVEL_TRACE
 
@@ -116,3 +118,56 @@ def add_logging_level(level_name: str, level_value: int, function_name: str) ->
     setattr(logging, level_name, level_value)
     setattr(logging.getLoggerClass(), function_name, log_for_level)
     setattr(logging, function_name, log_to_root)
+
+
+class JobLogBuffer(logging.Filter):
+    """
+    Hold back the log records of jobs that run concurrently, so the output of a job can be written in one go once the
+    job is finished, instead of being interleaved with the output of the other jobs.
+
+    The filter is installed once, the records are only captured in the context (thread or asyncio task) that called
+    capture, so runs that happen at the same time in one process don't capture each other's records.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._records: ContextVar[Optional[List[logging.LogRecord]]] = ContextVar(f"job_log_buffer_{id(self)}",
+                                                                                  default=None)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        records = self._records.get()
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+    def current(self) -> Optional[List[logging.LogRecord]]:
+        """
+        :return: the list the current context captures its records in, None if the context doesn't capture records
+        """
+        return self._records.get()
+
+    @contextmanager
+    def capture(self, records: List[logging.LogRecord]) -> Iterator[None]:
+        """
+        Capture the records that are logged in the current context
+
+        :param records: the list to add the records to
+        """
+        token = self._records.set(records)
+        try:
+            yield
+        finally:
+            self._records.reset(token)
+
+    @staticmethod
+    def flush(records: List[logging.LogRecord]) -> None:
+        """
+        Write the captured records to the handlers of the loggers they were logged to
+
+        :param records: the captured records
+        :return: None
+        """
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        records.clear()
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Final, List, Optional, Tuple
+
+from prepare_assignment.utils.file_lock import FileLock
+from prepare_assignment.utils.tracing import add_span_listener
+
+# Writes statistics of runs in the OpenMetrics text format, e.g. for the textfile collector of the node exporter.
+# The counters and histograms in the file are cumulative: every run adds its values to the values in the file.
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Upper bounds (in seconds) of the buckets of the duration histograms
+DURATION_BUCKETS: Final[Tuple[float, ...]] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+                                               300)
+
+
+@dataclass(frozen=True)
+class MetricFamily:
+    name: str
+    type: str
+    help: str
+
+
+FAMILIES: Final[Dict[str, MetricFamily]] = {family.name: family for family in [
+    MetricFamily("prepare_runs", "counter", "Number of runs, per result"),
+    MetricFamily("prepare_last_run_timestamp_seconds", "gauge", "Time the last run finished"),
+    MetricFamily("prepare_jobs", "counter", "Number of jobs that have run, per result"),
+    MetricFamily("prepare_task_installs", "counter", "Number of task versions that have been installed"),
+    MetricFamily("prepare_task_cache_hits", "counter", "Number of task versions that were already installed"),
+    MetricFamily("prepare_venv_installs", "counter", "Number of virtual environments that have been created"),
+    MetricFamily("prepare_venv_cache_hits", "counter", "Number of virtual environments that were already created"),
+    MetricFamily("prepare_tag_cache_lookups", "counter", "Number of lookups of the tags of a task repository, per "
+                                                         "result"),
+    MetricFamily("prepare_task_exits", "counter", "Number of task processes that exited, per exit code"),
+    MetricFamily("prepare_output_lines", "counter", "Number of lines of task output that have been processed"),
+    MetricFamily("prepare_preparation_duration_seconds", "histogram", "Time it took to prepare the tasks of a run"),
+    MetricFamily("prepare_resolve_version_duration_seconds", "histogram", "Time it took to resolve the version of a "
+                                                                          "task"),
+    MetricFamily("prepare_mirror_duration_seconds", "histogram", "Time it took to create or fetch a repository "
+                                                                 "mirror"),
+    MetricFamily("prepare_clone_duration_seconds", "histogram", "Time it took to clone a task from its mirror"),
+    MetricFamily("prepare_venv_create_duration_seconds", "histogram", "Time it took to create a virtualenv"),
+    MetricFamily("prepare_venv_clone_duration_seconds", "histogram", "Time it took to clone the virtualenv template"),
+    MetricFamily("prepare_pip_install_duration_seconds", "histogram", "Time it took to install the dependencies of "
+                                                                      "a task"),
+    MetricFamily("prepare_task_install_duration_seconds", "histogram", "Time it took to install a task"),
+    MetricFamily("prepare_step_duration_seconds", "histogram", "Time it took to run a step"),
+    MetricFamily("prepare_job_duration_seconds", "histogram", "Time it took to run a job"),
+    MetricFamily("prepare_run_duration_seconds", "histogram", "Time it took to run the jobs of an assignment"),
+]}
+
+# The histograms of the durations of spans (see tracing), mapped by the name of the span
+SPAN_DURATIONS: Final[Dict[str, str]] = {
+    "prepare tasks": "prepare_preparation_duration_seconds",
+    "resolve version": "prepare_resolve_version_duration_seconds",
+    "mirror": "prepare_mirror_duration_seconds",
+    "clone": "prepare_clone_duration_seconds",
+    "cli_run": "prepare_venv_create_duration_seconds",
+    "clone virtualenv": "prepare_venv_clone_duration_seconds",
+    "pip install": "prepare_pip_install_duration_seconds",
+    "install task": "prepare_task_install_duration_seconds",
+    "step": "prepare_step_duration_seconds",
+    "job": "prepare_job_duration_seconds",
+    "run": "prepare_run_duration_seconds",
+}
+
+
+def __escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: Labels) -> str:
+    if len(labels) == 0:
+        return name
+    return name + "{" + ",".join(f'{key}="{__escape(value)}"' for key, value in labels) + "}"
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def __family_of(sample: str) -> Optional[str]:
+    name = sample.split("{", 1)[0]
+    for suffix in ("", "_total", "_bucket", "_sum", "_count"):
+        if suffix == "" or name.endswith(suffix):
+            family = name[:len(name) - len(suffix)]
+            if family in FAMILIES:
+                return family
+    return None
+
+
+def _step_task(attributes: Dict[str, Any]) -> str:
+    # Shell commands are not grouped by their command, as commands often contain paths or expressions
+    return str(attributes.get("uses", None) or "run")
+
+
+class Metrics:
+    """
+    Thread safe collection of the counters and histograms of a run
+    """
+
+    def __init__(self) -> None:
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        # Count per bucket (and +Inf), sum
+        self._histograms: Dict[Tuple[str, Labels], Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._gauges[(name, tuple(sorted((labels or {}).items())))] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            counts, total = self._histograms.get(key, ([0] * (len(DURATION_BUCKETS) + 1), 0.0))
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self._histograms[key] = (counts, total + value)
+
+    def observe_span(self, name: str, category: str, duration: float, attributes: Dict[str, Any]) -> None:
+        """
+        Update the metrics with a finished span, see tracing.add_span_listener
+        """
+        task = str(attributes.get("task", None) or "run")
+        if name == "step":
+            self.observe(SPAN_DURATIONS[name], duration, {"task": _step_task(attributes)})
+        elif name == "install task":
+            # If another process installed the task in the meantime, the task is loaded which counts as a cache hit
+            if attributes.get("cache", None) == "miss" and "error" not in attributes:
+                self.observe(SPAN_DURATIONS[name], duration, {"task": task})
+                self.inc("prepare_task_installs", {"task": task})
+        elif name == "load task":
+            self.inc("prepare_task_cache_hits", {"task": task})
+        elif name == "virtualenv" and "cache" in attributes:
+            self.inc("prepare_venv_cache_hits" if attributes["cache"] == "hit" else "prepare_venv_installs")
+        elif name == "resolve version" and "tag cache" in attributes:
+            self.observe(SPAN_DURATIONS[name], duration)
+            self.inc("prepare_tag_cache_lookups", {"result": str(attributes["tag cache"])})
+        elif name in ("task process", "shell process"):
+            if attributes.get("exit code", None) is not None:
+                self.inc("prepare_task_exits", {"task": task, "code": str(attributes["exit code"])})
+            if attributes.get("output lines", None) is not None:
+                self.inc("prepare_output_lines", {"task": task}, attributes["output lines"])
+        elif name == "job":
+            failed = attributes.get("failed", False) or "error" in attributes
+            self.observe(SPAN_DURATIONS[name], duration)
+            self.inc("prepare_jobs", {"result": "failure" if failed else "success"})
+        elif name in SPAN_DURATIONS:
+            self.observe(SPAN_DURATIONS[name], duration)
+
+    def take_samples(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get the samples and reset the metrics, so the next run starts from zero
+
+        :return: the samples, per metric family
+        """
+        result: Dict[str, Dict[str, float]] = {name: {} for name in FAMILIES}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                result[name][_sample(f"{name}_total", labels)] = value
+            for (name, labels), value in sorted(self._gauges.items()):
+                result[name][_sample(name, labels)] = value
+            for (name, labels), (counts, total) in sorted(self._histograms.items()):
+                bounds = [_format(bound) for bound in DURATION_BUCKETS] + ["+Inf"]
+                for bound, count in zip(bounds, counts):
+                    result[name][_sample(f"{name}_bucket", labels + (("le", bound),))] = count
+                result[name][_sample(f"{name}_sum", labels)] = total
+                result[name][_sample(f"{name}_count", labels)] = counts[-1]
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+        return result
+
+
+def __read_samples(path: str | os.PathLike) -> Dict[str, Dict[str, float]]:
+    samples: Dict[str, Dict[str, float]] = {name: {} for name in FAMILIES}
+    try:
+        with open(path, "r") as handle:
+            lines = handle.read().splitlines()
+    except OSError:
+        return samples
+    for line in lines:
+        if line.startswith("#") or " " not in line:
+            continue
+        sample, value = line.rsplit(" ", 1)
+        family = __family_of(sample)
+        if family is None:
+            continue
+        try:
+            samples[family][sample] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+def write_metrics(metrics: Metrics, path: str | os.PathLike) -> None:
+    """
+    Add the metrics to the metrics file (gauges are replaced) and reset them. The file is replaced atomically, so a
+    collector never reads a partial file. Processes that write the same file at the same time wait for each other.
+
+    :param metrics: the metrics of the run
+    :param path: the metrics file
+    :return: None
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    current = metrics.take_samples()
+    with FileLock(f"{path}.lock"):
+        previous = __read_samples(path)
+        lines: List[str] = []
+        for name, family in FAMILIES.items():
+            merged = dict(current[name])
+            if family.type != "gauge":
+                for sample, value in merged.items():
+                    merged[sample] = value + previous[name].get(sample, 0)
+            for sample, value in previous[name].items():
+                merged.setdefault(sample, value)
+            if len(merged) == 0:
+                continue
+            lines.append(f"# TYPE {name} {family.type}")
+            lines.append(f"# HELP {name} {family.help}")
+            lines.extend(f"{sample} {_format(value)}" for sample, value in merged.items())
+        lines.append("# EOF")
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}-")
+        try:
+            with os.fdopen(fd, "w") as handle:
+                handle.write("\n".join(lines) + "\n")
+            # mkstemp only allows the owner to read the file, the collector might run as another user
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+# The metrics of this process, only collected once enabled
+metrics = Metrics()
+_enabled = False
+_enabled_lock = threading.Lock()
+
+
+def enable_metrics() -> Metrics:
+    """
+    Start collecting metrics from the spans of the runs (see tracing)
+
+    :return: the metrics of this process
+    """
+    global _enabled
+    with _enabled_lock:
+        if not _enabled:
+            add_span_listener(metrics.observe_span)
+            _enabled = True
+    return metrics
+
+
+def record_run(succeeded: bool) -> None:
+    """
+    Count a run (of one assignment)
+
+    :param succeeded: True if the assignment was prepared
+    :return: None
+    """
+    metrics.inc("prepare_runs", {"result": "success" if succeeded else "failure"})
+    metrics.set("prepare_last_run_timestamp_seconds", time.time())
@@ -5,9 +5,13 @@ from pathlib import Path
 from typing import Final, Optional
 
 TASKS_PATH: Final[str] = "tasks"
+VENVS_PATH: Final[str] = "venvs"
+MIRRORS_PATH: Final[str] = "mirrors"
 
 __cache_path = None
 __tasks_path = None
+__venvs_path = None
+__mirrors_path = None
 __config_path: Optional[Path] = None
 
 
@@ -66,3 +70,29 @@ def get_tasks_path() -> Path:
     cache_path = get_cache_path()
     __tasks_path = Path(os.path.join(cache_path, TASKS_PATH))
     return __tasks_path
+
+
+def get_venvs_path() -> Path:
+    """
+    Get the path to the pool of virtual environments that are shared between tasks
+    :return: Path to the virtual environment pool
+    """
+    global __venvs_path
+    if __venvs_path:
+        return __venvs_path
+    cache_path = get_cache_path()
+    __venvs_path = Path(os.path.join(cache_path, VENVS_PATH))
+    return __venvs_path
+
+
+def get_mirrors_path() -> Path:
+    """
+    Get the path to the bare mirrors of the task repositories, the versions of a task are checked out from its mirror
+    :return: Path to the mirrors
+    """
+    global __mirrors_path
+    if __mirrors_path:
+        return __mirrors_path
+    cache_path = get_cache_path()
+    __mirrors_path = Path(os.path.join(cache_path, MIRRORS_PATH))
+    return __mirrors_path
@@ -0,0 +1,79 @@
+import os
+import signal
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from prepare_assignment.data.task_event import TaskEvent
+
+
+def kill_process_group(pid: int) -> None:
+    """
+    Kill a process that has been started in its own session, including the processes it started
+
+    :param pid: the process id, which is also the id of its process group
+    :return: None
+    """
+    try:
+        if sys.platform == "win32":
+            os.kill(pid, signal.SIGTERM)
+        else:
+            os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        # The process is already finished
+        pass
+
+
+class RunControl:
+    """
+    Lets the code that started a run follow it and cancel it from another thread, e.g. the event loop of
+    prepare_async. Once the run is cancelled, the processes of the running tasks are killed and no new steps or jobs
+    are started.
+    """
+
+    def __init__(self, on_event: Optional[Callable[[TaskEvent], None]] = None):
+        """
+        :param on_event: called (from the thread that runs the task) with every command a task sends
+        """
+        self.on_event = on_event
+        self._cancelled = False
+        self._lock = threading.Lock()
+        self._kills: Dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        """
+        Cancel the run, the running tasks are killed
+
+        :return: None
+        """
+        with self._lock:
+            self._cancelled = True
+            kills = list(self._kills.values())
+        for kill in kills:
+            kill()
+
+    @contextmanager
+    def register(self, kill: Callable[[], None]) -> Iterator[None]:
+        """
+        Register a running process, it is killed if the run is cancelled before the context is left
+
+        :param kill: kills the process
+        """
+        with self._lock:
+            key = self._next_id
+            self._next_id += 1
+            self._kills[key] = kill
+            cancelled = self._cancelled
+        if cancelled:
+            kill()
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._kills[key]
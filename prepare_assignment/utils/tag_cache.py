@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from packaging.version import Version, InvalidVersion
+
+logger = logging.getLogger("prepare_assignment")
+
+
+def parse_tags(raw: str) -> List[str]:
+    """
+    Parse the output of 'git ls-remote --tags' into a list of tag names
+
+    :param raw: the output of git ls-remote
+    :return: the tag names, without the peeled ('^{}') entries
+    """
+    tags: List[str] = []
+    for line in raw.splitlines():
+        parts = line.split("\t")
+        if len(parts) != 2:
+            continue
+        ref = parts[1]
+        if ref.endswith("^{}"):
+            continue
+        tags.append(ref.replace("refs/tags/", ""))
+    return tags
+
+
+class RemoteTags:
+    """
+    The tags of a remote repository, kept sorted so lookups don't have to scan every tag.
+    """
+
+    def __init__(self, tags: Iterable[str]):
+        # Sorted by name, used to find exact and prefix matches
+        self.names: List[str] = sorted(set(tags))
+        # Sorted by version, only contains the tags that are a valid version
+        self.versions: List[Tuple[Version, str]] = []
+        self._parsed: Dict[str, Version] = {}
+        for tag in self.names:
+            try:
+                version = Version(tag)
+            except InvalidVersion:
+                continue
+            self._parsed[tag] = version
+            self.versions.append((version, tag))
+        self.versions.sort(key=lambda x: x[0])
+
+    def __contains__(self, tag: object) -> bool:
+        if not isinstance(tag, str):
+            return False
+        index = bisect_left(self.names, tag)
+        return index < len(self.names) and self.names[index] == tag
+
+    def latest(self) -> Optional[str]:
+        """
+        :return: the tag with the highest version, None if there are no versioned tags
+        """
+        if len(self.versions) == 0:
+            return None
+        return self.versions[-1][1]
+
+    def highest_with_prefix(self, prefix: str) -> Optional[str]:
+        """
+        Find the tag with the highest version that starts with prefix, e.g. "v1" → "v1.1.2"
+
+        :param prefix: the prefix the tag should start with
+        :return: the matching tag, None if no versioned tag starts with prefix
+        """
+        best: Optional[Tuple[Version, str]] = None
+        # All tags starting with prefix form a consecutive range in the sorted names
+        index = bisect_left(self.names, prefix)
+        while index < len(self.names) and self.names[index].startswith(prefix):
+            tag = self.names[index]
+            version = self._parsed.get(tag, None)
+            if version is not None and (best is None or version > best[0]):
+                best = (version, tag)
+            index += 1
+        return None if best is None else best[1]
+
+
+class TagCache:
+    """
+    Cache of the tags of remote repositories, keyed by git url.
+
+    Tags are remembered in the process and persisted to disk, both are used as long as the tags
+    are not older than the ttl. A ttl of 0 ignores the persisted tags, but a remote is still only listed
+    once per process.
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: the directory to persist the tags in
+        """
+        self.path = path
+        # The tags, the time they were listed and whether they were listed by this process
+        self._memo: Dict[str, Tuple[float, RemoteTags, bool]] = {}
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, git_url: str, fetch: Callable[[], str], ttl: int) -> RemoteTags:
+        """
+        Get the tags of a remote repository.
+
+        :param git_url: the url of the repository
+        :param fetch: function that lists the remote tags (output of 'git ls-remote --tags')
+        :param ttl: the maximum age in seconds of the tags, 0 to list the remote once in this process
+        :return: the tags of the remote repository
+        """
+        with self._lock:
+            url_lock = self._url_locks.setdefault(git_url, threading.Lock())
+        # Make sure the same repository is only listed once, even if it is requested concurrently
+        with url_lock:
+            memo = self._memo.get(git_url, None)
+            if memo is not None and ((ttl <= 0 and memo[2]) or time.time() - memo[0] < ttl):
+                return memo[1]
+            cached = self.__read(git_url, ttl)
+            if cached is None:
+                logger.debug(f"Listing remote tags of '{git_url}'")
+                timestamp = time.time()
+                names = parse_tags(fetch())
+                self.__write(git_url, names, timestamp)
+            else:
+                logger.debug(f"Using cached tags of '{git_url}'")
+                timestamp, names = cached
+            tags = RemoteTags(names)
+            self._memo[git_url] = (timestamp, tags, cached is None)
+            return tags
+
+    def clear(self) -> None:
+        """
+        Forget the tags that have been memoized in this process
+        :return: None
+        """
+        with self._lock:
+            self._memo.clear()
+
+    def __file(self, git_url: str) -> Path:
+        digest = hashlib.sha256(git_url.encode("utf-8")).hexdigest()
+        return Path(os.path.join(self.path, f"{digest}.json"))
+
+    def __read(self, git_url: str, ttl: int) -> Optional[Tuple[float, List[str]]]:
+        if ttl <= 0:
+            return None
+        file = self.__file(git_url)
+        try:
+            with open(file, "r") as handle:
+                cached = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(cached, dict) or cached.get("url", None) != git_url:
+            return None
+        timestamp = cached.get("timestamp", 0)
+        if not isinstance(timestamp, (int, float)) or time.time() - timestamp >= ttl:
+            return None
+        tags = cached.get("tags", None)
+        if not isinstance(tags, list):
+            return None
+        return timestamp, [tag for tag in tags if isinstance(tag, str)]
+
+    def __write(self, git_url: str, tags: List[str], timestamp: float) -> None:
+        file = self.__file(git_url)
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first, so other processes never read a partially written file
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "w") as handle:
+                json.dump({"url": git_url, "timestamp": timestamp, "tags": tags}, handle)
+            os.replace(tmp, file)
+        except OSError as e:
+            logger.debug(f"Unable to persist tags of '{git_url}': {e}")
@@ -0,0 +1,319 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Final, Iterable, List, Optional, Set, Tuple
+
+from prepare_assignment.data.constants import STAGING_PATH
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.file_lock import FileLock, cache_lock
+from prepare_assignment.utils.paths import get_cache_path, get_mirrors_path, get_venvs_path
+from prepare_assignment.utils.task_index import get_task_index, schema_path
+from prepare_assignment.utils.tasks import get_all_tasks, get_dependents
+from prepare_assignment.utils.virtual_env import get_venv_key, VENV_COMPLETE, VENV_TEMPLATE_PREFIX
+
+# File inside the task directory of which the modification time is the last time the task was run
+LAST_USED: Final[str] = "last-used"
+# File in the cache directory of which the modification time is the last time the cache was collected automatically
+LAST_COLLECTED: Final[str] = "last-gc"
+# Minimum number of seconds between automatic collections, a collection has to walk the whole cache
+AUTO_COLLECT_INTERVAL: Final[float] = 3600
+# Number of seconds after which a task or virtualenv that has been installed or used can be removed, so a run that is
+# preparing or using it in another process doesn't lose it
+GRACE_PERIOD: Final[float] = 600
+
+SIZE_REGEX: Final[re.Pattern] = re.compile(r"^\s*(?P<value>[0-9]+(?:\.[0-9]+)?)\s*(?P<unit>[kmgt]?)i?b?\s*$",
+                                           re.IGNORECASE)
+AGE_REGEX: Final[re.Pattern] = re.compile(r"^\s*(?P<value>[0-9]+(?:\.[0-9]+)?)\s*(?P<unit>[smhdw]?)\s*$",
+                                          re.IGNORECASE)
+SIZE_UNITS: Final[Dict[str, int]] = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+AGE_UNITS: Final[Dict[str, int]] = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+logger = logging.getLogger("prepare_assignment")
+
+# Tasks of which the last-used marker has been updated by this process, it only needs to be updated once
+_marked: Set[str] = set()
+_marked_lock = threading.Lock()
+
+
+@dataclass
+class CollectedGarbage:
+    # The task versions that have been removed
+    tasks: List[TaskProperties] = field(default_factory=list)
+    # The number of bytes that have been freed (an estimate, files that are linked elsewhere are not counted)
+    freed: int = 0
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size, e.g. '2G', '500MB', '1.5GiB' or '1024' (bytes). Units are powers of 1024.
+
+    :param size: the size
+    :return: the size in bytes
+    :raises ValueError: if the size cannot be parsed
+    """
+    match = SIZE_REGEX.match(size)
+    if match is None:
+        raise ValueError(f"Invalid size '{size}', use e.g. '500M' or '2G'")
+    return int(float(match.group("value")) * SIZE_UNITS[match.group("unit").lower()])
+
+
+def parse_age(age: str) -> float:
+    """
+    Parse an age, e.g. '30d', '12h', '2w' or '3600' (seconds)
+
+    :param age: the age
+    :return: the age in seconds
+    :raises ValueError: if the age cannot be parsed
+    """
+    match = AGE_REGEX.match(age)
+    if match is None:
+        raise ValueError(f"Invalid age '{age}', use e.g. '12h' or '30d'")
+    return float(match.group("value")) * AGE_UNITS[match.group("unit").lower()]
+
+
+def mark_used(props: TaskProperties) -> None:
+    """
+    Record that a task is used now, the marker is only updated once per process
+
+    :param props: the task properties
+    :return: None
+    """
+    with _marked_lock:
+        if str(props) in _marked:
+            return
+        _marked.add(str(props))
+    try:
+        Path(os.path.join(props.task_path, LAST_USED)).touch()
+    except OSError as e:
+        logger.debug(f"Unable to mark task '{props}' as used: {e}")
+
+
+def last_used(props: TaskProperties) -> float:
+    """
+    :param props: the task properties
+    :return: the last time the task was used, if it has never been used the time it was installed
+    """
+    for path in (os.path.join(props.task_path, LAST_USED), schema_path(props), props.task_path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            continue
+    return 0
+
+
+def disk_usage(path: str, seen: Optional[Set[Tuple[int, int]]] = None) -> int:
+    """
+    Get the number of bytes the files in a directory use, files with multiple links are counted once
+
+    :param path: the directory
+    :param seen: the (device, inode) of the files with multiple links that have already been counted
+    :return: the number of bytes
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+
+def __freeable(path: str) -> int:
+    # Files that are still linked from somewhere else are not freed when the path is removed
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if stat.st_nlink == 1:
+                total += stat.st_size
+    return total
+
+
+def __remove(path: str) -> int:
+    if not os.path.lexists(path):
+        return 0
+    if os.path.isdir(path):
+        freed = __freeable(path)
+        shutil.rmtree(path, ignore_errors=True)
+        return freed
+    freed = os.lstat(path).st_size
+    os.unlink(path)
+    return freed
+
+
+def __file_lock(name: str) -> FileLock:
+    # The same locks the preparer uses when it changes the resource
+    return cache_lock(get_cache_path(), name)
+
+
+def __mirror_path(props: TaskProperties) -> Path:
+    return Path(os.path.join(get_mirrors_path(), props.organization, f"{props.name}.git"))
+
+
+def __staging_paths() -> List[Path]:
+    """
+    Get the directories in which tasks are being installed or updated (organization/name/version)
+    """
+    staging_path = Path(os.path.join(get_cache_path(), STAGING_PATH))
+    return [path for path in staging_path.glob("*/*/*") if path.is_dir()]
+
+
+def __is_recent(path: str | os.PathLike, now: float) -> bool:
+    try:
+        return now - os.stat(path).st_mtime < GRACE_PERIOD
+    except OSError:
+        return False
+
+
+def __remove_venv(key: str, now: float) -> int:
+    """
+    Remove a virtual environment from the pool, unless it has been used recently or a task that is being installed
+    uses it
+    """
+    venv_path = os.path.join(get_venvs_path(), key)
+    with __file_lock(f"venv-{key}"):
+        if __is_recent(os.path.join(venv_path, VENV_COMPLETE), now) \
+                or any(get_venv_key(staging) == key for staging in __staging_paths()):
+            logger.debug(f"Keeping virtualenv '{key}', as it is in use")
+            return 0
+        logger.debug(f"Removing unused virtualenv '{key}'")
+        return __remove(venv_path)
+
+
+def __remove_mirror(props: TaskProperties) -> int:
+    """
+    Remove the mirror of a task repository, unless a version of the task is being installed
+    """
+    with __file_lock(f"mirror-{props.organization}-{props.name}"):
+        staging_path = os.path.join(get_cache_path(), STAGING_PATH, props.organization, props.name)
+        if os.path.isdir(staging_path) and len(os.listdir(staging_path)) > 0:
+            return 0
+        return __remove(str(__mirror_path(props)))
+
+
+def __unused_venvs(used: Set[Optional[str]]) -> List[str]:
+    """
+    Get the (completely installed) virtual environments in the pool that are not used, the templates are always kept
+    as every new virtual environment is cloned from them
+    """
+    venvs_path = get_venvs_path()
+    if not os.path.isdir(venvs_path):
+        return []
+    return [name for name in sorted(os.listdir(venvs_path))
+            if not name.startswith(VENV_TEMPLATE_PREFIX) and name not in used
+            and os.path.isfile(os.path.join(venvs_path, name, VENV_COMPLETE))]
+
+
+def __logs() -> List[Path]:
+    logs_path = os.path.join(get_cache_path(), "logs")
+    if not os.path.isdir(logs_path):
+        return []
+    logs = [Path(os.path.join(logs_path, name)) for name in os.listdir(logs_path) if name.endswith(".log")]
+    return sorted(logs, key=lambda log: log.stat().st_mtime)
+
+
+def collect_garbage(max_size: Optional[int] = None, max_age: Optional[float] = None,
+                    keep: Iterable[TaskProperties] = ()) -> CollectedGarbage:
+    """
+    Remove the task versions that have been used least recently, until the cache is not larger than max_size, and the
+    task versions that have not been used for max_age. Task versions that an installed composite task still uses are
+    never removed. Virtual environments and mirrors are removed once no task version uses them anymore, dependency
+    logs are removed before any task version and if they are older than max_age.
+
+    Every removal holds the lock the preparer uses for the task, virtual environment or mirror. Tasks and virtual
+    environments that have been used in the last GRACE_PERIOD seconds, or that a task which is being installed uses,
+    are never removed.
+
+    :param max_size: the maximum size in bytes of the cache, None for no maximum
+    :param max_age: the maximum number of seconds a task version is kept after it was last used, None for no maximum
+    :param keep: task versions that should never be removed, e.g. the versions that are used by the current run
+    :return: the removed task versions and the number of freed bytes
+    """
+    result = CollectedGarbage()
+    now = time.time()
+    index = get_task_index()
+    remaining = set(get_all_tasks())
+    dependents = get_dependents()
+    keep = set(keep)
+    total = disk_usage(str(get_cache_path())) if max_size is not None else 0
+
+    def over_size() -> bool:
+        return max_size is not None and total - result.freed > max_size
+
+    keys = {props: get_venv_key(props.task_path) for props in remaining}
+    for venv in __unused_venvs(set(keys.values())):
+        result.freed += __remove_venv(venv, now)
+    for log in __logs():
+        if over_size() or (max_age is not None and now - log.stat().st_mtime > max_age):
+            result.freed += __remove(str(log))
+
+    used = {props: last_used(props) for props in remaining}
+    while True:
+        candidates = [props for props in remaining if props not in keep and now - used[props] >= GRACE_PERIOD
+                      and not any(user in remaining for user in dependents.get(props, []))]
+        if len(candidates) == 0:
+            break
+        props = min(candidates, key=lambda candidate: used[candidate])
+        if not over_size() and (max_age is None or now - used[props] <= max_age):
+            break
+        with __file_lock(f"task-{props}"):
+            # Another process might have used (or updated) the task since the cache was walked
+            used[props] = last_used(props)
+            if now - used[props] < GRACE_PERIOD:
+                continue
+            logger.debug(f"Removing task '{props}'")
+            result.freed += __remove(str(props.task_path))
+            index.remove(props)
+        remaining.discard(props)
+        result.tasks.append(props)
+        key = keys[props]
+        if key is not None and not key.startswith(VENV_TEMPLATE_PREFIX) \
+                and key not in {keys[other] for other in remaining}:
+            result.freed += __remove_venv(key, now)
+        if not any(other.organization == props.organization and other.name == props.name for other in remaining):
+            result.freed += __remove_mirror(props)
+            # Remove the directories of the task and the organization once they are empty
+            for directory in (props.task_path.parent, props.task_path.parent.parent, __mirror_path(props).parent):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+    index.save()
+    return result
+
+
+def collect_garbage_automatically(max_size: int, keep: Iterable[TaskProperties] = ()) -> Optional[CollectedGarbage]:
+    """
+    Collect garbage (see collect_garbage) if the cache has not been collected automatically for a while
+
+    :param max_size: the maximum size in bytes of the cache
+    :param keep: task versions that should never be removed
+    :return: the result of the collection, None if the cache has been collected recently
+    """
+    marker = Path(os.path.join(get_cache_path(), LAST_COLLECTED))
+    try:
+        if time.time() - marker.stat().st_mtime < AUTO_COLLECT_INTERVAL:
+            return None
+    except OSError:
+        pass
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
+    return collect_garbage(max_size, keep=keep)
@@ -0,0 +1,139 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from prepare_assignment.data.task_definition import TaskDefinition, CompositeTaskDefinition
+from prepare_assignment.data.task_properties import TaskProperties
+
+
+def get_sub_tasks(task: TaskDefinition) -> List[TaskProperties]:
+    """
+    Get the tasks a (composite) task uses
+
+    :param task: the task definition
+    :return: the properties of the tasks that are used, in order of definition without duplicates
+    """
+    if not isinstance(task, CompositeTaskDefinition):
+        return []
+    sub_tasks: Dict[TaskProperties, None] = {}
+    for step in task.tasks:
+        uses = step.get("uses", None)
+        if uses:
+            sub_tasks[TaskProperties.of(uses)] = None
+    return list(sub_tasks.keys())
+
+
+@dataclass
+class TaskGraph:
+    """
+    The dependency graph of tasks, a composite task depends on all tasks it uses.
+    The task definitions are only available if the graph is created by loading the tasks.
+    """
+    tasks: Dict[TaskProperties, TaskDefinition] = field(default_factory=dict)
+    dependencies: Dict[TaskProperties, List[TaskProperties]] = field(default_factory=dict)
+
+    def dependents(self) -> Dict[TaskProperties, List[TaskProperties]]:
+        """
+        :return: mapping from task to the tasks that directly depend on it
+        """
+        reverse: Dict[TaskProperties, List[TaskProperties]] = {props: [] for props in self.dependencies}
+        for props, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                reverse.setdefault(dependency, []).append(props)
+        return reverse
+
+    def reachable(self, roots: Iterable[TaskProperties]) -> Set[TaskProperties]:
+        """
+        Get all tasks that can be reached from the roots, including the roots themselves
+
+        :param roots: the tasks to start from
+        :return: the roots and all their (transitive) dependencies
+        """
+        visited: Set[TaskProperties] = set()
+        worklist: List[TaskProperties] = list(roots)
+        while len(worklist) > 0:
+            props = worklist.pop()
+            if props in visited:
+                continue
+            visited.add(props)
+            worklist.extend(self.dependencies.get(props, []))
+        return visited
+
+    def topological_order(self) -> List[TaskProperties]:
+        """
+        Order the tasks so that every task comes after all of its dependencies
+
+        :return: the ordered tasks
+        :raises AssertionError: if the tasks contain a cycle
+        """
+        remaining = {props: len([d for d in dependencies if d in self.dependencies])
+                     for props, dependencies in self.dependencies.items()}
+        dependents = self.dependents()
+        ready: Deque[TaskProperties] = deque(props for props, count in remaining.items() if count == 0)
+        order: List[TaskProperties] = []
+        while len(ready) > 0:
+            props = ready.popleft()
+            order.append(props)
+            for dependent in dependents.get(props, []):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        if len(order) != len(self.dependencies):
+            raise AssertionError("Tasks contain a circular dependency")
+        return order
+
+
+def resolve_dependency_graph(roots: Iterable[TaskProperties],
+                             get_dependencies: Callable[[TaskProperties], List[TaskProperties]],
+                             skip: Optional[Callable[[TaskProperties], bool]] = None) -> TaskGraph:
+    """
+    Find the roots and all the tasks they (transitively) depend on, without the task definitions.
+    The dependencies of every task are requested exactly once, also if multiple composite tasks depend on it.
+
+    :param roots: the tasks to start from
+    :param get_dependencies: function that returns the tasks a task directly depends on
+    :param skip: optional function to indicate that a task (and therefore its dependencies) should not be visited
+    :return: the graph of all visited tasks
+    """
+    graph = TaskGraph()
+    seen: Set[TaskProperties] = set()
+    worklist: Deque[TaskProperties] = deque()
+    for props in roots:
+        if props not in seen:
+            seen.add(props)
+            worklist.append(props)
+    while len(worklist) > 0:
+        props = worklist.popleft()
+        if skip is not None and skip(props):
+            continue
+        dependencies = get_dependencies(props)
+        graph.dependencies[props] = dependencies
+        for dependency in dependencies:
+            if dependency not in seen:
+                seen.add(dependency)
+                worklist.append(dependency)
+    return graph
+
+
+def resolve_task_graph(roots: Iterable[TaskProperties],
+                       load: Callable[[TaskProperties], TaskDefinition],
+                       skip: Optional[Callable[[TaskProperties], bool]] = None) -> TaskGraph:
+    """
+    Load the roots and all the tasks they (transitively) depend on.
+    Every task is loaded exactly once, also if multiple composite tasks depend on it.
+
+    :param roots: the tasks to start from
+    :param load: function that loads a task definition
+    :param skip: optional function to indicate that a task (and therefore its dependencies) should not be loaded
+    :return: the graph of all loaded tasks
+    """
+    tasks: Dict[TaskProperties, TaskDefinition] = {}
+
+    def load_sub_tasks(props: TaskProperties) -> List[TaskProperties]:
+        task = load(props)
+        tasks[props] = task
+        return get_sub_tasks(task)
+
+    graph = resolve_dependency_graph(roots, load_sub_tasks, skip)
+    graph.tasks = tasks
+    return graph
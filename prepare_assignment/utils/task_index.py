@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Final, Iterable, List, Optional, Set, Tuple
+
+from prepare_assignment.data.task_definition import (CompositeTaskDefinition, PythonTaskDefinition, TaskDefinition,
+                                                     TaskInputDefinition, TaskOutputDefinition, ValidableTask)
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.paths import get_tasks_path
+from prepare_assignment.utils.task_graph import get_sub_tasks
+
+INDEX_FILE: Final[str] = "index.json"
+# Increase when the format of the index (or of the serialized task definitions) changes
+INDEX_VERSION: Final[int] = 3
+
+logger = logging.getLogger("prepare_assignment")
+
+# (mtime in ns, inode, size) of a file, None if the file doesn't exist
+Stamp = Optional[Tuple[int, int, int]]
+
+
+def _stamp(path: str | os.PathLike) -> Stamp:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+
+def _to_stamp(value: Any) -> Stamp:
+    if isinstance(value, list) and len(value) == 3 and all(isinstance(item, int) for item in value):
+        return value[0], value[1], value[2]
+    return None
+
+
+def _dump_task(task: ValidableTask) -> Optional[str]:
+    """
+    Serialize a parsed task to JSON
+
+    :param task: the parsed task definition and json schema
+    :return: the serialized task, None if the task cannot be serialized (e.g. the task definition contains dates)
+    """
+    definition = asdict(task["task"])
+    definition["path"] = str(task["task"].path)
+    try:
+        return json.dumps({"schema": task["schema"], "composite": task["task"].is_composite, "task": definition})
+    except (TypeError, ValueError):
+        return None
+
+
+def _load_task(data: str) -> ValidableTask:
+    loaded = json.loads(data)
+    definition: Dict[str, Any] = loaded["task"]
+    definition["path"] = Path(definition["path"])
+    definition["inputs"] = [TaskInputDefinition(**inp) for inp in definition["inputs"]]
+    definition["outputs"] = {key: TaskOutputDefinition(**output) for key, output in definition["outputs"].items()}
+    task: TaskDefinition
+    if loaded["composite"]:
+        task = CompositeTaskDefinition(**definition)
+    else:
+        task = PythonTaskDefinition(**definition)
+    return {"schema": loaded["schema"], "task": task}
+
+
+def schema_path(props: TaskProperties) -> Path:
+    """
+    :param props: the task properties
+    :return: the path of the generated json schema of the task
+    """
+    return Path(os.path.join(props.task_path, f"{props.name}.schema.json"))
+
+
+@dataclass
+class IndexEntry:
+    # Stamps of the task definition and the json schema at the moment the entry was created
+    definition: Stamp
+    schema: Stamp
+    # The ValidableTask serialized to JSON, only parsed when it is needed
+    data: str
+    # The tasks the task directly depends on (the tasks a composite task uses)
+    dependencies: List[str]
+
+
+class TaskIndex:
+    """
+    Index of the installed tasks, containing the parsed task definitions and json schemas.
+
+    Entries are only used as long as the stat of the task definition and the json schema didn't change, otherwise
+    the files have to be parsed again. The index is written atomically, so other processes never see a partial index.
+    The index is stored as JSON, a cache that is shared by several users must never be able to execute code.
+
+    Besides the definitions, the index keeps the dependencies of every task and the reverse mapping (the tasks that
+    use a task), so it can be determined which tasks depend on a task without loading any task definition.
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: the file to store the index in
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, IndexEntry] = {}
+        # All installed tasks, None if unknown (e.g. tasks installed by an older version of prepare)
+        self._tasks: Optional[Set[str]] = None
+        # Task to the indexed tasks that directly depend on it
+        self._dependents: Dict[str, Set[str]] = {}
+        self._loaded: Stamp = None
+        self._is_loaded = False
+        self._dirty = False
+
+    def get(self, props: TaskProperties) -> Optional[ValidableTask]:
+        """
+        Get the parsed task definition and json schema of a task
+
+        :param props: the task properties
+        :return: the parsed task, None if the task is not in the index or the files changed
+        """
+        with self._lock:
+            self.__load()
+            entry = self._entries.get(str(props), None)
+        if entry is None:
+            return None
+        if entry.definition != _stamp(props.definition_path) or entry.schema != _stamp(schema_path(props)):
+            return None
+        try:
+            return _load_task(entry.data)
+        except Exception as e:
+            logger.debug(f"Unable to load '{props}' from the task index: {e}")
+            return None
+
+    def put(self, props: TaskProperties, task: ValidableTask) -> None:
+        """
+        Add (or replace) a task, the files of the task should not change afterward
+
+        :param props: the task properties
+        :param task: the parsed task definition and json schema
+        :return: None
+        """
+        data = _dump_task(task)
+        if data is None:
+            logger.debug(f"Unable to add '{props}' to the task index, the task definition cannot be serialized")
+            self.remove(props)
+            return
+        entry = IndexEntry(_stamp(props.definition_path), _stamp(schema_path(props)), data,
+                           [str(sub_task) for sub_task in get_sub_tasks(task["task"])])
+        with self._lock:
+            self.__load()
+            self.__unlink(str(props))
+            self._entries[str(props)] = entry
+            for dependency in entry.dependencies:
+                self._dependents.setdefault(dependency, set()).add(str(props))
+            if self._tasks is not None:
+                self._tasks.add(str(props))
+            self._dirty = True
+
+    def remove(self, props: TaskProperties) -> None:
+        """
+        Remove a task from the index
+
+        :param props: the task properties
+        :return: None
+        """
+        with self._lock:
+            self.__load()
+            self.__unlink(str(props))
+            self._entries.pop(str(props), None)
+            if self._tasks is not None:
+                self._tasks.discard(str(props))
+            self._dirty = True
+
+    def tasks(self) -> Optional[List[TaskProperties]]:
+        """
+        :return: all installed tasks, None if the index doesn't know all installed tasks
+        """
+        with self._lock:
+            self.__load()
+            if self._tasks is None:
+                return None
+            return [TaskProperties.of(task) for task in self._tasks]
+
+    def set_tasks(self, tasks: Iterable[TaskProperties]) -> None:
+        """
+        Set all installed tasks, e.g. after walking the tasks directory
+
+        :param tasks: all installed tasks
+        :return: None
+        """
+        with self._lock:
+            self.__load()
+            self._tasks = {str(task) for task in tasks}
+            self._entries = {key: entry for key, entry in self._entries.items() if key in self._tasks}
+            self.__link_all()
+            self._dirty = True
+
+    def dependencies(self, props: TaskProperties) -> Optional[List[TaskProperties]]:
+        """
+        Get the tasks a task directly depends on, without loading the task definition
+
+        :param props: the task properties
+        :return: the dependencies, None if the task is not in the index or the task definition changed
+        """
+        with self._lock:
+            self.__load()
+            entry = self._entries.get(str(props), None)
+        if entry is None or entry.definition != _stamp(props.definition_path):
+            return None
+        return [TaskProperties.of(dependency) for dependency in entry.dependencies]
+
+    def dependents(self) -> Optional[Dict[TaskProperties, List[TaskProperties]]]:
+        """
+        Get for every task the installed tasks that directly depend on it. Only the stat of the task definitions is
+        checked, no task definition is loaded.
+
+        :return: mapping from task to its dependents, None if the index doesn't know the dependencies of all
+                 installed tasks (e.g. because a task definition changed)
+        """
+        with self._lock:
+            self.__load()
+            if self._tasks is None:
+                return None
+            tasks = list(self._tasks)
+            entries = [self._entries.get(task, None) for task in tasks]
+            dependents = {task: list(users) for task, users in self._dependents.items()}
+        for task, entry in zip(tasks, entries):
+            if entry is None or entry.definition != _stamp(TaskProperties.of(task).definition_path):
+                return None
+        return {TaskProperties.of(task): [TaskProperties.of(user) for user in users]
+                for task, users in dependents.items() if len(users) > 0}
+
+    def save(self) -> None:
+        """
+        Write the index if it changed, errors are ignored as the index is only a cache
+
+        :return: None
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            tasks = self._tasks
+            # Another process changed the index since we loaded it, so we might not know all installed tasks
+            if _stamp(self.path) != self._loaded:
+                tasks = None
+            data = {
+                "version": INDEX_VERSION,
+                "entries": {key: asdict(entry) for key, entry in self._entries.items()},
+                "tasks": None if tasks is None else sorted(tasks),
+                "dependents": {key: sorted(users) for key, users in self._dependents.items()}
+            }
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+                with os.fdopen(fd, "w") as handle:
+                    json.dump(data, handle)
+                os.replace(tmp, self.path)
+                self._loaded = _stamp(self.path)
+                self._tasks = tasks
+                self._dirty = False
+            except OSError as e:
+                logger.debug(f"Unable to write the task index: {e}")
+
+    def __load(self) -> None:
+        if self._is_loaded:
+            return
+        self._is_loaded = True
+        self._loaded = _stamp(self.path)
+        if self._loaded is None:
+            return
+        try:
+            with open(self.path, "r") as handle:
+                data = json.load(handle)
+            if isinstance(data, dict) and data.get("version", None) == INDEX_VERSION:
+                entries = {key: IndexEntry(_to_stamp(entry["definition"]), _to_stamp(entry["schema"]),
+                                           str(entry["data"]), [str(task) for task in entry["dependencies"]])
+                           for key, entry in data["entries"].items()}
+                tasks = data["tasks"]
+                self._entries = entries
+                self._tasks = None if tasks is None else {str(task) for task in tasks}
+                self._dependents = {key: {str(user) for user in users} for key, users in data["dependents"].items()}
+        except Exception as e:
+            logger.debug(f"Unable to read the task index: {e}")
+
+    def __unlink(self, task: str) -> None:
+        entry = self._entries.get(task, None)
+        if entry is None:
+            return
+        for dependency in entry.dependencies:
+            users = self._dependents.get(dependency, None)
+            if users is not None:
+                users.discard(task)
+                if len(users) == 0:
+                    del self._dependents[dependency]
+
+    def __link_all(self) -> None:
+        self._dependents = {}
+        for task, entry in self._entries.items():
+            for dependency in entry.dependencies:
+                self._dependents.setdefault(dependency, set()).add(task)
+
+
+__task_index: Optional[TaskIndex] = None
+
+
+def get_task_index() -> TaskIndex:
+    """
+    Get the index of the tasks in the tasks directory
+    :return: the task index
+    """
+    global __task_index
+    if __task_index:
+        return __task_index
+    __task_index = TaskIndex(Path(os.path.join(get_tasks_path(), INDEX_FILE)))
+    return __task_index
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import secrets
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Final, Optional, Tuple
+
+logger = logging.getLogger("prepare_assignment")
+
+SERVER_PATH: Final[str] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_worker_server.py")
+# Number of seconds a worker keeps running without requests
+WORKER_IDLE_TIMEOUT: Final[float] = 300
+# Number of seconds to wait for a new worker to accept connections
+WORKER_START_TIMEOUT: Final[float] = 10
+# Size of the chunks the output of a task is read in
+OUTPUT_CHUNK_SIZE: Final[int] = 64 * 1024
+# Maximum length of the line with the token and process id the worker sends when the task is started
+MAX_STARTED_LENGTH: Final[int] = 256
+
+_start_locks: Dict[str, threading.Lock] = {}
+_start_locks_guard = threading.Lock()
+
+
+def workers_supported() -> bool:
+    """
+    :return: True if tasks can be run by a worker on this platform (workers need fork and unix sockets)
+    """
+    return sys.platform != "win32" and hasattr(os, "fork") and hasattr(socket, "AF_UNIX")
+
+
+def get_workers_path() -> str:
+    """
+    Get the directory of the sockets of the workers. Unix socket paths are limited to about 100 characters, so a
+    short directory in the runtime directory of the user (or the temp directory) is used instead of the cache
+    directory.
+
+    :return: the path of the directory
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR", None)
+    if runtime and os.path.isabs(runtime) and len(runtime) < 50:
+        return os.path.join(runtime, "prepare-assignment")
+    return os.path.join(tempfile.gettempdir(), f"prepare-assignment-{os.getuid()}")
+
+
+def __is_private_directory(path: str) -> bool:
+    """
+    Create the directory of the sockets if necessary, and check that only the current user can access it. The
+    directory has a predictable name, so another user could have created it first to receive the environment
+    variables (and secrets) of tasks.
+
+    :param path: the directory
+    :return: True if the directory can be used
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+    except OSError as e:
+        logger.debug(f"Unable to create the directory of the task workers '{path}': {e}")
+        return False
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077 != 0:
+        logger.warning(f"Not using task workers, '{path}' is not a directory that only the current user can access")
+        return False
+    return True
+
+
+def worker_socket_path(executable: str, main_path: str) -> str:
+    """
+    Get the socket of the worker for a task. The path changes when the virtual environment or the main file of
+    the task changes, so a worker never runs a task with modules that were preloaded from an older version.
+
+    :param executable: the python executable of the virtual environment of the task
+    :param main_path: the main file of the task
+    :return: the path of the socket
+    """
+    stamps = []
+    for path in (executable, main_path, os.path.join(os.path.dirname(os.path.dirname(executable)), "pyvenv.cfg")):
+        try:
+            stat = os.stat(path)
+            stamps.append(f"{path}:{stat.st_mtime_ns}:{stat.st_ino}")
+        except OSError:
+            stamps.append(path)
+    digest = hashlib.sha256("\n".join(stamps).encode("utf-8")).hexdigest()[:24]
+    return os.path.join(get_workers_path(), f"{digest}.sock")
+
+
+def __connect(path: str) -> Optional[socket.socket]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def __start(executable: str, main_path: str, path: str) -> Optional[socket.socket]:
+    with _start_locks_guard:
+        lock = _start_locks.setdefault(path, threading.Lock())
+    # Make sure a worker is only started once, also if the task is used by jobs that run concurrently
+    with lock:
+        sock = __connect(path)
+        if sock is not None:
+            return sock
+        logger.debug(f"Starting worker for '{main_path}'")
+        process = subprocess.Popen(
+            [executable, SERVER_PATH, path, main_path, str(WORKER_IDLE_TIMEOUT)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            sock = __connect(path)
+            if sock is not None:
+                return sock
+            if process.poll() is not None and process.returncode != 0:
+                break
+            time.sleep(0.005)
+        logger.debug(f"Unable to start worker for '{main_path}'")
+        return None
+
+
+def __read_started(sock: socket.socket) -> Tuple[bytes, bytes]:
+    """
+    Read the line the worker sends when the task is started
+
+    :return: the line without the newline (empty if the worker didn't send it) and the output that was read after it
+    """
+    data = b""
+    while b"\n" not in data and len(data) < MAX_STARTED_LENGTH:
+        chunk = sock.recv(MAX_STARTED_LENGTH)
+        if not chunk:
+            break
+        data += chunk
+    started, newline, output = data.partition(b"\n")
+    return (started, output) if newline else (b"", b"")
+
+
+def run_in_worker(executable: str, main_path: str, env: Dict[str, str], on_output: Callable[[bytes], None],
+                  cwd: Optional[str] = None, on_start: Optional[Callable[[int], None]] = None) -> Optional[int]:
+    """
+    Run the main file of a python task in a worker, the worker is started if it isn't running yet.
+
+    :param executable: the python executable of the virtual environment of the task
+    :param main_path: the main file of the task
+    :param env: the environment variables of the task
+    :param on_output: function that is called with every chunk of (raw) output of the task
+    :param cwd: the directory to run the task in, defaults to the working directory of this process
+    :param on_start: function that is called with the process id of the task once it is started, the task runs in its
+                     own session so it can be killed with the processes it starts
+    :return: the exit code of the task, None if the task could not be started by a worker
+    :raises ConnectionError: if the connection to the worker is lost while the task is running
+    """
+    path = worker_socket_path(executable, main_path)
+    if not __is_private_directory(os.path.dirname(path)):
+        return None
+    sock = __connect(path) or __start(executable, main_path, path)
+    if sock is None:
+        return None
+    token = secrets.token_hex(16)
+    request = {"main": main_path, "cwd": os.path.abspath(cwd or os.getcwd()), "env": env, "token": token}
+    with sock:
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            started, output = __read_started(sock)
+        except OSError:
+            started, output = b"", b""
+        token_sent, _, pid = started.decode("utf-8", errors="replace").partition(" ")
+        if token_sent != token:
+            # The worker stopped before it could start the task (e.g. because it was idle for too long)
+            return None
+        if on_start is not None and pid.isdigit():
+            on_start(int(pid))
+        # The trailer starts with a newline that isn't part of the output, the output is passed on without the trailer
+        trailer = ("\n" + token + " ").encode("utf-8")
+        while True:
+            index = output.find(trailer)
+            if index >= 0:
+                end = output.find(b"\n", index + len(trailer))
+                if end >= 0:
+                    if index > 0:
+                        on_output(output[:index])
+                    return int(output[index + len(trailer):end])
+                cut = index
+            else:
+                # The trailer could start in the last bytes, hold them back until the next chunk is read
+                cut = max(len(output) - len(trailer) + 1, 0)
+            if cut > 0:
+                on_output(output[:cut])
+                output = output[cut:]
+            chunk = sock.recv(OUTPUT_CHUNK_SIZE)
+            if not chunk:
+                break
+            output += chunk
+    raise ConnectionError(f"Lost connection to the worker of '{main_path}'")
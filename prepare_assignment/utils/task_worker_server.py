@@ -0,0 +1,180 @@
+"""
+Fork server for Python tasks, started with the python executable of the virtual environment of a task.
+
+NOTE: this file is executed by the interpreter of the task, so it can only use the standard library and should not
+import anything from prepare_assignment.
+
+The server imports the modules the task uses once and then waits for requests on a unix socket. Every request is
+handled in a forked child that runs the main file of the task with runpy. The child writes the token of the request
+and its process id, the output of the task and a trailer with the token and the exit code to the connection.
+
+Usage: python task_worker_server.py <socket path> <main file> <idle timeout in seconds>
+"""
+import ast
+import errno
+import importlib
+import io
+import json
+import os
+import runpy
+import signal
+import socket
+import sys
+import traceback
+
+PRELOAD = ["prepare_toolbox", "prepare_toolbox.core", "prepare_toolbox.command"]
+
+
+def _imported_modules(main):
+    """
+    Get the top-level modules imported by the main file, except the modules that are part of the task itself
+    """
+    try:
+        with open(main, "r", encoding="utf-8") as handle:
+            tree = ast.parse(handle.read(), main)
+    except (OSError, SyntaxError, ValueError):
+        return []
+    directory = os.path.dirname(main)
+    modules = []
+    for node in tree.body:
+        names = []
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        for name in names:
+            top = name.split(".")[0]
+            if os.path.exists(os.path.join(directory, top)) or os.path.exists(os.path.join(directory, top + ".py")):
+                continue
+            modules.append(name)
+    return modules
+
+
+def _preload(main):
+    for module in PRELOAD + _imported_modules(main):
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+
+
+def _read_request(conn):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            return None
+        data += chunk
+    return json.loads(data.decode("utf-8"))
+
+
+def _run(conn, request):
+    """
+    Run the task in the (forked) child, never returns
+    """
+    code = 1
+    try:
+        # The task gets its own session, so the client can kill it together with the processes it starts
+        os.setsid()
+        # Let the client know the task is started, so it doesn't start it again if the connection breaks
+        os.write(conn.fileno(), (request["token"] + " " + str(os.getpid()) + "\n").encode("utf-8"))
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), encoding="utf-8", errors="replace")
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), encoding="utf-8", errors="replace",
+                                      line_buffering=True)
+        os.environ.clear()
+        os.environ.update(request["env"])
+        os.chdir(request["cwd"])
+        main = request["main"]
+        sys.argv = [main]
+        sys.path[0] = os.path.dirname(main)
+        try:
+            runpy.run_path(main, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except BaseException:
+        pass
+    finally:
+        try:
+            # The newline makes sure the trailer is on its own line, the client removes it again
+            os.write(conn.fileno(), ("\n" + request["token"] + " " + str(code) + "\n").encode("utf-8"))
+        finally:
+            os._exit(0)
+
+
+def _bind(path):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        # Either another server is running, or the socket of a server that stopped was left behind
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            return None
+        except OSError:
+            os.unlink(path)
+            server.bind(path)
+        finally:
+            probe.close()
+    server.listen(16)
+    return server
+
+
+def main(path, main_file, idle):
+    os.umask(0o077)
+    server = _bind(path)
+    if server is None:
+        return
+    _preload(main_file)
+    # Children are never waited for, let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    server.settimeout(idle)
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            try:
+                conn.settimeout(None)
+                request = _read_request(conn)
+                if request is None:
+                    continue
+                sys.stdout.flush()
+                sys.stderr.flush()
+                if os.fork() == 0:
+                    server.close()
+                    _run(conn, request)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], float(sys.argv[3]))
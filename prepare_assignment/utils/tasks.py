@@ -1,13 +1,22 @@
+import json
 import os
-from typing import List
+from typing import Dict, List
 
 from prepare_assignment.data.task_definition import TaskDefinition
 from prepare_assignment.data.task_properties import TaskProperties
 from prepare_assignment.utils.paths import get_tasks_path
+from prepare_assignment.utils.task_graph import get_sub_tasks, resolve_dependency_graph
+from prepare_assignment.utils.task_index import get_task_index, schema_path
 from prepare_assignment.utils.yml_loader import YAML_LOADER
 
 
 def get_all_tasks() -> List[TaskProperties]:
+    index = get_task_index()
+    indexed = index.tasks()
+    if indexed is not None:
+        # Tasks might have been removed by hand
+        return [props for props in indexed if os.path.isdir(props.task_path)]
+
     tasks_path = get_tasks_path()
     tasks: List[TaskProperties] = []
     if not os.path.isdir(tasks_path):
@@ -15,16 +24,59 @@ def get_all_tasks() -> List[TaskProperties]:
 
     for org in os.listdir(tasks_path):
         org_path = os.path.join(tasks_path, org)
+        # The tasks directory also contains the task index
+        if not os.path.isdir(org_path):
+            continue
         task_dirs = os.listdir(org_path)
         for task in task_dirs:
             version_path = os.path.join(org_path, task)
             versions = os.listdir(version_path)
             for version in versions:
                 tasks.append(TaskProperties.of(f"{org}/{task}@{version}"))
+    index.set_tasks(tasks)
+    index.save()
     return tasks
 
 
 def load_task(props: TaskProperties) -> TaskDefinition:
+    index = get_task_index()
+    indexed = index.get(props)
+    if indexed is not None:
+        return indexed["task"]
     yaml = YAML_LOADER.load(props.definition_path)
-    task = TaskDefinition.of(yaml, props.definition_path)
+    task = TaskDefinition.of(yaml, props.task_path)
+    # Tasks that are not prepared completely don't have a schema yet
+    if os.path.isfile(schema_path(props)):
+        with open(schema_path(props), "r") as handle:
+            index.put(props, {"schema": json.load(handle), "task": task})
     return task
+
+
+def load_dependencies(props: TaskProperties) -> List[TaskProperties]:
+    """
+    Get the tasks a task directly depends on, the task definition is only loaded if the task index doesn't know them
+
+    :param props: the task properties
+    :return: the dependencies of the task
+    """
+    dependencies = get_task_index().dependencies(props)
+    if dependencies is not None:
+        return dependencies
+    return get_sub_tasks(load_task(props))
+
+
+def get_dependents() -> Dict[TaskProperties, List[TaskProperties]]:
+    """
+    Get for every installed task the installed tasks that directly depend on it. The task index answers this without
+    loading task definitions; only if the index is incomplete the missing task definitions are loaded (and indexed).
+
+    :return: mapping from task to its dependents, tasks without dependents are left out
+    """
+    index = get_task_index()
+    dependents = index.dependents()
+    if dependents is not None:
+        return dependents
+    installed = set(get_all_tasks())
+    graph = resolve_dependency_graph(installed, load_dependencies, skip=lambda props: props not in installed)
+    index.save()
+    return {props: users for props, users in graph.dependents().items() if len(users) > 0}
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+# Records spans of the phases of a run (resolving versions, cloning, creating virtualenvs, running steps, etc.) in the
+# Chrome trace event format, which can be opened in Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+# Tracing is disabled by default, a disabled span only yields its attributes. Listeners (e.g. the metrics) are called
+# with every finished span, whether the spans are recorded or not.
+
+SpanListener = Callable[[str, str, float, Dict[str, Any]], None]
+
+_enabled = False
+_listeners: List[SpanListener] = []
+_events: List[Dict[str, Any]] = []
+# The (process, thread) of which the name has been recorded
+_named: Set[Tuple[int, int]] = set()
+_lock = threading.Lock()
+
+
+def enable_tracing() -> None:
+    """
+    Start recording spans
+
+    :return: None
+    """
+    global _enabled
+    _enabled = True
+
+
+def is_tracing() -> bool:
+    """
+    :return: True if spans are recorded
+    """
+    return _enabled
+
+
+def add_span_listener(listener: SpanListener) -> None:
+    """
+    Add a function that is called with the name, category, duration (in seconds) and attributes of every finished span.
+    Listeners are called from the thread that finished the span.
+
+    :param listener: the function
+    :return: None
+    """
+    with _lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def has_span_listeners() -> bool:
+    """
+    :return: True if there are listeners for the spans
+    """
+    return len(_listeners) > 0
+
+
+def __notify(name: str, category: str, duration: float, attributes: Dict[str, Any]) -> None:
+    for listener in list(_listeners):
+        listener(name, category, duration, attributes)
+
+
+def __now() -> float:
+    # The monotonic clock is shared by all processes, so the spans of worker processes line up
+    return time.perf_counter_ns() / 1000
+
+
+def __record(name: str, category: str, start: float, end: float, attributes: Dict[str, Any]) -> None:
+    pid = os.getpid()
+    thread = threading.current_thread()
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start,
+        "dur": end - start,
+        "pid": pid,
+        "tid": thread.ident,
+        "args": {key: value if isinstance(value, (bool, int, float, str)) or value is None else str(value)
+                 for key, value in attributes.items()}
+    }
+    with _lock:
+        if (pid, thread.ident or 0) not in _named:
+            _named.add((pid, thread.ident or 0))
+            _events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread.ident,
+                            "args": {"name": thread.name}})
+        _events.append(event)
+
+
+@contextmanager
+def span(name: str, category: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Record the duration of a phase, e.g. 'with span("clone", "prepare", task=str(props)) as attributes: ...'
+
+    :param name: the name of the phase
+    :param category: the category of the phase, e.g. 'prepare' or 'run'
+    :param attributes: attributes of the span, attributes that are only known at the end of the phase (like an exit
+                       code or a cache hit) can be added to the yielded dictionary
+    :return: the attributes of the span
+    """
+    if not _enabled and len(_listeners) == 0:
+        yield attributes
+        return
+    start = __now()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        end = __now()
+        if _enabled:
+            __record(name, category, start, end, attributes)
+        __notify(name, category, (end - start) / 1_000_000, attributes)
+
+
+def take_events() -> List[Dict[str, Any]]:
+    """
+    Get the recorded events and clear them, e.g. to send them from a worker process to the main process
+
+    :return: the events
+    """
+    global _events
+    with _lock:
+        events, _events = _events, []
+        _named.clear()
+    return events
+
+
+def add_events(events: List[Dict[str, Any]]) -> None:
+    """
+    Add the events that have been recorded by another process, the listeners are called with their spans
+
+    :param events: the events
+    :return: None
+    """
+    if _enabled:
+        with _lock:
+            _events.extend(events)
+    for event in events:
+        if event["ph"] == "X":
+            __notify(event["name"], event["cat"], event["dur"] / 1_000_000, event["args"])
+
+
+def write_trace(path: str | os.PathLike) -> None:
+    """
+    Write the recorded events to a file in the Chrome trace event format
+
+    :param path: the file
+    :return: None
+    """
+    with _lock:
+        events = list(_events)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as handle:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, handle)
@@ -1,4 +1,21 @@
+from __future__ import annotations
+
+import json
 import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Final, Optional
+
+from prepare_assignment.utils.paths import get_venvs_path
+
+# File inside the task directory that references the virtual environment (from the pool) the task uses
+VENV_REFERENCE: Final[str] = "venv.json"
+# Marker file that indicates that a virtual environment in the pool is completely installed
+VENV_COMPLETE: Final[str] = ".complete"
+# Prefix of the template virtual environments (one per interpreter) in the pool, other virtual environments are cloned
+# from the template
+VENV_TEMPLATE_PREFIX: Final[str] = "template-"
 
 
 def is_virtualenv_active() -> bool:
@@ -13,3 +30,111 @@ def get_virtualenv_name() -> str:
     if virtualenv_path:
         return os.path.basename(virtualenv_path)  # Get the name from the virtualenv path
     return "None (not active)"
+
+
+def get_python_executable(venv_path: str | os.PathLike) -> str:
+    """
+    Get the path to the python executable of a virtual environment
+
+    :param venv_path: the path to the virtual environment
+    :return: the path to the python executable
+    """
+    if sys.platform == "win32":
+        return os.path.join(venv_path, "Scripts", "python.exe")
+    return os.path.join(venv_path, "bin", "python")
+
+
+def get_venv_key(task_path: str | os.PathLike) -> Optional[str]:
+    """
+    Get the key of the virtual environment (in the pool) that a task uses
+
+    :param task_path: the path of the (installed) task
+    :return: the key, None if the task doesn't reference a virtual environment from the pool
+    """
+    try:
+        with open(os.path.join(task_path, VENV_REFERENCE), "r") as handle:
+            key = json.load(handle).get("key", None)
+    except (OSError, ValueError, AttributeError):
+        return None
+    return key if isinstance(key, str) else None
+
+
+def set_venv_key(task_path: str | os.PathLike, key: str) -> None:
+    """
+    Let a task reference a virtual environment from the pool
+
+    :param task_path: the path of the task
+    :param key: the key of the virtual environment
+    :return: None
+    """
+    with open(os.path.join(task_path, VENV_REFERENCE), "w") as handle:
+        json.dump({"key": key}, handle)
+
+
+def get_task_venv(task_path: str | os.PathLike) -> str:
+    """
+    Get the path to the virtual environment of a task.
+    Tasks installed before the pool existed have their own virtual environment in 'venv'.
+
+    :param task_path: the path of the (installed) task
+    :return: the path to the virtual environment
+    """
+    key = get_venv_key(task_path)
+    if key is None:
+        return os.path.join(task_path, "venv")
+    return os.path.join(get_venvs_path(), key)
+
+
+def relocate_venv(venv_path: str | os.PathLike, old_path: str | os.PathLike) -> None:
+    """
+    Fix the references to the old location of a virtual environment that has been copied or moved.
+    Python finds its prefix through 'pyvenv.cfg', so only the scripts and the configuration contain the path.
+
+    :param venv_path: the new location of the virtual environment
+    :param old_path: the location the virtual environment was created at
+    :return: None
+    """
+    old = os.fsencode(old_path)
+    new = os.fsencode(venv_path)
+    scripts_path = os.path.join(venv_path, "Scripts" if sys.platform == "win32" else "bin")
+    candidates = [os.path.join(venv_path, "pyvenv.cfg")]
+    if os.path.isdir(scripts_path):
+        candidates.extend(os.path.join(scripts_path, name) for name in os.listdir(scripts_path))
+    for file in candidates:
+        if os.path.islink(file) or not os.path.isfile(file):
+            continue
+        with open(file, "rb") as handle:
+            data = handle.read()
+        if old not in data:
+            continue
+        mode = os.stat(file).st_mode
+        # The file might be a hardlink, so replace it instead of changing the shared contents
+        os.unlink(file)
+        with open(file, "wb") as handle:
+            handle.write(data.replace(old, new))
+        os.chmod(file, mode)
+
+
+def __link_or_copy(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except OSError:
+        # e.g. the template is on a different file system
+        shutil.copy2(source, destination)
+
+
+def clone_venv(template_path: str | os.PathLike, venv_path: str | os.PathLike) -> None:
+    """
+    Create a virtual environment by cloning a template virtual environment, files are hardlinked where possible.
+    NOTE: only supported on POSIX platforms, on Windows the scripts are executables that contain the path.
+
+    :param template_path: the virtual environment to clone
+    :param venv_path: the path of the new virtual environment
+    :return: None
+    :raises OSError: if the template cannot be cloned
+    """
+    if sys.platform == "win32":
+        raise OSError("Cloning a virtual environment is not supported on Windows")
+    shutil.copytree(template_path, venv_path, symlinks=True, copy_function=__link_or_copy,
+                    ignore=shutil.ignore_patterns(VENV_COMPLETE))
+    relocate_venv(venv_path, template_path)
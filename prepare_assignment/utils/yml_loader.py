@@ -1,5 +1,38 @@
-from ruamel.yaml import YAML
+from __future__ import annotations
 
-YAML_LOADER = YAML(typ='safe')
-YAML_LOADER.brace_single_entry_mapping_in_flow_sequence = False
-YAML_LOADER.default_flow_style = True
\ No newline at end of file
+import threading
+from typing import Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ruamel.yaml import YAML
+
+
+class ThreadSafeYAML:
+    """
+    A ruamel YAML instance keeps parser state, so it cannot be shared between threads.
+    This creates a separate (identically configured) instance for every thread.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+
+    @property
+    def yaml(self) -> YAML:
+        yaml = getattr(self._local, "yaml", None)
+        if yaml is None:
+            # Importing ruamel is relatively slow, so only do it when we actually need to parse yaml
+            from ruamel.yaml import YAML
+            yaml = YAML(typ='safe')
+            yaml.brace_single_entry_mapping_in_flow_sequence = False
+            yaml.default_flow_style = True
+            self._local.yaml = yaml
+        return yaml
+
+    def load(self, stream: Any) -> Any:
+        return self.yaml.load(stream)
+
+    def dump(self, data: Any, stream: Any) -> None:
+        self.yaml.dump(data, stream)
+
+
+YAML_LOADER = ThreadSafeYAML()
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from prepare_assignment.core.main import prepare_async
+from prepare_assignment.data.errors import TaskExecutionError
+from prepare_assignment.data.task_event import TaskEvent
+
+PREPARE = """name: test
+jobs:
+  first:
+    - name: write
+      run: echo $NAME > out.txt && echo ':PA:warning:PA:written'
+  second:
+    needs: first
+    steps:
+      - name: read
+        run: echo ":PA:info:PA:$(cat out.txt)"
+"""
+
+
+async def collect(file: str, **kwargs) -> List[TaskEvent]:
+    return [event async for event in prepare_async(file, **kwargs)]
+
+
+def test_prepare_async(tmp_path: Path) -> None:
+    (tmp_path / "prepare.yml").write_text(PREPARE)
+    cwd = os.getcwd()
+    events = asyncio.run(collect(str(tmp_path / "prepare.yml"), env_vars={"NAME": "async"}))
+    assert events == [TaskEvent("first", "write", "warning", ["written"]),
+                      TaskEvent("second", "read", "info", ["async"])]
+    assert (tmp_path / "out.txt").read_text() == "async\n"
+    assert os.getcwd() == cwd
+
+
+def test_prepare_async_failed(tmp_path: Path) -> None:
+    (tmp_path / "prepare.yml").write_text("name: test\njobs:\n  fails:\n    - name: fail\n      run: exit 3\n")
+    with pytest.raises(TaskExecutionError) as pytest_wrapped_e:
+        asyncio.run(collect(str(tmp_path / "prepare.yml")))
+    assert "fails" in str(pytest_wrapped_e.value)
+
+
+def test_prepare_async_cancelled(tmp_path: Path) -> None:
+    (tmp_path / "prepare.yml").write_text(
+        "name: test\njobs:\n  slow:\n    - name: slow\n      run: echo ':PA:info:PA:started' && sleep 30\n")
+
+    async def first_event() -> TaskEvent:
+        events = prepare_async(str(tmp_path / "prepare.yml"))
+        event = await events.__anext__()
+        await events.aclose()
+        return event
+
+    start = time.monotonic()
+    assert asyncio.run(first_event()).params == ["started"]
+    assert time.monotonic() - start < 10
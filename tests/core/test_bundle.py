@@ -0,0 +1,212 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+import git
+import pytest
+from pytest_mock import MockerFixture
+
+from prepare_assignment.core import bundle
+from prepare_assignment.core.bundle import export_tasks, import_tasks, MANIFEST_FILE
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.file_lock import cache_lock
+from prepare_assignment.utils.task_index import TaskIndex, schema_path
+from prepare_assignment.utils.virtual_env import get_venv_key, set_venv_key, VENV_COMPLETE
+
+
+def __use_cache(mocker: MockerFixture, cache: Path) -> None:
+    mocker.patch("prepare_assignment.core.preparer.cache_path", str(cache))
+    mocker.patch("prepare_assignment.core.preparer.venvs_path", str(cache / "venvs"))
+    mocker.patch("prepare_assignment.core.preparer.mirrors_path", str(cache / "mirrors"))
+    mocker.patch("prepare_assignment.core.preparer.task_index", TaskIndex(cache / "tasks" / "index.json"))
+    mocker.patch("prepare_assignment.data.task_properties.tasks_path", str(cache / "tasks"))
+
+
+def __venv(cache: Path, key: str) -> Path:
+    venv_path = cache / "venvs" / key
+    (venv_path / "bin").mkdir(parents=True)
+    (venv_path / "pyvenv.cfg").write_text("home = /usr/bin\n")
+    (venv_path / "bin" / "activate").write_text(f"VIRTUAL_ENV='{venv_path}'\n")
+    # Virtualenvs link to the interpreter they use
+    (venv_path / "bin" / "python").symlink_to("/usr/bin/python3")
+    (venv_path / "bin" / "python3").symlink_to("python")
+    (venv_path / "lib.py").write_text("# the same in every virtualenv\n" * 100)
+    (venv_path / VENV_COMPLETE).touch()
+    return venv_path
+
+
+def __install(cache: Path) -> TaskProperties:
+    props = TaskProperties.of("task")
+    mirror_path = cache / "mirrors" / props.organization / "task.git"
+    props.repo_path.mkdir(parents=True)
+    with git.Repo.init(props.repo_path) as repo:
+        props.definition_path.write_text("id: task\nname: task\ndescription: task\n"
+                                         "runs:\n  using: python\n  main: main.py\n")
+        (props.repo_path / "main.py").write_text("print('task')\n")
+        repo.index.add(["task.yml", "main.py"])
+        repo.index.commit("Initial commit")
+        repo.git.clone("--mirror", str(props.repo_path), str(mirror_path))
+        repo.git.remote("add", "origin", str(mirror_path))
+    schema_path(props).write_text('{"type": "object"}')
+    __venv(cache, "template-cpython")
+    __venv(cache, "key")
+    set_venv_key(props.task_path, "key")
+    return props
+
+
+def test_export_import(mocker: MockerFixture, tmp_path: Path) -> None:
+    source = tmp_path / "source"
+    __use_cache(mocker, source)
+    props = __install(source)
+    mocker.patch("prepare_assignment.core.bundle.get_all_tasks", return_value=[props])
+    archive = tmp_path / "tasks.tar.gz"
+    assert export_tasks(archive) == [props]
+
+    with tarfile.open(archive, "r:gz") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST_FILE))  # type: ignore
+        links = [member.name for member in tar.getmembers() if member.islnk()]
+    with git.Repo(props.repo_path) as repo:
+        assert manifest["tasks"] == [{"task": str(props), "commit": repo.head.commit.hexsha, "venv": "key"}]
+    assert manifest["venvs"] == ["key", "template-cpython"]
+    # Files with the same contents are only stored once
+    assert "venvs/template-cpython/lib.py" in links
+
+    target = tmp_path / "target"
+    __use_cache(mocker, target)
+    props = TaskProperties.of("task")
+    assert import_tasks(archive) == [props]
+    assert os.path.isfile(props.definition_path)
+    assert get_venv_key(props.task_path) == "key"
+    venv_path = target / "venvs" / "key"
+    assert str(venv_path) in (venv_path / "bin" / "activate").read_text()
+    assert os.path.isfile(venv_path / VENV_COMPLETE)
+    with git.Repo(props.repo_path) as repo:
+        assert repo.remotes.origin.url == str(target / "mirrors" / props.organization / "task.git")
+    assert os.listdir(target / "staging") == []
+    # Tasks that are already installed are kept
+    assert import_tasks(archive) == []
+
+
+def test_export_waits_for_lock(mocker: MockerFixture, tmp_path: Path) -> None:
+    cache = tmp_path / "cache"
+    __use_cache(mocker, cache)
+    props = __install(cache)
+    mocker.patch("prepare_assignment.core.bundle.get_all_tasks", return_value=[props])
+    archive = tmp_path / "tasks.tar.gz"
+    results = []
+    with cache_lock(cache, f"task-{props}"):
+        thread = threading.Thread(target=lambda: results.append(export_tasks(archive)))
+        thread.start()
+        thread.join(0.2)
+        # The task is being updated, or removed, by another process
+        assert thread.is_alive()
+        shutil.rmtree(props.task_path)
+    thread.join()
+    assert results == [[]]
+    with tarfile.open(archive, "r:gz") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST_FILE))  # type: ignore
+    assert manifest["tasks"] == [] and manifest["mirrors"] == []
+    assert manifest["venvs"] == ["template-cpython"]
+
+
+def test_import_other_interpreter(mocker: MockerFixture, tmp_path: Path) -> None:
+    __use_cache(mocker, tmp_path / "cache")
+    archive = tmp_path / "tasks.tar.gz"
+    manifest = {"version": 1, "interpreter": {"implementation": "cpython", "version": "2.7.18", "platform": "linux",
+                                              "executable": "/usr/bin/python2"},
+                "venvs-path": "", "mirrors-path": "", "tasks": [], "venvs": [], "mirrors": []}
+    data = json.dumps(manifest).encode("utf-8")
+    with tarfile.open(archive, "w:gz") as tar:
+        info = tarfile.TarInfo(MANIFEST_FILE)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    with pytest.raises(ValueError, match="2.7.18"):
+        import_tasks(archive)
+
+
+def __archive(path: Path, members: List[tarfile.TarInfo], executable: str = sys.executable, **entries: Any) -> None:
+    interpreter = getattr(bundle, "__interpreter")()
+    interpreter["executable"] = executable
+    manifest = {"version": 1, "interpreter": interpreter, "venvs-path": "", "mirrors-path": "", "tasks": [],
+                "venvs": [], "mirrors": []}
+    manifest.update(entries)
+    data = json.dumps(manifest).encode("utf-8")
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo(MANIFEST_FILE)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+        for member in members:
+            tar.addfile(member, io.BytesIO(b"x" * member.size))
+
+
+def __member(name: str, kind: bytes = tarfile.REGTYPE, linkname: str = "", size: int = 0) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.linkname = linkname
+    info.size = size
+    return info
+
+
+def test_import_other_executable(mocker: MockerFixture, tmp_path: Path) -> None:
+    __use_cache(mocker, tmp_path / "cache")
+    archive = tmp_path / "tasks.tar.gz"
+    __archive(archive, [], executable=str(tmp_path / "python"))
+    with pytest.raises(ValueError, match="not available"):
+        import_tasks(archive)
+    # The interpreter is installed at the same location on this machine
+    (tmp_path / "python").touch()
+    assert import_tasks(archive) == []
+
+
+@pytest.mark.parametrize("member", [
+    __member("venvs/key/bin/python", tarfile.SYMTYPE, "../../../../outside"),
+    __member("venvs/key/bin/python", tarfile.SYMTYPE, "/etc/passwd"),
+    __member("tasks/org/task/v1/link", tarfile.SYMTYPE, "/usr/bin/python3"),
+    __member("tasks/org/task/v1/link", tarfile.LNKTYPE, "../../../../outside"),
+    __member("tasks/org/task/v1/link", tarfile.LNKTYPE, "tasks/org/task/v1/missing"),
+    __member("tasks/org/task/v1/device", tarfile.CHRTYPE),
+])
+def test_import_invalid_link(mocker: MockerFixture, tmp_path: Path, member: tarfile.TarInfo) -> None:
+    __use_cache(mocker, tmp_path / "cache")
+    archive = tmp_path / "tasks.tar.gz"
+    cfg = __member("venvs/key/pyvenv.cfg", size=1)
+    __archive(archive, [cfg, member])
+    with pytest.raises(ValueError, match="Archive contains"):
+        import_tasks(archive)
+    assert not os.path.exists(tmp_path / "outside")
+
+
+def test_import_through_link(mocker: MockerFixture, tmp_path: Path) -> None:
+    __use_cache(mocker, tmp_path / "cache")
+    archive = tmp_path / "tasks.tar.gz"
+    __archive(archive, [__member("tasks/org", tarfile.SYMTYPE, "other"),
+                        __member("tasks/org/task/v1/task.yml", size=1)])
+    with pytest.raises(ValueError, match="through a symbolic link"):
+        import_tasks(archive)
+
+
+@pytest.mark.parametrize("entries", [
+    {"venvs": [".."]},
+    {"venvs": ["missing"]},
+    {"mirrors": ["../evil.git"]},
+    {"mirrors": ["org/.."]},
+    {"tasks": [{"task": "../evil@v1", "commit": "", "venv": None}]},
+    {"tasks": [{"task": "org/task@..", "commit": "", "venv": None}]},
+])
+def test_import_invalid_manifest(mocker: MockerFixture, tmp_path: Path, entries: Dict[str, Any]) -> None:
+    cache = tmp_path / "cache"
+    __use_cache(mocker, cache)
+    archive = tmp_path / "tasks.tar.gz"
+    # The directories the manifest refers to are not in the archive, or would be moved outside the cache
+    __archive(archive, [__member("venvs/other", tarfile.DIRTYPE), __member("venvs/other/file", size=1)], **entries)
+    (cache / "victim").mkdir(parents=True)
+    with pytest.raises(ValueError, match="invalid (virtual environment|mirror|task)"):
+        import_tasks(archive)
+    assert os.listdir(cache / "victim") == []
+    assert not os.path.exists(cache / "venvs") and not os.path.exists(cache / "mirrors")
@@ -18,7 +18,7 @@ task_definition = PythonTaskDefinition(outputs={'test': output},
                                        name="test",
                                        path="path",
                                        main="main.py")
-task = UsesTask(name="test", id="id", with_={}, uses="test", if_=None)
+task = UsesTask(name="test", id="id", with_={}, uses="test", if_=None, reads=[], writes=[])
 env = JobEnvironment(environment={},
                      outputs={'id': {}},
                      inputs={},
@@ -0,0 +1,118 @@
+from typing import Any, Dict, List, Set
+
+import pytest
+
+from prepare_assignment.core.planner import plan_steps, referenced_tasks, normalize_path, paths_overlap
+from prepare_assignment.data.prepare import Task
+
+
+def tasks_of(steps: List[Dict[str, Any]]) -> List[Task]:
+    return [Task.of(step) for step in steps]
+
+
+@pytest.mark.parametrize(
+    "path, expected", [
+        ("out", "out"),
+        ("./out/", "out"),
+        ("out/../src", "src"),
+        ("out\\student", "out/student"),
+        ("out/*.zip", "out"),
+        ("**/*.py", "."),
+        ("", "."),
+        ("/tmp/out", "/tmp/out"),
+    ]
+)
+def test_normalize_path(path: str, expected: str) -> None:
+    assert normalize_path(path) == expected
+
+
+@pytest.mark.parametrize(
+    "first, second, expected", [
+        ("out", "out", True),
+        ("out", "out/student", True),
+        ("out/student", "out/solution", False),
+        ("out", "output", False),
+        (".", "src", True),
+        ("../src", "src", True),
+        ("/tmp/out", "out", True),
+        ("/tmp/out", "/tmp/src", False),
+    ]
+)
+def test_paths_overlap(first: str, second: str, expected: bool) -> None:
+    assert paths_overlap(first, second) == expected
+
+
+def test_referenced_tasks() -> None:
+    task = Task.of({'name': 'zip', 'uses': 'zip',
+                    'with': {'input': ["${{ tasks.build.outputs.files }}", "${{ tasks['other-build'].outputs.x }}"]},
+                    'if': "tasks.check.outputs.ok"})
+    assert referenced_tasks(task) == {"build", "other-build", "check"}
+
+
+def test_referenced_tasks_dynamic() -> None:
+    task = Task.of({'name': 'zip', 'run': "echo ${{ tasks[inputs.name].outputs.x }}"})
+    assert referenced_tasks(task) is None
+
+
+def test_plan_undeclared_sequential() -> None:
+    plan = plan_steps(tasks_of([
+        {'name': 'a', 'run': 'a'},
+        {'name': 'b', 'run': 'b', 'writes': 'out/b'},
+        {'name': 'c', 'run': 'c'},
+    ]))
+    assert plan == [set(), {0}, {0, 1}]
+
+
+def test_plan_declared_paths() -> None:
+    plan = plan_steps(tasks_of([
+        {'name': 'student', 'run': 'student', 'reads': 'src', 'writes': 'out/student'},
+        {'name': 'solution', 'run': 'solution', 'reads': 'src', 'writes': 'out/solution'},
+        {'name': 'zip', 'run': 'zip', 'reads': 'out', 'writes': 'dist/*.zip'},
+        {'name': 'lint', 'run': 'lint', 'reads': 'src'},
+    ]))
+    assert plan == [set(), set(), {0, 1}, set()]
+
+
+def test_plan_outputs() -> None:
+    plan = plan_steps(tasks_of([
+        {'name': 'build', 'uses': 'build', 'writes': 'out'},
+        {'name': 'report', 'run': 'echo ${{ tasks.build.outputs.files }}', 'writes': 'report'},
+    ]))
+    assert plan == [set(), {0}]
+
+
+@pytest.mark.parametrize(
+    "condition", ["always()", "failure()", "env.BUILD == 'true'"]
+)
+def test_plan_condition_sequential(condition: str) -> None:
+    plan = plan_steps(tasks_of([
+        {'name': 'build', 'run': 'build', 'writes': 'out'},
+        {'name': 'report', 'run': 'report', 'writes': 'report', 'if': condition},
+    ]))
+    assert plan == [set(), {0}]
+
+
+def test_plan_set_env_sequential() -> None:
+    plan = plan_steps(tasks_of([
+        {'name': 'set', 'run': 'echo "::set-env::VAR::value"', 'writes': 'out/set'},
+        {'name': 'echo', 'run': 'echo $VAR', 'writes': 'out/echo'},
+        {'name': 'build', 'uses': 'build', 'writes': 'out/build'},
+    ]))
+    # The task after the echo only waits for the task that sets the variable
+    assert plan == [set(), {0}, {0}]
+
+
+@pytest.mark.parametrize(
+    "command, expected", [
+        ("echo $VAR", {0}),
+        ("echo ${VAR:-default}", {0}),
+        ("echo ${{ inputs.name }}", set()),
+        ("echo $1", set()),
+    ]
+)
+def test_plan_shell_variables(command: str, expected: Set[int]) -> None:
+    plan = plan_steps(tasks_of([
+        {'name': 'build', 'uses': 'build', 'writes': 'out'},
+        {'name': 'report', 'run': command, 'writes': 'report'},
+    ]))
+    assert plan == [set(), expected]
@@ -2,6 +2,8 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 from pathlib import Path
 from typing import Final, Dict, Any
 
@@ -9,8 +11,15 @@ import git
 import pytest
 from pytest_mock import MockerFixture
 
-from prepare_assignment.core.preparer import prepare_tasks, __task_install_dependencies
-from prepare_assignment.data.errors import DependencyError, PrepareTaskError
+from prepare_assignment.core import preparer
+from prepare_assignment.core.preparer import prepare_tasks, __task_install_dependencies, __prepare_venv, __venv_key, \
+    download_wheels, __download_task, update_task, update_tasks, __prepare_task
+from prepare_assignment.data.errors import DependencyError, PrepareTaskError, ValidationError
+from prepare_assignment.data.task_definition import PythonTaskDefinition, CompositeTaskDefinition, ValidableTask
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.tag_cache import TagCache
+from prepare_assignment.utils.task_graph import TaskGraph
+from prepare_assignment.utils.task_index import TaskIndex
 from virtualenv import cli_run  # type: ignore
 
 from prepare_assignment.utils.paths import get_cache_path
@@ -38,6 +47,11 @@ def set_cache(class_mocker) -> None:
     class_mocker.patch("prepare_assignment.core.preparer.cache_path", CACHE_PATH)
     class_mocker.patch("prepare_assignment.data.task_properties.tasks_path", TASKS_PATH)
     class_mocker.patch("prepare_assignment.core.preparer.tasks_path", TASKS_PATH)
+    class_mocker.patch("prepare_assignment.core.preparer.venvs_path", os.path.join(CACHE_PATH, "venvs"))
+    class_mocker.patch("prepare_assignment.core.preparer.mirrors_path", os.path.join(CACHE_PATH, "mirrors"))
+    class_mocker.patch("prepare_assignment.core.preparer.tag_cache", TagCache(Path(os.path.join(CACHE_PATH, "tags"))))
+    class_mocker.patch("prepare_assignment.core.preparer.task_index",
+                       TaskIndex(Path(os.path.join(TASKS_PATH, "index.json"))))
 
 
 def __clean_cache() -> None:
@@ -157,3 +171,392 @@ def test_install_wrong_dependencies() -> None:
             with open(os.path.join(repo_path, "requirements.txt"), "w") as handle:
                 handle.write("prepare_toolbox==0.0.0")
             __task_install_dependencies(tmpdir)
+
+
+def __python_task(props: TaskProperties) -> ValidableTask:
+    task = PythonTaskDefinition(id=props.name, name=props.name, description=props.name, inputs=[], outputs={},
+                                path=props.task_path, main="main.py")
+    return {"schema": {"type": "object"}, "task": task}
+
+
+def __composite_task(props: TaskProperties, uses: str) -> ValidableTask:
+    task = CompositeTaskDefinition(id=props.name, name=props.name, description=props.name, inputs=[], outputs={},
+                                   path=props.task_path, tasks=[{"name": "sub", "uses": uses}])
+    return {"schema": {"type": "object"}, "task": task}
+
+
+def test_prepare_tasks_concurrently(mocker: MockerFixture) -> None:
+    __clean_cache()
+    # All three tasks have to be in progress at the same time to get past the barrier
+    barrier = threading.Barrier(3, timeout=10)
+
+    def prepare_task(props: TaskProperties) -> ValidableTask:
+        barrier.wait()
+        return __python_task(props)
+
+    mock = mocker.patch("prepare_assignment.core.preparer.__prepare_task", side_effect=prepare_task)
+    prepare = {
+        'prepare': [
+            {'name': 'one', 'uses': 'one'},
+            {'name': 'two', 'uses': 'two'},
+            {'name': 'three', 'uses': 'three'},
+            {'name': 'one again', 'uses': 'prepare-assignment/one@latest'}
+        ]
+    }
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.max_workers", 3)
+    mapping = prepare_tasks("prepare.yml", prepare)
+    assert len(mapping) == 3
+    assert mock.call_count == 3
+
+
+def test_prepare_composite_sub_task_fails_removes_composite(mocker: MockerFixture) -> None:
+    __clean_cache()
+
+    def prepare_task(props: TaskProperties) -> ValidableTask:
+        if props.name == "composite":
+            return __composite_task(props, "fails")
+        raise PrepareTaskError(f"Unable to prepare task '{props}'", Exception("failed"))
+
+    mocker.patch("prepare_assignment.core.preparer.__prepare_task", side_effect=prepare_task)
+    rmtree = mocker.patch("prepare_assignment.core.preparer.shutil.rmtree")
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.max_workers", 2)
+    prepare = {'prepare': [{'name': 'composite', 'uses': 'composite'}]}
+    with pytest.raises(PrepareTaskError):
+        prepare_tasks("prepare.yml", prepare)
+    removed = [call.args[0] for call in rmtree.call_args_list]
+    assert TaskProperties.of("composite").task_path in removed
+
+
+def test_prepare_many_steps(mocker: MockerFixture) -> None:
+    __clean_cache()
+    mock = mocker.patch("prepare_assignment.core.preparer.__prepare_task", side_effect=__python_task)
+    validate = mocker.patch("prepare_assignment.core.preparer.validate_tasks")
+    steps = 10000
+    prepare = {'prepare': [{'name': f'step {i}', 'uses': f'task{i % 10}'} for i in range(steps)]}
+    mapping = prepare_tasks("prepare.yml", prepare)
+    assert len(mapping) == 10
+    assert mock.call_count == 10
+    assert validate.call_count == steps
+
+
+def test_prepare_warm_uses_index(mocker: MockerFixture) -> None:
+    __clean_cache()
+    props = TaskProperties.of("indexed")
+    props.repo_path.mkdir(parents=True)
+    props.definition_path.write_text("id: indexed\nname: indexed\ndescription: indexed\n"
+                                     "runs:\n  using: python\n  main: main.py\n")
+    Path(os.path.join(props.task_path, "indexed.schema.json")).write_text('{"type": "object"}')
+    load = mocker.spy(preparer, "load_yaml")
+    prepare = {'prepare': [{'name': 'indexed', 'uses': 'indexed'}]}
+    prepare_tasks("prepare.yml", prepare)
+    assert load.call_count == 1
+    # A new process only has the index on disk
+    mocker.patch("prepare_assignment.core.preparer.task_index",
+                 TaskIndex(Path(os.path.join(TASKS_PATH, "index.json"))))
+    mapping = prepare_tasks("prepare.yml", prepare)
+    assert load.call_count == 1
+    assert mapping[str(props)].id == "indexed"
+    # Changing the definition invalidates the entry
+    props.definition_path.write_text(props.definition_path.read_text().replace("name: indexed", "name: changed"))
+    mapping = prepare_tasks("prepare.yml", prepare)
+    assert load.call_count == 2
+    assert mapping[str(props)].name == "changed"
+
+
+def __fake_repo(props: TaskProperties, requirements: str) -> None:
+    props.repo_path.mkdir(parents=True, exist_ok=True)
+    with open(os.path.join(props.repo_path, "requirements.txt"), "w") as handle:
+        handle.write(requirements)
+
+
+def test_venv_key_depends_on_requirements() -> None:
+    __clean_cache()
+    one = TaskProperties.of("one")
+    two = TaskProperties.of("two")
+    three = TaskProperties.of("three")
+    __fake_repo(one, "prepare_toolbox==0.4.0")
+    __fake_repo(two, "prepare_toolbox==0.4.0")
+    __fake_repo(three, "prepare_toolbox==0.3.0")
+    assert __venv_key(one.repo_path) == __venv_key(two.repo_path)
+    assert __venv_key(one.repo_path) != __venv_key(three.repo_path)
+
+
+def test_venv_shared_between_tasks(mocker: MockerFixture) -> None:
+    __clean_cache()
+    one = TaskProperties.of("one")
+    two = TaskProperties.of("two")
+    __fake_repo(one, "prepare_toolbox==0.4.0")
+    __fake_repo(two, "prepare_toolbox==0.4.0")
+    create = mocker.patch("prepare_assignment.core.preparer.cli_run",
+                          side_effect=lambda args: Path(args[0]).mkdir(parents=True))
+    install = mocker.patch("prepare_assignment.core.preparer.__task_install_dependencies")
+    assert __prepare_venv(one) == __prepare_venv(two)
+    create.assert_called_once()
+    install.assert_called_once()
+
+
+def test_venv_cloned_from_template(mocker: MockerFixture) -> None:
+    __clean_cache()
+    one = TaskProperties.of("one")
+    two = TaskProperties.of("two")
+    __fake_repo(one, "prepare_toolbox==0.4.0")
+    __fake_repo(two, "prepare_toolbox==0.3.0")
+    mocker.patch("prepare_assignment.core.preparer.sys.platform", "linux")
+    create = mocker.patch("prepare_assignment.core.preparer.cli_run",
+                          side_effect=lambda args: Path(args[0]).mkdir(parents=True))
+    clone = mocker.patch("prepare_assignment.core.preparer.clone_venv",
+                         side_effect=lambda template, target: Path(target).mkdir(parents=True))
+    mocker.patch("prepare_assignment.core.preparer.__task_install_dependencies")
+    __prepare_venv(one)
+    __prepare_venv(two)
+    # Only the template is created, the venvs of the tasks are clones
+    create.assert_called_once()
+    assert Path(create.call_args.args[0][0]).name.startswith("template-")
+    assert clone.call_count == 2
+
+
+def test_venv_created_if_clone_fails(mocker: MockerFixture) -> None:
+    __clean_cache()
+    one = TaskProperties.of("one")
+    __fake_repo(one, "prepare_toolbox==0.4.0")
+    create = mocker.patch("prepare_assignment.core.preparer.cli_run",
+                          side_effect=lambda args: Path(args[0]).mkdir(parents=True))
+    mocker.patch("prepare_assignment.core.preparer.clone_venv", side_effect=OSError("failed"))
+    mocker.patch("prepare_assignment.core.preparer.__task_install_dependencies")
+    key = __prepare_venv(one)
+    assert create.call_args.args[0][0] == os.path.join(CACHE_PATH, "venvs", key)
+
+
+def test_venv_removed_if_install_fails(mocker: MockerFixture) -> None:
+    __clean_cache()
+    one = TaskProperties.of("one")
+    __fake_repo(one, "prepare_toolbox==0.0.0")
+    mocker.patch("prepare_assignment.core.preparer.cli_run",
+                 side_effect=lambda args: Path(args[0]).mkdir(parents=True))
+    mocker.patch("prepare_assignment.core.preparer.__task_install_dependencies",
+                 side_effect=DependencyError("failed"))
+    with pytest.raises(DependencyError):
+        __prepare_venv(one)
+    assert not os.path.exists(os.path.join(CACHE_PATH, "venvs", __venv_key(one.repo_path)))
+
+
+def test_install_offline_uses_wheelhouse(mocker: MockerFixture) -> None:
+    __clean_cache()
+    props = TaskProperties.of("one")
+    __fake_repo(props, "prepare_toolbox==0.4.0")
+    wheelhouse = os.path.join(CACHE_PATH, "wheels")
+    os.mkdir(wheelhouse)
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.offline", True)
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.wheelhouse", wheelhouse)
+    run = mocker.patch("prepare_assignment.core.preparer.subprocess.run")
+    run.return_value.returncode = 0
+    __task_install_dependencies(props.task_path)
+    args = run.call_args.args[0]
+    assert "--no-index" in args
+    assert args[args.index("--find-links") + 1] == wheelhouse
+
+
+def test_install_offline_without_wheelhouse(mocker: MockerFixture) -> None:
+    __clean_cache()
+    props = TaskProperties.of("one")
+    __fake_repo(props, "prepare_toolbox==0.4.0")
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.offline", True)
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.wheelhouse", os.path.join(CACHE_PATH, "missing"))
+    with pytest.raises(DependencyError):
+        __task_install_dependencies(props.task_path)
+
+
+def test_download_wheels(mocker: MockerFixture) -> None:
+    __clean_cache()
+    props = TaskProperties.of("one")
+    __fake_repo(props, "prepare_toolbox==0.4.0")
+    run = mocker.patch("prepare_assignment.core.preparer.subprocess.run")
+    run.return_value.returncode = 0
+    download_wheels(props, Path("wheels"))
+    args = run.call_args.args[0]
+    assert args[1:4] == ["-m", "pip", "wheel"]
+    assert args[args.index("--wheel-dir") + 1] == "wheels"
+    assert args[-2:] == ["-r", os.path.join(props.repo_path, "requirements.txt")]
+
+
+def __local_remote(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> git.Repo:
+    # Redirect github to a local directory, so we can test without network access
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", f"url.{tmp_path.as_uri()}/.insteadOf")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "https://github.com/")
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.git_mode", "https")
+    origin = git.Repo.init(tmp_path / "org" / "task.git")
+    with origin.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@example.com")
+    return origin
+
+
+def __commit(origin: git.Repo, content: str, tag: str) -> str:
+    Path(origin.working_dir, "task.yml").write_text(content)
+    origin.index.add(["task.yml"])
+    commit = origin.index.commit(content)
+    origin.create_tag(tag)
+    return commit.hexsha
+
+
+def test_download_versions_from_mirror(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch,
+                                       tmp_path: Path) -> None:
+    __clean_cache()
+    origin = __local_remote(mocker, monkeypatch, tmp_path)
+    first = __commit(origin, "one", "v1.0.0")
+    __commit(origin, "two", "v2.0.0")
+    spy = mocker.spy(git.Repo, "clone_from")
+    for version, content in (("v1.0.0", "one"), ("v2.0.0", "two"), (first, "one")):
+        props = TaskProperties.of(f"org/task@{version}")
+        __download_task(props)
+        assert props.definition_path.read_text() == content
+    mirror = os.path.join(CACHE_PATH, "mirrors", "org", "task.git")
+    assert os.path.isdir(mirror)
+    assert all(call.args[0] == mirror for call in spy.call_args_list)
+
+
+def test_download_fetches_mirror(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    __clean_cache()
+    origin = __local_remote(mocker, monkeypatch, tmp_path)
+    __commit(origin, "one", "v1.0.0")
+    __download_task(TaskProperties.of("org/task@v1.0.0"))
+    # New tag, unknown to the mirror
+    __commit(origin, "two", "v2.0.0")
+    mocker.patch("prepare_assignment.core.preparer.fetched_mirrors", set())
+    props = TaskProperties.of("org/task@v2.0.0")
+    __download_task(props)
+    assert props.definition_path.read_text() == "two"
+
+
+def test_update_task_in_place(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    __clean_cache()
+    origin = __local_remote(mocker, monkeypatch, tmp_path)
+    __commit(origin, "one", "v1.0.0")
+    props = TaskProperties.of("org/task@latest")
+    __download_task(props)
+    install = mocker.patch("prepare_assignment.core.preparer.__install_task",
+                           side_effect=lambda task_props, task_path: __python_task(task_props))
+    clone = mocker.spy(git.Repo, "clone_from")
+    assert not update_task(props)
+    assert install.call_count == 0
+
+    second = __commit(origin, "two", "v2.0.0")
+    # A new process, which doesn't remember the tags and fetched mirrors
+    mocker.patch("prepare_assignment.core.preparer.fetched_mirrors", set())
+    mocker.patch("prepare_assignment.core.preparer.tag_cache", TagCache(Path(os.path.join(CACHE_PATH, "tags"))))
+    assert update_task(props)
+    assert props.definition_path.read_text() == "two"
+    with git.Repo(props.repo_path) as repo:
+        assert repo.head.commit.hexsha == second
+    assert install.call_count == 1
+    assert clone.call_count == 0
+    # The new tag is known locally now, so nothing has to be fetched to see the task is up to date
+    assert not update_task(props)
+    assert not update_task(TaskProperties.of("org/task@v1.0.0"))
+
+
+def test_update_task_failure_keeps_task(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch,
+                                        tmp_path: Path) -> None:
+    __clean_cache()
+    origin = __local_remote(mocker, monkeypatch, tmp_path)
+    first = __commit(origin, "one", "v1.0.0")
+    props = TaskProperties.of("org/task@latest")
+    __download_task(props)
+    __commit(origin, "two", "v2.0.0")
+    # A new process, which doesn't remember the tags and fetched mirrors
+    mocker.patch("prepare_assignment.core.preparer.fetched_mirrors", set())
+    mocker.patch("prepare_assignment.core.preparer.tag_cache", TagCache(Path(os.path.join(CACHE_PATH, "tags"))))
+    error = ValidationError("invalid task")
+
+    def install(task_props: TaskProperties, task_path: Path) -> ValidableTask:
+        # The task is updated somewhere else, so the installed task is never half updated
+        assert task_path != task_props.task_path
+        assert Path(task_path, "repo", "task.yml").read_text() == "two"
+        assert props.definition_path.read_text() == "one"
+        raise error
+
+    install_mock = mocker.patch("prepare_assignment.core.preparer.__install_task", side_effect=install)
+    with pytest.raises(PrepareTaskError) as info:
+        update_task(props)
+    assert info.value.__cause__ is error
+    assert install_mock.call_count == 1
+    assert props.definition_path.read_text() == "one"
+    with git.Repo(props.repo_path) as repo:
+        assert repo.head.commit.hexsha == first
+    assert not os.path.exists(os.path.join(CACHE_PATH, "staging", props.organization, props.name, props.version))
+
+
+def test_update_tasks_dependency_order(mocker: MockerFixture) -> None:
+    order = []
+
+    def update(props: TaskProperties) -> bool:
+        order.append(props.name)
+        return props.name != "right"
+
+    mocker.patch("prepare_assignment.core.preparer.update_task", side_effect=update)
+    top, left, right, bottom = (TaskProperties.of(name) for name in ("top", "left", "right", "bottom"))
+    graph = TaskGraph(dependencies={top: [left, right], left: [bottom], right: [bottom], bottom: []})
+    updated = update_tasks(graph, max_workers=3)
+    assert order[0] == "bottom" and order[-1] == "top"
+    assert set(updated) == {top, left, bottom}
+
+
+def test_update_tasks_failure_skips_dependents(mocker: MockerFixture) -> None:
+    def update(props: TaskProperties) -> bool:
+        if props.name == "bottom":
+            raise PrepareTaskError(f"Unable to update task '{props}'", Exception("failed"))
+        return True
+
+    mock = mocker.patch("prepare_assignment.core.preparer.update_task", side_effect=update)
+    top, bottom = TaskProperties.of("top"), TaskProperties.of("bottom")
+    with pytest.raises(PrepareTaskError):
+        update_tasks(TaskGraph(dependencies={top: [bottom], bottom: []}), max_workers=2)
+    assert mock.call_count == 1
+
+
+def test_prepare_task_staged(mocker: MockerFixture) -> None:
+    __clean_cache()
+    props = TaskProperties.of("staged")
+
+    def download(task_props: TaskProperties, repo_path: Path) -> Path:
+        # The task is built somewhere else, so other processes never see a half-built task
+        assert repo_path != task_props.repo_path
+        assert not os.path.exists(task_props.task_path)
+        repo_path.mkdir(parents=True)
+        raise DependencyError("failed")
+
+    mocker.patch("prepare_assignment.core.preparer.__download_task", side_effect=download)
+    with pytest.raises(PrepareTaskError):
+        __prepare_task(props)
+    assert not os.path.exists(props.task_path)
+    assert not os.path.exists(os.path.join(CACHE_PATH, "staging", props.organization, props.name, props.version))
+
+
+def test_prepare_task_waits_for_other_install(mocker: MockerFixture) -> None:
+    __clean_cache()
+    props = TaskProperties.of("shared")
+
+    def download(task_props: TaskProperties, repo_path: Path) -> Path:
+        repo_path.mkdir(parents=True)
+        (repo_path / "task.yml").write_text("id: shared\nname: shared\ndescription: shared\n"
+                                            "runs:\n  using: python\n  main: main.py\n")
+        # Give the other install the chance to start
+        time.sleep(0.2)
+        return repo_path
+
+    def install(task_props: TaskProperties, task_path: Path) -> ValidableTask:
+        (task_path / "shared.schema.json").write_text('{"type": "object"}')
+        return __python_task(task_props)
+
+    download_mock = mocker.patch("prepare_assignment.core.preparer.__download_task", side_effect=download)
+    mocker.patch("prepare_assignment.core.preparer.__install_task", side_effect=install)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(__prepare_task(props))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert download_mock.call_count == 1
+    assert [result["task"].id for result in results] == ["shared", "shared"]
+    assert os.path.isfile(props.definition_path)
@@ -1,9 +1,11 @@
-from typing import Optional
+from pathlib import Path
+from typing import Any
 
 import pytest
 from pytest_mock import MockerFixture
 
 from prepare_assignment.core.preparer import __resolve_version
+from prepare_assignment.utils.tag_cache import TagCache
 
 URL = "https://github.com/prepare-assignment/remove.git"
 
@@ -38,11 +40,20 @@ TAGS_BRANCHES_ONLY = (
 )
 
 
-def mock_ls_remote(mocker: MockerFixture, return_value: str) -> None:
+@pytest.fixture(autouse=True)
+def tag_cache(mocker: MockerFixture, tmp_path: Path) -> TagCache:
+    # Every test gets its own (empty) cache, otherwise tags of a previous test would be used
+    cache = TagCache(tmp_path)
+    mocker.patch("prepare_assignment.core.preparer.tag_cache", cache)
+    return cache
+
+
+def mock_ls_remote(mocker: MockerFixture, return_value: str) -> Any:
     # Git uses __getattr__ for command dispatch, so patch the class at the module level
     # and configure the instance's ls_remote to return the desired string.
     mock_git_cls = mocker.patch("prepare_assignment.core.preparer.Git")
     mock_git_cls.return_value.ls_remote.return_value = return_value
+    return mock_git_cls.return_value.ls_remote
 
 
 # ── No network call needed ───────────────────────────────────────────────────
@@ -137,3 +148,30 @@ def test_prefix_no_matches_returns_version_as_fallback(mocker: MockerFixture) ->
 def test_unknown_version_returns_as_is(mocker: MockerFixture) -> None:
     mock_ls_remote(mocker, TAGS_MULTIVERSION)
     assert __resolve_version(URL, "develop") == "develop"
+
+
+# ── Caching ──────────────────────────────────────────────────────────────────
+
+def test_tags_listed_once_per_run(mocker: MockerFixture) -> None:
+    ls_remote = mock_ls_remote(mocker, TAGS_MULTIVERSION)
+    assert __resolve_version(URL, "latest") == "v2.1.0"
+    assert __resolve_version(URL, "v1") == "v1.1.2"
+    ls_remote.assert_called_once()
+
+
+def test_tags_persisted_between_runs(mocker: MockerFixture, tag_cache: TagCache) -> None:
+    ls_remote = mock_ls_remote(mocker, TAGS_MULTIVERSION)
+    assert __resolve_version(URL, "latest") == "v2.1.0"
+    # A new run doesn't have the memoized tags, but can use the persisted ones
+    mocker.patch("prepare_assignment.core.preparer.tag_cache", TagCache(tag_cache.path))
+    assert __resolve_version(URL, "latest") == "v2.1.0"
+    ls_remote.assert_called_once()
+
+
+def test_refresh_ignores_persisted_tags(mocker: MockerFixture, tag_cache: TagCache) -> None:
+    ls_remote = mock_ls_remote(mocker, TAGS_MULTIVERSION)
+    assert __resolve_version(URL, "latest") == "v2.1.0"
+    mocker.patch("prepare_assignment.core.preparer.tag_cache", TagCache(tag_cache.path))
+    mocker.patch("prepare_assignment.core.preparer.CONFIG.core.tag_cache_ttl", 0)
+    assert __resolve_version(URL, "latest") == "v2.1.0"
+    assert ls_remote.call_count == 2
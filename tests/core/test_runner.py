@@ -1,10 +1,15 @@
-from typing import Any, Dict, List
+import io
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 import pytest
 from prepare_toolbox.command import DEMARCATION
 from pytest_mock import MockerFixture
 
+from prepare_assignment.core import runner
 from prepare_assignment.core.runner import run
+from prepare_assignment.data.job_environment import JobEnvironment
 from prepare_assignment.data.errors import TaskExecutionError
 from prepare_assignment.data.task_definition import PythonTaskDefinition, TaskInputDefinition, \
     TaskOutputDefinition, CompositeTaskDefinition
@@ -36,7 +41,7 @@ class MockedPopen:
 
     @property
     def stdout(self):
-        return [":PA:error:PA:error message\n"]
+        return io.BytesIO(b":PA:error:PA:error message\n")
 
 
 class MockedPopenFail(MockedPopen):
@@ -300,8 +305,8 @@ def _make_popen_factory(outputs: List[List[str]]) -> Any:
             call_index[0] += 1
 
         @property
-        def stdout(self) -> List[str]:
-            return self._lines
+        def stdout(self) -> io.BytesIO:
+            return io.BytesIO("".join(self._lines).encode("utf-8"))
 
     _Popen.captured = call_envs  # type: ignore
     return _Popen
@@ -374,3 +379,242 @@ def test_set_env_inside_composite_propagates_to_next_task(mocker: MockerFixture)
     run(Prepare.of(_composite_then_task_yaml), mapping)
     assert mock.call_count == 2
     assert factory.captured[1].get("COMPOSITE_VAR") == "from-composite"  # type: ignore
+
+
+# ── jobs with needs ───────────────────────────────────────────────────────────
+
+_SET_OUTPUT_LINE = f"{DEMARCATION}set-output{DEMARCATION}files{DEMARCATION}{{\"files\": [\"out\"]}}\n"
+
+
+def test_runner_needs_outputs(mocker: MockerFixture) -> None:
+    """A job runs after the jobs it needs, and can use their outputs."""
+    yaml_needs = dict(name='Test', jobs={
+        'reader': {'needs': 'writer', 'steps': [{'name': 'reader', 'run': "echo '${{ needs.writer.outputs.remove.files }}'"}]},
+        'writer': [{'name': 'remove', 'uses': 'remove', 'id': 'remove',
+                    'with': {'input': ['out'], 'force': True, 'recursive': True}}],
+    })
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.max_workers", 2)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = _make_popen_factory([[_SET_OUTPUT_LINE], []])
+    run(Prepare.of(yaml_needs), mapping)
+    assert mock.call_count == 2
+    assert mock.call_args_list[1].args[0][-1] == 'echo \'["out"]\''
+
+
+def test_runner_independent_jobs_concurrently(mocker: MockerFixture) -> None:
+    """Jobs without needs run at the same time."""
+    barrier = threading.Barrier(3, timeout=10)
+
+    class _Popen(MockedPopen):
+        def __init__(self, args: Any, **kwargs: Any) -> None:
+            super().__init__(args, **kwargs)
+            barrier.wait()
+
+        @property
+        def stdout(self) -> io.BytesIO:
+            return io.BytesIO()
+
+    yaml_jobs = dict(name='Test', jobs={
+        name: [{'name': name, 'run': f'echo {name}'}] for name in ('student', 'template', 'solution')
+    })
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.max_workers", 3)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = _Popen
+    run(Prepare.of(yaml_jobs), mapping)
+    assert mock.call_count == 3
+
+
+def test_runner_failed_job_not_needed(mocker: MockerFixture) -> None:
+    """Jobs that need a failed job don't run."""
+    yaml_needs = dict(name='Test', jobs={
+        'first': [{'name': 'fails', 'run': 'exit 1'}],
+        'second': {'needs': ['first'], 'steps': [{'name': 'never', 'run': 'echo never'}]},
+    })
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.max_workers", 2)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = MockedPopenFail
+    with pytest.raises(TaskExecutionError) as pytest_wrapped_e:
+        run(Prepare.of(yaml_needs), mapping)
+    assert "first" in str(pytest_wrapped_e.value)
+    assert mock.call_count == 1
+
+
+def test_runner_declared_steps_concurrently(mocker: MockerFixture) -> None:
+    """Steps that declare paths that don't overlap run at the same time, the next step sees their environment."""
+    barrier = threading.Barrier(2, timeout=10)
+    envs: List[Dict[str, str]] = []
+
+    class _Popen(MockedPopen):
+        def __init__(self, args: Any, **kwargs: Any) -> None:
+            super().__init__(args, **kwargs)
+            self.command = args[-1]
+            envs.append(kwargs["env"])
+            if "build" in self.command:
+                barrier.wait()
+
+        @property
+        def stdout(self) -> io.BytesIO:
+            if "build" in self.command:
+                name = self.command.split()[-1].upper()
+                return io.BytesIO(f"{DEMARCATION}set-env{DEMARCATION}{name}{DEMARCATION}\"done\"\n".encode("utf-8"))
+            return io.BytesIO()
+
+    yaml_steps = dict(name='Test', jobs={'prepare': [
+        {'name': 'student', 'run': 'build student', 'reads': 'src', 'writes': 'out/student'},
+        {'name': 'solution', 'run': 'build solution', 'reads': ['src'], 'writes': ['out/solution']},
+        {'name': 'zip', 'run': 'zip out'},
+    ]})
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.max_workers", 2)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = _Popen
+    run(Prepare.of(yaml_steps), mapping)
+    assert mock.call_count == 3
+    assert envs[-1]["STUDENT"] == "done"
+    assert envs[-1]["SOLUTION"] == "done"
+
+
+def test_runner_declared_steps_sequential_single_worker(mocker: MockerFixture) -> None:
+    """With a single worker declared steps run in order of definition."""
+    commands: List[str] = []
+
+    class _Popen(MockedPopen):
+        def __init__(self, args: Any, **kwargs: Any) -> None:
+            super().__init__(args, **kwargs)
+            commands.append(args[-1])
+
+    yaml_steps = dict(name='Test', jobs={'prepare': [
+        {'name': 'first', 'run': 'first', 'writes': 'a'},
+        {'name': 'second', 'run': 'second', 'writes': 'b'},
+    ]})
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.max_workers", 1)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = _Popen
+    run(Prepare.of(yaml_steps), mapping)
+    assert commands == ["first", "second"]
+
+
+def test_runner_task_workers(mocker: MockerFixture) -> None:
+    """Python tasks run in a worker when task workers are enabled, run steps still use a subprocess."""
+    def _run_in_worker(executable: str, main: str, env: Dict[str, str], on_output: Any, cwd: Optional[str],
+                       on_start: Any) -> int:
+        # The output is split into lines by the runner, also when a line is sent in several chunks
+        on_output(_SET_ENV_LINE[:5].encode("utf-8"))
+        on_output(_SET_ENV_LINE[5:].encode("utf-8"))
+        return 0
+
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.task_workers", True)
+    mocker.patch("prepare_assignment.core.runner.workers_supported", return_value=True)
+    worker = mocker.patch("prepare_assignment.core.runner.run_in_worker", side_effect=_run_in_worker)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = MockedPopen
+    run(Prepare.of(yaml), mapping)
+    assert worker.call_count == 2
+    assert mock.call_count == 1
+    assert mock.call_args.kwargs["env"]["MY_VAR"] == "hello"
+
+
+def test_runner_task_workers_fallback(mocker: MockerFixture) -> None:
+    """Python tasks run in a subprocess if the worker could not start the task."""
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.task_workers", True)
+    mocker.patch("prepare_assignment.core.runner.workers_supported", return_value=True)
+    mocker.patch("prepare_assignment.core.runner.run_in_worker", return_value=None)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = MockedPopen
+    run(Prepare.of(yaml), mapping)
+    assert mock.call_count == 3
+
+
+def test_pump_output_commands_across_chunks(mocker: MockerFixture) -> None:
+    """Command lines are handled even if they are split over multiple chunks, log lines are skipped."""
+    mocker.patch("prepare_assignment.core.runner.OUTPUT_CHUNK_SIZE", 7)
+    logger = mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    logger.isEnabledFor.return_value = False
+    environment = JobEnvironment({}, {}, {})
+    stream = io.BytesIO(b"log \xff line\r\n" + _SET_ENV_LINE.encode("utf-8").replace(b"\n", b"\r\n") +
+                        b"not a command " + _SET_ENV_LINE.encode("utf-8").replace(b"MY_VAR", b"OTHER") +
+                        b"last " + DEMARCATION.encode("utf-8"))
+    getattr(runner, "__pump_output")(stream, environment)
+    assert environment.environment == {"MY_VAR": "hello"}
+    logger.trace.assert_not_called()
+
+
+def test_pump_output_trace(mocker: MockerFixture) -> None:
+    """All lines are logged with trace enabled, lines that are too long are split."""
+    mocker.patch("prepare_assignment.core.runner.OUTPUT_CHUNK_SIZE", 4)
+    mocker.patch("prepare_assignment.core.runner.MAX_OUTPUT_LINE_LENGTH", 8)
+    logger = mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    logger.isEnabledFor.return_value = True
+    getattr(runner, "__pump_output")(io.BytesIO(b"short\n0123456789abcdefgh\nend"), JobEnvironment({}, {}, {}))
+    lines = [call.args[0] for call in logger.trace.call_args_list]
+    assert lines[0] == "short\n"
+    assert "".join(lines[1:]) == "0123456789abcdefghend"
+    assert all(len(line) <= 10 for line in lines)
+
+
+def test_runner_cwd(mocker: MockerFixture) -> None:
+    """Every subprocess runs in the directory that is passed to run."""
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = MockedPopen
+    run(Prepare.of(yaml), mapping, cwd="assignment")
+    assert mock.call_count == 3
+    assert all(call.kwargs["cwd"] == "assignment" for call in mock.call_args_list)
+
+
+def test_runner_concurrent_assignments(tmp_path: Path) -> None:
+    """Assignments can be prepared by threads of the same process, each in its own directory."""
+    prepare = Prepare.of(dict(name='Test', jobs={'prepare': [{'name': 'write', 'run': 'pwd > out.txt'}]}))
+    directories = [tmp_path / str(index) for index in range(4)]
+    threads = []
+    for directory in directories:
+        directory.mkdir()
+        threads.append(threading.Thread(target=run, args=(prepare, {}), kwargs={"cwd": str(directory)}))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for directory in directories:
+        assert (directory / "out.txt").read_text().strip() == str(directory)
+
+
+def test_runner_declared_steps_failure(mocker: MockerFixture) -> None:
+    """A failed step only skips the steps that depend on it, also when it fails before an independent step starts."""
+    commands: List[str] = []
+    linted = threading.Event()
+
+    class _Popen(MockedPopen):
+        def __init__(self, args: Any, **kwargs: Any) -> None:
+            super().__init__(args, **kwargs)
+            commands.append(args[-1])
+            if args[-1] == "build":
+                self.returncode = 1
+            elif args[-1] == "slow":
+                # Keeps the second worker busy, so 'lint' is only started once 'build' has failed
+                linted.wait(timeout=5)
+            elif args[-1] == "lint":
+                linted.set()
+
+        @property
+        def stdout(self) -> io.BytesIO:
+            return io.BytesIO()
+
+    yaml_steps = dict(name='Test', jobs={'prepare': [
+        {'name': 'build', 'run': 'build', 'reads': 'src', 'writes': 'out'},
+        {'name': 'slow', 'run': 'slow', 'reads': 'docs', 'writes': 'site'},
+        {'name': 'lint', 'run': 'lint', 'reads': 'src', 'writes': 'reports'},
+        {'name': 'package', 'run': 'package', 'reads': 'out', 'writes': 'dist'},
+    ]})
+    mocker.patch("prepare_assignment.core.runner.CONFIG.core.max_workers", 2)
+    mocker.patch("prepare_assignment.core.runner.tasks_logger")
+    mock = mocker.patch("prepare_assignment.core.runner.subprocess.Popen")
+    mock.side_effect = _Popen
+    with pytest.raises(TaskExecutionError):
+        run(Prepare.of(yaml_steps), mapping)
+    assert sorted(commands) == ["build", "lint", "slow"]
@@ -0,0 +1,31 @@
+import os
+import threading
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+
+from prepare_assignment.core.task_handler import remove
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.file_lock import cache_lock
+from prepare_assignment.utils.task_graph import TaskGraph
+from prepare_assignment.utils.task_index import TaskIndex
+
+
+def test_remove_waits_for_lock(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch("prepare_assignment.data.task_properties.tasks_path", str(tmp_path / "tasks"))
+    mocker.patch("prepare_assignment.core.task_handler.get_cache_path", return_value=tmp_path)
+    mocker.patch("prepare_assignment.core.task_handler.get_task_index", return_value=TaskIndex(tmp_path / "index.json"))
+    mocker.patch("prepare_assignment.core.task_handler.get_dependents", return_value={})
+    props = TaskProperties.of("task")
+    mocker.patch("prepare_assignment.core.task_handler.resolve_dependency_graph",
+                 return_value=TaskGraph(dependencies={props: []}))
+    props.repo_path.mkdir(parents=True)
+    with cache_lock(tmp_path, f"task-{props}"):
+        thread = threading.Thread(target=remove, args=(str(props), False))
+        thread.start()
+        thread.join(0.2)
+        # The task is being installed or updated by another process
+        assert thread.is_alive()
+        assert os.path.isdir(props.task_path)
+    thread.join()
+    assert not os.path.exists(props.task_path)
@@ -4,6 +4,7 @@ from typing import Any, Dict, Final
 import pytest
 from pytest_mock import MockerFixture
 
+from prepare_assignment.core import validator
 from prepare_assignment.core.validator import (validate_prepare, validate_tasks, load_yaml,
                                                validate_task_definition, validate_default_values)
 from prepare_assignment.data.task_definition import PythonTaskDefinition
@@ -138,3 +139,63 @@ def test_validate_default_values_invalid_array() -> None:
 def test_validate_default_values_valid() -> None:
     task = PythonTaskDefinition.of(TASK_DEFINITION, "test.yml")
     validate_default_values(task)
+
+
+def test_validate_tasks_memoized() -> None:
+    schema = copy.deepcopy(TASK_SCHEMA)
+    schema['properties']['with']['properties']['level'] = {'type': 'integer', 'default': 3}
+    cache_info = getattr(validator, "__validate_payload").cache_info
+    hits = cache_info().hits
+    first = {'name': 'first', 'id': 'first', 'uses': 'test', 'with': {'fail': True}}
+    second = {'name': 'second', 'id': 'second', 'uses': 'test', 'with': {'fail': True}}
+    validate_tasks("task.yml", first, schema)
+    validate_tasks("task.yml", second, copy.deepcopy(schema))
+    assert cache_info().hits == hits + 1
+    assert first['with'] == {'fail': True, 'level': 3}
+    assert second == {'name': 'second', 'id': 'second', 'uses': 'test', 'with': {'fail': True, 'level': 3}}
+
+
+def test_validate_tasks_memoized_error() -> None:
+    for name in ("first", "second"):
+        task = {'name': name, 'uses': 'test', 'with': {'fail': 'no'}}
+        with pytest.raises(ValidationError) as pytest_wrapped_e:
+            validate_tasks("task.yml", task, TASK_SCHEMA)
+        assert f"'{name}'" in str(pytest_wrapped_e.value)
+
+
+def test_validate_tasks_step_properties() -> None:
+    task = {'name': 'test', 'uses': 'test', 'with': {'fail': True}, 'if': 'always()', 'reads': 'src',
+            'writes': ['out']}
+    validate_tasks("task.yml", task, TASK_SCHEMA)
+    assert task['reads'] == 'src'
+
+
+def test_validate_prepare_paths() -> None:
+    prepare = copy.deepcopy(VALID_PREPARE_YAML)
+    prepare['jobs']['step2'] = [{'name': 'run', 'run': 'echo', 'reads': 'src', 'writes': ['out', 'dist']}]
+    validate_prepare("prepare.yml", prepare)
+    prepare['jobs']['step2'][0]['writes'] = 1
+    with pytest.raises(ValidationError):
+        validate_prepare("prepare.yml", prepare)
+
+
+def test_validate_prepare_needs() -> None:
+    prepare = copy.deepcopy(VALID_PREPARE_YAML)
+    prepare['jobs']['step2'] = {'needs': 'step1', 'steps': [{'name': 'run', 'run': 'echo'}]}
+    validate_prepare("prepare.yml", prepare)
+
+
+def test_validate_prepare_needs_unknown_job() -> None:
+    prepare = copy.deepcopy(VALID_PREPARE_YAML)
+    prepare['jobs']['step2'] = {'needs': ['missing'], 'steps': [{'name': 'run', 'run': 'echo'}]}
+    with pytest.raises(ValidationError) as pytest_wrapped_e:
+        validate_prepare("prepare.yml", prepare)
+    assert "missing" in str(pytest_wrapped_e.value)
+
+
+def test_validate_prepare_needs_cycle() -> None:
+    prepare = copy.deepcopy(VALID_PREPARE_YAML)
+    prepare['jobs']['step1'] = {'needs': 'step2', 'steps': prepare['jobs']['step1']}
+    prepare['jobs']['step2'] = {'needs': 'step1', 'steps': [{'name': 'run', 'run': 'echo'}]}
+    with pytest.raises(ValidationError):
+        validate_prepare("prepare.yml", prepare)
@@ -0,0 +1,30 @@
+import logging
+from pathlib import Path
+
+from benchmarks.harness import compare_results, load_results, run_benchmarks, write_results
+from benchmarks.workloads import BENCHMARKS
+
+
+def test_run_benchmarks(tmp_path: Path) -> None:
+    tasks_logger = logging.getLogger("tasks")
+    level = tasks_logger.level
+    # Run every workload once, so the benchmarks keep working when the hot paths change
+    results = run_benchmarks(BENCHMARKS, repeat=1, min_time=0)
+    assert list(results["benchmarks"]) == [benchmark.name for benchmark in BENCHMARKS]
+    assert all(stats["loops"] == 1 and stats["min"] > 0 for stats in results["benchmarks"].values())
+    assert tasks_logger.level == level
+    write_results(results, tmp_path / "results.json")
+    assert load_results(tmp_path / "results.json") == results
+
+
+def test_run_benchmarks_filter() -> None:
+    results = run_benchmarks(BENCHMARKS, pattern="^substitute", repeat=2, min_time=0)
+    assert list(results["benchmarks"]) == ["substitute.blocks", "substitute.inputs"]
+
+
+def test_compare_results() -> None:
+    base = {"benchmarks": {"fast": {"min": 1.0}, "removed": {"min": 1.0}}}
+    new = {"benchmarks": {"fast": {"min": 1.5}, "added": {"min": 1.0}}}
+    comparisons = compare_results(base, new)
+    assert [comparison.name for comparison in comparisons] == ["fast"]
+    assert comparisons[0].change == 0.5
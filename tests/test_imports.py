@@ -0,0 +1,39 @@
+import ast
+import importlib
+import pkgutil
+from pathlib import Path
+from typing import List
+
+import pytest
+
+import prepare_assignment
+
+PACKAGE_PATH = Path(prepare_assignment.__file__).parent
+
+
+def __modules() -> List[str]:
+    return sorted(module.name for module in pkgutil.walk_packages([str(PACKAGE_PATH)], "prepare_assignment.")
+                  if module.name != "prepare_assignment.__main__")
+
+
+@pytest.mark.parametrize("module", __modules())
+def test_import(module: str) -> None:
+    importlib.import_module(module)
+
+
+def test_union_annotations_are_postponed() -> None:
+    # 'str | os.PathLike' is only valid at runtime from Python 3.10, older versions need the annotations to be strings
+    for path in PACKAGE_PATH.rglob("*.py"):
+        tree = ast.parse(path.read_text())
+        if any(isinstance(node, ast.ImportFrom) and node.module == "__future__" for node in tree.body):
+            continue
+        annotations = [node.annotation for node in ast.walk(tree) if isinstance(node, (ast.arg, ast.AnnAssign))]
+        annotations += [node.returns for node in ast.walk(tree)
+                        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+        for annotation in annotations:
+            if annotation is None:
+                continue
+            unions = [node for node in ast.walk(annotation) if isinstance(node, ast.BinOp)
+                      and isinstance(node.op, ast.BitOr)]
+            assert len(unions) == 0, f"{path.relative_to(PACKAGE_PATH)}:{annotation.lineno} uses '|' in an " \
+                                     f"annotation without 'from __future__ import annotations'"
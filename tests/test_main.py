@@ -10,6 +10,8 @@ from pytest_mock import MockerFixture
 from typer.testing import CliRunner
 
 from prepare_assignment.cli.main import app
+from prepare_assignment.data.config import Core
+from prepare_assignment.data.constants import _LazyConfig
 
 test_project_dir = os.path.join(Path(__file__).parent.absolute())
 cli_runner = CliRunner()
@@ -25,8 +27,10 @@ def test_main(monkeypatch: pytest.MonkeyPatch, caplog: LogCaptureFixture, mocker
         with patch.object(sys, 'argv', args):
             with pytest.raises(SystemExit):
                 app()
-    assert os.path.isdir("out")
-    with open('out.txt', 'r') as handle:
+    # The tasks run in the directory of the prepare file, the working directory doesn't change
+    assert os.getcwd() == test_project_dir
+    assert os.path.isdir(os.path.join("testproject", "out"))
+    with open(os.path.join("testproject", "out.txt"), 'r') as handle:
         text = handle.read()
     assert "AssessmentResult.java" in text
 
@@ -64,3 +68,46 @@ def test_run_shorthand_key_value_form(mocker: MockerFixture) -> None:
     mock_prepare.assert_called_once_with(None, {"mode": "production"})
 
 
+def write_assignment(path: Path, command: str) -> Path:
+    path.mkdir(parents=True)
+    (path / "prepare.yml").write_text(f"name: test\njobs:\n  prepare:\n    - name: run\n      run: {command}\n")
+    return path / "prepare.yml"
+
+
+def test_run_many(mocker: MockerFixture, tmp_path: Path) -> None:
+    """run-many finds the prepare files and exits with 1 if one of them failed."""
+    first = write_assignment(tmp_path / "first", "echo first")
+    second = write_assignment(tmp_path / "nested" / "second", "echo second")
+    write_assignment(tmp_path / ".hidden", "echo hidden")
+    mock_prepare = mocker.patch("prepare_assignment.cli.main.prepare_many")
+    mock_prepare.return_value = {str(first): None, str(second): "failed"}
+    result = cli_runner.invoke(app, ["run-many", str(tmp_path), "-p", "2", "-e", "TEST=1"])
+    mock_prepare.assert_called_once_with([str(first), str(second)], {"TEST": "1"}, 2)
+    assert result.exit_code == 1
+    assert "Prepared 1 of 2 assignments" in result.output
+
+
+def test_prepare_many(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Every assignment runs in its own directory, a failing assignment doesn't stop the others."""
+    from prepare_assignment.core.main import prepare_many
+
+    monkeypatch.chdir(tmp_path)
+    files = [str(write_assignment(tmp_path / name, "echo $NAME > out.txt")) for name in ("first", "second")]
+    files.append(str(write_assignment(tmp_path / "failing", "exit 3")))
+    results = prepare_many(files, {"NAME": "prepared"}, processes=2)
+    assert results[files[0]] is None
+    assert results[files[1]] is None
+    assert results[files[2]] is not None
+    assert (tmp_path / "first" / "out.txt").read_text() == "prepared\n"
+    assert (tmp_path / "second" / "out.txt").read_text() == "prepared\n"
+    assert os.getcwd() == str(tmp_path)
+
+
+def test_config_set_core(mocker: MockerFixture) -> None:
+    load = mocker.patch("prepare_assignment.utils.config.load_config")
+    config = _LazyConfig()
+    core = Core(max_workers=4)
+    config.set_core(core)
+    # The settings of the command line are used, the config file isn't loaded
+    assert config.core is core
+    load.assert_not_called()
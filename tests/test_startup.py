@@ -0,0 +1,49 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Final, Set, Tuple
+
+import pytest
+
+# Modules that are only needed when tasks are prepared or executed
+HEAVY_MODULES: Final[Set[str]] = {"git", "virtualenv", "jsonschema", "simpleeval", "multipledispatch", "ruamel",
+                                  "treelib", "prepare_toolbox"}
+
+# The heavy modules a command is not allowed to import. The import time itself is not checked, it depends too much
+# on the load of the machine and on whether the bytecode is cached.
+FORBIDDEN: Final[Dict[Tuple[str, ...], Set[str]]] = {
+    ("--help",): HEAVY_MODULES,
+    ("run", "--help"): HEAVY_MODULES,
+    ("task", "--help"): HEAVY_MODULES,
+    ("tasks", "--help"): HEAVY_MODULES,
+    ("tasks", "ls"): HEAVY_MODULES - {"treelib"},
+}
+
+IMPORT_TIME_RE: Final[re.Pattern] = re.compile(r"^import time:\s+\d+ \|\s+\d+ \| \s*(\S+)$")
+
+
+def __imported_modules(args: Tuple[str, ...], tmp_path: Path) -> Set[str]:
+    env = dict(os.environ)
+    env["XDG_CACHE_HOME"] = str(tmp_path / "cache")
+    env["XDG_CONFIG_HOME"] = str(tmp_path / "config")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-m", "prepare_assignment", *args],
+                            capture_output=True, text=True, env=env)
+    assert result.returncode == 0, result.stderr
+    imported: Set[str] = set()
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match:
+            imported.add(match.group(1).split(".")[0])
+    return imported
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="The tasks path is based on XDG_CACHE_HOME")
+@pytest.mark.parametrize("args", list(FORBIDDEN.keys()), ids=[" ".join(args) for args in FORBIDDEN.keys()])
+def test_startup_imports(args: Tuple[str, ...], tmp_path: Path) -> None:
+    imported = __imported_modules(args, tmp_path)
+    # Make sure the output was actually parsed
+    assert "prepare_assignment" in imported
+    forbidden = FORBIDDEN[args]
+    assert imported.isdisjoint(forbidden), f"'{' '.join(args)}' imports {sorted(imported & forbidden)}"
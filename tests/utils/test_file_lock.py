@@ -0,0 +1,64 @@
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from prepare_assignment.utils.file_lock import FileLock, lock_path
+
+
+def test_lock_path(tmp_path: Path) -> None:
+    assert lock_path(tmp_path, "task-org/name@v1").name == "task-org_name@v1.lock"
+
+
+def test_lock_excludes_threads(tmp_path: Path) -> None:
+    path = tmp_path / "locks" / "test.lock"
+    events: List[str] = []
+
+    def hold(name: str) -> None:
+        with FileLock(path):
+            events.append(f"{name} start")
+            time.sleep(0.1)
+            events.append(f"{name} end")
+
+    threads = [threading.Thread(target=hold, args=(str(i),)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The critical sections never overlap
+    for i in range(0, len(events), 2):
+        assert events[i].split()[0] == events[i + 1].split()[0]
+
+
+def test_lock_excludes_processes(tmp_path: Path) -> None:
+    path = tmp_path / "test.lock"
+    script = ("import sys, time\n"
+              "from prepare_assignment.utils.file_lock import FileLock\n"
+              "with FileLock(sys.argv[1]):\n"
+              "    print('locked', flush=True)\n"
+              "    time.sleep(0.3)\n")
+    process = subprocess.Popen([sys.executable, "-c", script, str(path)], stdout=subprocess.PIPE, text=True)
+    try:
+        assert process.stdout is not None and process.stdout.readline().strip() == "locked"
+        start = time.monotonic()
+        with FileLock(path):
+            assert time.monotonic() - start > 0.1
+    finally:
+        process.wait()
+
+
+def test_lock_released_when_process_is_killed(tmp_path: Path) -> None:
+    path = tmp_path / "test.lock"
+    script = ("import sys, time\n"
+              "from prepare_assignment.utils.file_lock import FileLock\n"
+              "FileLock(sys.argv[1]).acquire()\n"
+              "print('locked', flush=True)\n"
+              "time.sleep(60)\n")
+    process = subprocess.Popen([sys.executable, "-c", script, str(path)], stdout=subprocess.PIPE, text=True)
+    assert process.stdout is not None and process.stdout.readline().strip() == "locked"
+    process.kill()
+    process.wait()
+    with FileLock(path):
+        assert path.exists()
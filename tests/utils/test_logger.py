@@ -1,9 +1,11 @@
 import logging
+import threading
+from typing import List
 
 import pytest
 
 from prepare_assignment.data.constants import LOG_LEVEL_TRACE
-from prepare_assignment.utils.logger import ColourFormatter, add_logging_level, set_logger_level
+from prepare_assignment.utils.logger import ColourFormatter, JobLogBuffer, add_logging_level, set_logger_level
 
 
 def test_set_colour() -> None:
@@ -88,3 +90,52 @@ def test_colour_formatter(level: int, name: str, control: bool):
     contains_control = '\x1b[' in formatted
     control_correct = contains_control if control else not contains_control
     assert (contains_name and control_correct), "Colour formatter should format correctly"
+
+
+def test_job_log_buffer(caplog: pytest.LogCaptureFixture) -> None:
+    logger = logging.getLogger("test_job_log_buffer")
+    buffer = JobLogBuffer()
+    logger.addFilter(buffer)
+    records: List[logging.LogRecord] = []
+    with caplog.at_level(logging.INFO, logger="test_job_log_buffer"):
+        with buffer.capture(records):
+            logger.info("buffered")
+        logger.info("direct")
+        assert caplog.messages == ["direct"]
+        JobLogBuffer.flush(records)
+        assert caplog.messages == ["direct", "buffered"]
+    logger.removeFilter(buffer)
+
+
+def test_job_log_buffer_per_context(caplog: pytest.LogCaptureFixture) -> None:
+    logger = logging.getLogger("test_job_log_buffer_per_context")
+    buffer = JobLogBuffer()
+    logger.addFilter(buffer)
+    records: List[logging.LogRecord] = []
+    inner: List[logging.LogRecord] = []
+    capturing = threading.Event()
+    logged = threading.Event()
+
+    def capture() -> None:
+        with buffer.capture(records):
+            with buffer.capture(inner):
+                logger.info("inner")
+            capturing.set()
+            logged.wait()
+            logger.info("captured")
+
+    def log() -> None:
+        capturing.wait()
+        logger.info("other thread")
+        logged.set()
+
+    with caplog.at_level(logging.INFO, logger="test_job_log_buffer_per_context"):
+        threads = [threading.Thread(target=capture), threading.Thread(target=log)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert caplog.messages == ["other thread"]
+    assert [record.getMessage() for record in inner] == ["inner"]
+    assert [record.getMessage() for record in records] == ["captured"]
+    logger.removeFilter(buffer)
@@ -0,0 +1,56 @@
+from pathlib import Path
+from typing import Dict
+
+from prepare_assignment.utils.metrics import Metrics, write_metrics
+
+
+def __samples(path: Path) -> Dict[str, float]:
+    samples = {}
+    for line in path.read_text().splitlines():
+        if not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+    return samples
+
+
+def test_observe_spans() -> None:
+    metrics = Metrics()
+    metrics.observe_span("install task", "prepare", 2.0, {"task": "org/task@v1", "cache": "miss"})
+    metrics.observe_span("load task", "prepare", 0.01, {"task": "org/other@v1", "index": "hit"})
+    metrics.observe_span("pip install", "prepare", 1.5, {"exit code": 0})
+    metrics.observe_span("step", "run", 0.2, {"step": "echo", "run": "echo 'test'"})
+    metrics.observe_span("task process", "run", 0.1, {"task": "org/task@v1", "exit code": 1, "output lines": 12})
+    metrics.observe_span("job", "run", 0.3, {"job": "prepare", "failed": True})
+    samples = metrics.take_samples()
+    assert samples["prepare_task_installs"] == {'prepare_task_installs_total{task="org/task@v1"}': 1}
+    assert samples["prepare_task_cache_hits"] == {'prepare_task_cache_hits_total{task="org/other@v1"}': 1}
+    pip = samples["prepare_pip_install_duration_seconds"]
+    assert pip['prepare_pip_install_duration_seconds_bucket{le="1"}'] == 0
+    assert pip['prepare_pip_install_duration_seconds_bucket{le="2.5"}'] == 1
+    assert pip["prepare_pip_install_duration_seconds_sum"] == 1.5
+    assert samples["prepare_step_duration_seconds"]['prepare_step_duration_seconds_count{task="run"}'] == 1
+    assert samples["prepare_task_exits"] == {'prepare_task_exits_total{code="1",task="org/task@v1"}': 1}
+    assert samples["prepare_output_lines"] == {'prepare_output_lines_total{task="org/task@v1"}': 12}
+    assert samples["prepare_jobs"] == {'prepare_jobs_total{result="failure"}': 1}
+    # The samples are reset once they are taken
+    assert all(len(family) == 0 for family in metrics.take_samples().values())
+
+
+def test_write_metrics_cumulative(tmp_path: Path) -> None:
+    path = tmp_path / "prepare.prom"
+    metrics = Metrics()
+    for duration in (0.5, 3.0):
+        metrics.observe_span("prepare tasks", "prepare", duration, {})
+        metrics.inc("prepare_runs", {"result": "success"})
+        metrics.set("prepare_last_run_timestamp_seconds", duration)
+        write_metrics(metrics, path)
+    samples = __samples(path)
+    assert samples['prepare_runs_total{result="success"}'] == 2
+    assert samples["prepare_preparation_duration_seconds_count"] == 2
+    assert samples["prepare_preparation_duration_seconds_sum"] == 3.5
+    assert samples['prepare_preparation_duration_seconds_bucket{le="1"}'] == 1
+    # Gauges are replaced
+    assert samples["prepare_last_run_timestamp_seconds"] == 3
+    lines = path.read_text().splitlines()
+    assert "# TYPE prepare_runs counter" in lines
+    assert lines[-1] == "# EOF"
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+from typing import List
+
+import pytest
+
+from prepare_assignment.utils.run_control import RunControl, kill_process_group
+
+
+def test_cancel_kills_registered() -> None:
+    control = RunControl()
+    killed: List[str] = []
+    with control.register(lambda: killed.append("first")):
+        control.cancel()
+    assert control.cancelled
+    assert killed == ["first"]
+    # A process registered after the cancel is killed right away
+    with control.register(lambda: killed.append("second")):
+        pass
+    assert killed == ["first", "second"]
+
+
+def test_cancel_forgets_finished() -> None:
+    control = RunControl()
+    killed: List[str] = []
+    with control.register(lambda: killed.append("finished")):
+        pass
+    control.cancel()
+    assert killed == []
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="process groups are POSIX only")
+def test_kill_process_group() -> None:
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"], start_new_session=True)
+    kill_process_group(process.pid)
+    assert process.wait(timeout=10) != 0
+    # Killing a finished process is ignored
+    kill_process_group(process.pid)
@@ -0,0 +1,85 @@
+import json
+import os
+import time
+from pathlib import Path
+
+from prepare_assignment.utils.tag_cache import RemoteTags, TagCache, parse_tags
+
+RAW = (
+    "abc1230000000000000000000000000000000001\trefs/tags/v1.0.0\n"
+    "abc1230000000000000000000000000000000002\trefs/tags/v1.0.0^{}\n"
+    "abc1230000000000000000000000000000000003\trefs/tags/v10.0.0\n"
+    "abc1230000000000000000000000000000000004\trefs/tags/v1.2.0\n"
+    "abc1230000000000000000000000000000000005\trefs/tags/nightly"
+)
+
+
+def test_parse_tags() -> None:
+    assert parse_tags(RAW) == ["v1.0.0", "v10.0.0", "v1.2.0", "nightly"]
+
+
+def test_remote_tags_lookups() -> None:
+    tags = RemoteTags(parse_tags(RAW))
+    assert tags.latest() == "v10.0.0"
+    assert "nightly" in tags
+    assert "v2.0.0" not in tags
+    assert tags.highest_with_prefix("v1.") == "v1.2.0"
+    assert tags.highest_with_prefix("v3") is None
+    assert tags.highest_with_prefix("night") is None
+
+
+def test_remote_tags_no_versions() -> None:
+    tags = RemoteTags(["nightly", "beta"])
+    assert tags.latest() is None
+
+
+def test_cache_memoizes(tmp_path: Path) -> None:
+    calls = []
+    cache = TagCache(tmp_path)
+
+    def fetch() -> str:
+        calls.append(1)
+        return RAW
+
+    cache.get("url", fetch, 60)
+    cache.get("url", fetch, 60)
+    assert len(calls) == 1
+
+
+def test_cache_refresh(tmp_path: Path) -> None:
+    calls = []
+    cache = TagCache(tmp_path)
+
+    def fetch() -> str:
+        calls.append(1)
+        return RAW
+
+    TagCache(tmp_path).get("url", fetch, 60)
+    # A ttl of 0 (--refresh) ignores the persisted tags, but a run lists every remote only once
+    cache.get("url", fetch, 0)
+    cache.get("url", fetch, 0)
+    cache.get("other", fetch, 0)
+    cache.get("other", fetch, 0)
+    assert len(calls) == 3
+    cache.get("url", fetch, 60)
+    assert len(calls) == 3
+
+
+def test_cache_expired(tmp_path: Path) -> None:
+    calls = []
+
+    def fetch() -> str:
+        calls.append(1)
+        return RAW
+
+    TagCache(tmp_path).get("url", fetch, 60)
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    # Make the persisted tags older than the ttl
+    with open(os.path.join(tmp_path, files[0]), "r") as handle:
+        cached = json.load(handle)
+    cached["timestamp"] = time.time() - 120
+    with open(os.path.join(tmp_path, files[0]), "w") as handle:
+        json.dump(cached, handle)
+    TagCache(tmp_path).get("url", fetch, 60)
+    assert len(calls) == 2
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.file_lock import FileLock, lock_path
+from prepare_assignment.utils.task_gc import collect_garbage, last_used, mark_used, parse_age, parse_size, LAST_USED
+from prepare_assignment.utils.task_index import TaskIndex
+from prepare_assignment.utils.virtual_env import set_venv_key, VENV_COMPLETE
+
+DAY = 86400
+
+
+@pytest.mark.parametrize("size, expected", [("1024", 1024), ("2K", 2048), ("500MB", 500 * 1024 ** 2),
+                                            ("1.5GiB", int(1.5 * 1024 ** 3)), ("2 g", 2 * 1024 ** 3)])
+def test_parse_size(size: str, expected: int) -> None:
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize("age, expected", [("30", 30), ("45m", 45 * 60), ("12h", 12 * 3600), ("30d", 30 * DAY),
+                                           ("2w", 14 * DAY)])
+def test_parse_age(age: str, expected: float) -> None:
+    assert parse_age(age) == expected
+
+
+@pytest.mark.parametrize("value", ["", "2X", "-1G", "G"])
+def test_parse_invalid(value: str) -> None:
+    with pytest.raises(ValueError):
+        parse_size(value)
+    with pytest.raises(ValueError):
+        parse_age(value)
+
+
+def __install(name: str, age: float, size: int, venv: str) -> TaskProperties:
+    props = TaskProperties.of(name)
+    props.repo_path.mkdir(parents=True)
+    (props.repo_path / "data").write_bytes(b"x" * size)
+    set_venv_key(props.task_path, venv)
+    marker = Path(os.path.join(props.task_path, LAST_USED))
+    marker.touch()
+    used = time.time() - age
+    os.utime(marker, (used, used))
+    return props
+
+
+def __venv(cache: Path, key: str, age: float) -> None:
+    os.makedirs(cache / "venvs" / key)
+    marker = cache / "venvs" / key / VENV_COMPLETE
+    marker.touch()
+    used = time.time() - age
+    os.utime(marker, (used, used))
+
+
+@pytest.fixture
+def cache(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch("prepare_assignment.data.task_properties.tasks_path", str(tmp_path / "tasks"))
+    mocker.patch("prepare_assignment.utils.task_gc.get_cache_path", return_value=tmp_path)
+    mocker.patch("prepare_assignment.utils.task_gc.get_venvs_path", return_value=tmp_path / "venvs")
+    mocker.patch("prepare_assignment.utils.task_gc.get_mirrors_path", return_value=tmp_path / "mirrors")
+    mocker.patch("prepare_assignment.utils.task_gc.get_task_index", return_value=TaskIndex(tmp_path / "index.json"))
+    for venv in ("shared", "own", "unused", "template-cpython"):
+        __venv(tmp_path, venv, DAY)
+    return tmp_path
+
+
+def __store(mocker: MockerFixture, tasks: List[TaskProperties],
+            dependents: Dict[TaskProperties, List[TaskProperties]]) -> None:
+    mocker.patch("prepare_assignment.utils.task_gc.get_all_tasks", return_value=tasks)
+    mocker.patch("prepare_assignment.utils.task_gc.get_dependents", return_value=dependents)
+
+
+def test_collect_least_recently_used(mocker: MockerFixture, cache: Path) -> None:
+    old = __install("old", 10 * DAY, 4096, "own")
+    recent = __install("recent", DAY, 4096, "shared")
+    newest = __install("newest", 0, 4096, "shared")
+    __store(mocker, [old, recent, newest], {})
+    os.makedirs(cache / "mirrors" / "prepare-assignment" / "old.git")
+    result = collect_garbage(max_size=10000)
+    assert result.tasks == [old]
+    assert result.freed >= 4096
+    assert not os.path.exists(old.task_path)
+    assert not os.path.exists(cache / "mirrors" / "prepare-assignment" / "old.git")
+    # Virtual environments that are not used anymore are removed, the templates are kept
+    assert sorted(os.listdir(cache / "venvs")) == ["shared", "template-cpython"]
+    assert os.path.isdir(recent.task_path) and os.path.isdir(newest.task_path)
+
+
+def test_collect_max_age(mocker: MockerFixture, cache: Path) -> None:
+    old = __install("old", 10 * DAY, 10, "own")
+    recent = __install("recent", DAY, 10, "shared")
+    __store(mocker, [old, recent], {})
+    assert collect_garbage(max_age=5 * DAY).tasks == [old]
+
+
+def test_collect_keeps_dependencies(mocker: MockerFixture, cache: Path) -> None:
+    sub = __install("sub", 10 * DAY, 10, "shared")
+    composite = __install("composite", 5 * DAY, 10, "own")
+    kept = __install("kept", 20 * DAY, 10, "shared")
+    __store(mocker, [sub, composite, kept], {sub: [composite]})
+    # The sub task can only be removed after the composite task that uses it
+    assert collect_garbage(max_age=DAY, keep=[kept]).tasks == [composite, sub]
+    assert os.path.isdir(kept.task_path)
+
+
+def test_collect_used_by_composite(mocker: MockerFixture, cache: Path) -> None:
+    sub = __install("sub", 10 * DAY, 10, "shared")
+    composite = __install("composite", 0, 10, "own")
+    __store(mocker, [sub, composite], {sub: [composite]})
+    assert collect_garbage(max_age=DAY).tasks == []
+
+
+def test_collect_grace_period(mocker: MockerFixture, cache: Path) -> None:
+    # Installed (or used) by another process while the cache is collected
+    new = __install("new", 0, 4096, "own")
+    __venv(cache, "fresh", 0)
+    __store(mocker, [new], {})
+    assert collect_garbage(max_size=0).tasks == []
+    assert os.path.isdir(new.task_path)
+    assert sorted(os.listdir(cache / "venvs")) == ["fresh", "own", "template-cpython"]
+
+
+def test_collect_keeps_staged(mocker: MockerFixture, cache: Path) -> None:
+    old = __install("old", 10 * DAY, 10, "own")
+    __store(mocker, [old], {})
+    os.makedirs(cache / "mirrors" / "prepare-assignment" / "old.git")
+    # Another version of the task is being installed, with the virtualenv that is not used yet
+    staging = cache / "staging" / "prepare-assignment" / "old" / "v2"
+    staging.mkdir(parents=True)
+    set_venv_key(staging, "unused")
+    assert collect_garbage(max_age=DAY).tasks == [old]
+    assert sorted(os.listdir(cache / "venvs")) == ["template-cpython", "unused"]
+    assert os.path.isdir(cache / "mirrors" / "prepare-assignment" / "old.git")
+
+
+def test_collect_waits_for_lock(mocker: MockerFixture, cache: Path) -> None:
+    old = __install("old", 10 * DAY, 10, "own")
+    __store(mocker, [old], {})
+    lock = FileLock(lock_path(cache / "locks", f"task-{old}"))
+    results = []
+    with lock:
+        thread = threading.Thread(target=lambda: results.append(collect_garbage(max_age=DAY)))
+        thread.start()
+        thread.join(0.2)
+        # The task is being installed or updated by another process
+        assert thread.is_alive()
+        assert os.path.isdir(old.task_path)
+    thread.join()
+    assert results[0].tasks == [old]
+    assert not os.path.exists(old.task_path)
+
+
+def test_mark_used(mocker: MockerFixture, cache: Path) -> None:
+    mocker.patch("prepare_assignment.utils.task_gc._marked", set())
+    props = __install("task", 10 * DAY, 10, "own")
+    mark_used(props)
+    assert time.time() - last_used(props) < DAY
+    os.remove(os.path.join(props.task_path, LAST_USED))
+    # The marker is only updated once per process
+    mark_used(props)
+    assert not os.path.exists(os.path.join(props.task_path, LAST_USED))
@@ -0,0 +1,91 @@
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from prepare_assignment.data.task_definition import TaskDefinition, CompositeTaskDefinition, PythonTaskDefinition
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.task_graph import resolve_dependency_graph, resolve_task_graph, get_sub_tasks
+
+
+def __definition(name: str, uses: List[str]) -> TaskDefinition:
+    if len(uses) == 0:
+        return PythonTaskDefinition(id=name, name=name, description=name, inputs=[], outputs={}, path=Path(name),
+                                    main="main.py")
+    tasks = [{"name": f"use {sub}", "uses": sub} for sub in uses] + [{"name": "run", "run": "echo"}]
+    return CompositeTaskDefinition(id=name, name=name, description=name, inputs=[], outputs={}, path=Path(name),
+                                   tasks=tasks)
+
+
+def __loader(definitions: Dict[str, List[str]], loads: Counter):
+    def load(props: TaskProperties) -> TaskDefinition:
+        loads[props.name] += 1
+        return __definition(props.name, definitions[props.name])
+    return load
+
+
+def test_sub_tasks_without_duplicates() -> None:
+    task = __definition("top", ["a", "b", "prepare-assignment/a@latest"])
+    assert get_sub_tasks(task) == [TaskProperties.of("a"), TaskProperties.of("b")]
+
+
+def test_diamond_loaded_once() -> None:
+    definitions = {"top": ["left", "right"], "left": ["bottom"], "right": ["bottom"], "bottom": []}
+    loads: Counter = Counter()
+    graph = resolve_task_graph([TaskProperties.of("top")], __loader(definitions, loads))
+    assert len(graph.tasks) == 4
+    assert all(count == 1 for count in loads.values())
+    order = [props.name for props in graph.topological_order()]
+    assert order.index("bottom") < order.index("left") < order.index("top")
+    assert order.index("right") < order.index("top")
+
+
+def test_deep_chain_does_not_recurse() -> None:
+    depth = 5000
+    definitions = {f"task{i}": [f"task{i + 1}"] for i in range(depth)}
+    definitions[f"task{depth}"] = []
+    loads: Counter = Counter()
+    graph = resolve_task_graph([TaskProperties.of("task0")], __loader(definitions, loads))
+    assert len(graph.tasks) == depth + 1
+    assert len(graph.reachable([TaskProperties.of("task10")])) == depth - 9
+
+
+def test_skip() -> None:
+    definitions = {"top": ["left", "right"], "left": [], "right": []}
+    loads: Counter = Counter()
+    graph = resolve_task_graph([TaskProperties.of("top")], __loader(definitions, loads),
+                               skip=lambda props: props.name == "left")
+    assert "left" not in loads
+    assert TaskProperties.of("left") not in graph.tasks
+
+
+def test_dependents() -> None:
+    definitions = {"top": ["left", "right"], "left": ["bottom"], "right": ["bottom"], "bottom": []}
+    graph = resolve_task_graph([TaskProperties.of("top")], __loader(definitions, Counter()))
+    dependents = graph.dependents()
+    assert sorted(props.name for props in dependents[TaskProperties.of("bottom")]) == ["left", "right"]
+    assert dependents[TaskProperties.of("top")] == []
+
+
+def test_cycle() -> None:
+    definitions = {"a": ["b"], "b": ["a"]}
+    graph = resolve_task_graph([TaskProperties.of("a")], __loader(definitions, Counter()))
+    with pytest.raises(AssertionError):
+        graph.topological_order()
+
+
+def test_dependency_graph_without_definitions() -> None:
+    definitions = {"top": ["left", "right"], "left": ["bottom"], "right": ["bottom"], "bottom": []}
+    requested: Counter = Counter()
+
+    def get_dependencies(props: TaskProperties) -> List[TaskProperties]:
+        requested[props.name] += 1
+        return [TaskProperties.of(name) for name in definitions[props.name]]
+
+    graph = resolve_dependency_graph([TaskProperties.of("top")], get_dependencies)
+    assert len(graph.tasks) == 0
+    assert all(count == 1 for count in requested.values())
+    order = [props.name for props in graph.topological_order()]
+    assert order[0] == "bottom" and order[-1] == "top"
+    assert graph.dependents()[TaskProperties.of("bottom")] == [TaskProperties.of("left"), TaskProperties.of("right")]
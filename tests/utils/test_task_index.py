@@ -0,0 +1,135 @@
+import json
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from prepare_assignment.data.task_definition import CompositeTaskDefinition, PythonTaskDefinition, ValidableTask
+from prepare_assignment.data.task_properties import TaskProperties
+from prepare_assignment.utils.task_index import TaskIndex, schema_path
+
+
+@pytest.fixture
+def props(mocker: MockerFixture, tmp_path: Path) -> TaskProperties:
+    mocker.patch("prepare_assignment.data.task_properties.tasks_path", str(tmp_path))
+    props = TaskProperties.of("task")
+    props.repo_path.mkdir(parents=True)
+    props.definition_path.write_text("id: task")
+    schema_path(props).write_text("{}")
+    return props
+
+
+def __task(props: TaskProperties) -> ValidableTask:
+    task = PythonTaskDefinition(id="task", name="task", description="task", inputs=[], outputs={},
+                                path=props.task_path, main="main.py")
+    return {"schema": {"type": "object"}, "task": task}
+
+
+def __composite(props: TaskProperties, uses: List[str]) -> ValidableTask:
+    props.repo_path.mkdir(parents=True, exist_ok=True)
+    props.definition_path.write_text(f"id: {props.name}")
+    schema_path(props).write_text("{}")
+    task = CompositeTaskDefinition(id=props.name, name=props.name, description=props.name, inputs=[], outputs={},
+                                   path=props.task_path, tasks=[{"name": use, "uses": use} for use in uses])
+    return {"schema": {"type": "object"}, "task": task}
+
+
+def test_get_put(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    assert index.get(props) is None
+    index.put(props, __task(props))
+    indexed = index.get(props)
+    assert indexed == __task(props)
+    # Every get returns a new copy, so changes don't end up in the index
+    assert indexed is not None and indexed["task"] is not index.get(props)["task"]  # type: ignore
+
+
+def test_changed_files_invalidate(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    index.put(props, __task(props))
+    schema_path(props).write_text('{"type": "object"}')
+    assert index.get(props) is None
+
+
+def test_persisted(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    index.set_tasks([])
+    index.put(props, __task(props))
+    index.save()
+    loaded = TaskIndex(tmp_path / "index.json")
+    assert loaded.get(props) == __task(props)
+    assert loaded.tasks() == [props]
+    loaded.remove(props)
+    loaded.save()
+    assert TaskIndex(tmp_path / "index.json").tasks() == []
+
+
+def test_concurrent_change_forgets_tasks(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    other = TaskIndex(tmp_path / "index.json")
+    index.set_tasks([props])
+    assert other.tasks() is None
+    index.save()
+    other.set_tasks([])
+    other.save()
+    # The other process doesn't know which tasks have been installed in the meantime
+    assert TaskIndex(tmp_path / "index.json").tasks() is None
+
+
+def test_corrupt_index(props: TaskProperties, tmp_path: Path) -> None:
+    (tmp_path / "index.json").write_bytes(b"corrupt")
+    index = TaskIndex(tmp_path / "index.json")
+    assert index.get(props) is None
+    assert index.tasks() is None
+    assert os.path.isfile(tmp_path / "index.json")
+
+
+def test_dependents(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    index.set_tasks([props])
+    index.put(props, __task(props))
+    first = TaskProperties.of("first")
+    second = TaskProperties.of("second")
+    index.put(first, __composite(first, ["task"]))
+    index.put(second, __composite(second, ["task", "first"]))
+    index.save()
+
+    loaded = TaskIndex(tmp_path / "index.json")
+    assert loaded.dependencies(second) == [props, first]
+    dependents = loaded.dependents()
+    assert dependents is not None
+    assert sorted(map(str, dependents[props])) == [str(first), str(second)]
+    assert dependents[first] == [second]
+
+    loaded.remove(second)
+    assert loaded.dependents() == {props: [first]}
+    # A task that uses nothing anymore is no longer a dependent
+    loaded.put(first, __composite(first, []))
+    assert loaded.dependents() == {}
+
+
+def test_dependents_unknown(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    index.put(props, __task(props))
+    # Not all installed tasks are known
+    assert index.dependents() is None
+    index.set_tasks([props])
+    assert index.dependents() == {}
+    props.definition_path.write_text("id: changed")
+    assert index.dependencies(props) is None
+    assert index.dependents() is None
+
+
+def test_persisted_as_json(props: TaskProperties, tmp_path: Path) -> None:
+    index = TaskIndex(tmp_path / "index.json")
+    composite = TaskProperties.of("composite")
+    index.put(props, __task(props))
+    index.put(composite, __composite(composite, ["task"]))
+    index.save()
+    with open(tmp_path / "index.json", "r") as handle:
+        assert json.load(handle)["tasks"] is None
+    loaded = TaskIndex(tmp_path / "index.json")
+    assert loaded.get(props) == __task(props)
+    assert loaded.get(composite) == __composite(composite, ["task"])
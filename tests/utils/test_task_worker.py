@@ -0,0 +1,104 @@
+import os
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from prepare_assignment.utils.task_worker import get_workers_path, run_in_worker, workers_supported, \
+    worker_socket_path
+
+pytestmark = pytest.mark.skipif(not workers_supported(), reason="workers need fork and unix sockets")
+
+MAIN = """import os
+import sys
+
+print(os.environ["PREPARE_INPUT"])
+print(os.getcwd())
+print(os.getppid())
+sys.stdout.write("no newline")
+sys.exit(int(os.environ.get("PREPARE_CODE", "0")))
+"""
+
+
+@pytest.fixture
+def main(mocker: MockerFixture, tmp_path: Path) -> Path:
+    mocker.patch("prepare_assignment.utils.task_worker.get_workers_path", return_value=str(tmp_path / "workers"))
+    mocker.patch("prepare_assignment.utils.task_worker.WORKER_IDLE_TIMEOUT", 5)
+    path = tmp_path / "main.py"
+    path.write_text(MAIN)
+    return path
+
+
+def __lines(chunks: List[bytes]) -> List[str]:
+    return b"".join(chunks).decode("utf-8").splitlines(keepends=True)
+
+
+def test_run_in_worker(main: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    chunks: List[bytes] = []
+    env = {"PREPARE_INPUT": "hello", "PREPARE_CODE": "3"}
+    assert run_in_worker(sys.executable, str(main), env, chunks.append) == 3
+    lines = __lines(chunks)
+    assert lines[0] == "hello\n"
+    assert lines[1] == f"{tmp_path}\n"
+    assert lines[3] == "no newline"
+    assert len(lines) == 4
+    # The second run is forked from the same worker
+    second: List[bytes] = []
+    assert run_in_worker(sys.executable, str(main), {"PREPARE_INPUT": "again"}, second.append) == 0
+    assert __lines(second)[0] == "again\n"
+    assert __lines(second)[2] == lines[2]
+
+
+def test_run_in_worker_exception(main: Path) -> None:
+    main.write_text("raise ValueError('broken')\n")
+    chunks: List[bytes] = []
+    assert run_in_worker(sys.executable, str(main), {}, chunks.append) == 1
+    assert b"ValueError: broken" in b"".join(chunks)
+
+
+def test_run_in_worker_long_line(main: Path) -> None:
+    main.write_text("import sys\nsys.stdout.write('x' * 1000000 + '\\n')\n")
+    chunks: List[bytes] = []
+    assert run_in_worker(sys.executable, str(main), {}, chunks.append) == 0
+    # The line is passed on in chunks, instead of being read as a single line
+    assert len(chunks) > 1
+    assert max(len(chunk) for chunk in chunks) <= 2 * 64 * 1024
+    assert b"".join(chunks) == b"x" * 1000000 + b"\n"
+
+
+def test_worker_socket_path_changes(main: Path, tmp_path: Path) -> None:
+    path = worker_socket_path(sys.executable, str(main))
+    assert os.path.dirname(path) == str(tmp_path / "workers")
+    # Only the directory of the workers adds to the length of the path, unix socket paths are limited
+    assert len(os.path.basename(path)) < 30
+    os.utime(main, ns=(0, 0))
+    assert worker_socket_path(sys.executable, str(main)) != path
+
+
+def test_run_in_worker_not_started(mocker: MockerFixture, main: Path) -> None:
+    mocker.patch("prepare_assignment.utils.task_worker.SERVER_PATH", str(main.parent / "missing.py"))
+    assert run_in_worker(sys.executable, str(main), {}, lambda line: None) is None
+
+
+@pytest.mark.parametrize("shared", ["permissions", "symlink"])
+def test_run_in_worker_shared_directory(main: Path, tmp_path: Path, shared: str) -> None:
+    workers = tmp_path / "workers"
+    if shared == "permissions":
+        workers.mkdir(mode=0o755)
+        workers.chmod(0o755)
+    else:
+        (tmp_path / "other").mkdir(mode=0o700)
+        workers.symlink_to(tmp_path / "other")
+    # The task runs without a worker instead of sending its environment to a socket someone else might listen on
+    assert run_in_worker(sys.executable, str(main), {"PREPARE_INPUT": "secret"}, lambda line: None) is None
+    assert os.listdir(tmp_path / "other" if shared == "symlink" else workers) == []
+
+
+def test_get_workers_path(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert get_workers_path() == "/run/user/1000/prepare-assignment"
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert get_workers_path().endswith(f"prepare-assignment-{os.getuid()}")
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from prepare_assignment.utils.tracing import add_events, span, take_events, write_trace
+
+
+@pytest.fixture
+def tracing(mocker: MockerFixture) -> None:
+    mocker.patch("prepare_assignment.utils.tracing._enabled", True)
+    mocker.patch("prepare_assignment.utils.tracing._events", [])
+    mocker.patch("prepare_assignment.utils.tracing._named", set())
+
+
+def test_span_disabled(mocker: MockerFixture) -> None:
+    mocker.patch("prepare_assignment.utils.tracing._enabled", False)
+    mocker.patch("prepare_assignment.utils.tracing._events", [])
+    with span("clone", "prepare", task="task") as attributes:
+        attributes["cache"] = "miss"
+    assert take_events() == []
+
+
+def test_span(tracing: None) -> None:
+    with span("clone", "prepare", task="task", path=Path("repo")) as attributes:
+        attributes["cache"] = "miss"
+    events = take_events()
+    assert [event["ph"] for event in events] == ["M", "X"]
+    event = events[1]
+    assert event["name"] == "clone" and event["cat"] == "prepare"
+    assert event["dur"] >= 0
+    # Attributes that cannot be serialized are converted to strings
+    assert event["args"] == {"task": "task", "path": "repo", "cache": "miss"}
+    assert take_events() == []
+
+
+def test_span_error(tracing: None) -> None:
+    with pytest.raises(ValueError):
+        with span("pip install", "prepare"):
+            raise ValueError("failed")
+    assert take_events()[-1]["args"] == {"error": "ValueError"}
+
+
+def test_write_trace(tracing: None, tmp_path: Path) -> None:
+    with span("job", "run", job="test"):
+        with span("step", "run", step="first"):
+            pass
+    add_events([{"name": "step", "cat": "run", "ph": "X", "ts": 0, "dur": 1, "pid": 1, "tid": 1, "args": {}}])
+    write_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json", "r") as handle:
+        trace = json.load(handle)
+    assert [event["name"] for event in trace["traceEvents"] if event["ph"] == "X"] == ["step", "job", "step"]
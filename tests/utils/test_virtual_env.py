@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+from virtualenv import cli_run  # type: ignore
+
+from prepare_assignment.utils.virtual_env import get_task_venv, set_venv_key, get_venv_key, clone_venv, \
+    get_python_executable, relocate_venv
+
+
+def test_task_venv_legacy(tmp_path: Path) -> None:
+    assert get_task_venv(tmp_path) == os.path.join(tmp_path, "venv")
+
+
+def test_task_venv_from_pool(mocker: MockerFixture, tmp_path: Path) -> None:
+    mocker.patch("prepare_assignment.utils.virtual_env.get_venvs_path", return_value=Path("pool"))
+    set_venv_key(tmp_path, "cpython-3.11.0-abc")
+    assert get_venv_key(tmp_path) == "cpython-3.11.0-abc"
+    assert get_task_venv(tmp_path) == os.path.join("pool", "cpython-3.11.0-abc")
+
+
+def test_relocate_venv_does_not_change_hardlinks(tmp_path: Path) -> None:
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    (old / "bin").mkdir(parents=True)
+    (new / "bin").mkdir(parents=True)
+    script = old / "bin" / "tool"
+    script.write_text(f"#!{old}/bin/python\n")
+    script.chmod(0o755)
+    os.link(script, new / "bin" / "tool")
+    relocate_venv(new, old)
+    assert (new / "bin" / "tool").read_text() == f"#!{new}/bin/python\n"
+    assert script.read_text() == f"#!{old}/bin/python\n"
+    assert os.access(new / "bin" / "tool", os.X_OK)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Cloning is not supported on Windows")
+def test_clone_venv(tmp_path: Path) -> None:
+    template = tmp_path / "template"
+    clone = tmp_path / "clone"
+    cli_run([str(template)])
+    clone_venv(template, clone)
+    result = subprocess.run([get_python_executable(clone), "-c", "import sys; print(sys.prefix)"],
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == str(clone)
+    assert str(template) not in (clone / "bin" / "pip").read_text()